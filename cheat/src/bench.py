@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+'''Times copy detection on synthetic cohorts: the pair-by-pair
+comparison dumbcopiers used to do against fingerprinting and
+find_copies, checking that
+they come up with the same copies. Optionally, times find_similar on the
+same cohorts, for near-copies.
+Cohorts are made of distinct programs of about the given size, a few
+students copying off a few others, with or without a small change, and
+some not answering ('-').
+'''
+
+import random
+import time
+from cheat import dumbcopiers
+
+
+def pair_loop(progs):
+    '''
+    The copies as dumbcopiers used to find them, comparing all pairs.
+    '''
+    studs = sorted(progs)
+    known = set()
+    groups = []
+    for i, stud in enumerate(studs):
+        if progs[stud] == '-': continue
+        copiers = []
+        for other in studs[i + 1:]:
+            if progs[stud] == progs[other] and other not in known:
+                copiers.append(other)
+                known.add(other)
+                known.add(stud)
+        if copiers:
+            groups.append([stud] + copiers)
+    return groups
+
+def cohort(students, size, seed):
+    '''
+    Cleaned programs by student: all of them start alike, as answers to
+    the same question do, and 1 in 20 is copied, 1 in 30 with a change,
+    1 in 50 is missing.
+    '''
+    rnd = random.Random(seed)
+    preamble = 'publicstaticintanswer(int[]xxx){' * (size // 64)
+    progs = {}
+    for i in range(students):
+        stud = 'stud%05d' % i
+        roll = rnd.random()
+        if roll < 0.02:
+            progs[stud] = '-'
+        elif roll < 0.07 and progs:
+            progs[stud] = progs[rnd.choice(list(progs))]
+        elif roll < 0.10 and progs:
+            copied = progs[rnd.choice(list(progs))]
+            at = rnd.randrange(len(copied) + 1)
+            progs[stud] = copied[:at] + 'xxx=xxx+1;' + copied[at:]
+        else:
+            progs[stud] = preamble + ''.join(
+                rnd.choice('xxx+-*/=;(){}0123456789')
+                for _ in range(size - len(preamble)))
+    return progs
+
+def bench(find, progs):
+    start = time.perf_counter()
+    groups = find(progs)
+    return groups, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    parser = OptionParser()
+    parser.add_option('-n', '--students', type='int',
+            dest='students', default=10000,
+            help='students per cohort (default 10000)')
+    parser.add_option('-s', '--size', type='int',
+            dest='size', default=400,
+            help='characters per cleaned program (default 400)')
+    parser.add_option('-c', '--cohorts', type='int',
+            dest='cohorts', default=3,
+            help='cohorts to time (default 3)')
+    parser.add_option('--no-pairs', action='store_false',
+            dest='pairs', default=True,
+            help="don't time the pair loop, which takes a while")
+    parser.add_option('-t', '--threshold', type='float',
+            dest='threshold', default=None,
+            help='also time near-copy detection at this similarity')
+    (options, args) = parser.parse_args()
+    for seed in range(options.cohorts):
+        progs = cohort(options.students, options.size, seed)
+        groups, digest_time = bench(
+                lambda progs: dumbcopiers.find_copies(
+                    {stud: dumbcopiers.fingerprint(prog)
+                     for stud, prog in progs.items()}),
+                progs)
+        line = 'cohort {}: {} students, {} copy groups, digests {:.3f}s'.format(
+                seed, len(progs), len(groups), digest_time)
+        if options.pairs:
+            expected, pair_time = bench(pair_loop, progs)
+            assert groups == expected, 'copies differ'
+            line += ', pairs {:.3f}s'.format(pair_time)
+        if options.threshold:
+            sets = {stud: dumbcopiers.shingles(dumbcopiers.TOKEN.findall(prog))
+                    for stud, prog in progs.items() if prog != '-'}
+            groups, similar_time = bench(
+                    lambda sets: dumbcopiers.find_similar(sets, options.threshold),
+                    sets)
+            line += ', {} near-copy groups {:.3f}s'.format(len(groups),
+                                                          similar_time)
+        print(line)
@@ -1,5 +1,8 @@
 EXACT_COPIES_ONLY = False
 IGNORE_IDENTIFIERS = True  # If true, all non-keyword identifiers are replaced by '###'
+SHINGLE_SIZE = 5  # Tokens per shingle when looking for near-copies
+MINHASH_PERMUTATIONS = 64  # Length of the MinHash signatures
+LSH_BANDS = 16  # Signatures are split into this many bands for bucketing
 
 # Remaining constants are not intended to be user-configured.
 
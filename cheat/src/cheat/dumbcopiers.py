@@ -12,20 +12,50 @@ import csv
    are removed. Also, if IGNORE_IDENTIFIERS is True, all non-keyword
    identifiers (roughly) are replaced by 'xxx' before comparison.
 
+   With a similarity threshold, near-copies are flagged too: programs
+   whose token shingles have a Jaccard similarity at least that high.
+   Candidates are found with MinHash signatures bucketed by
+   locality-sensitive hashing, so that not all pairs need comparing.
+
+   With all_questions, every response column is checked, in a single pass
+   over the CSV file. Only a fingerprint of each response is kept in
+   memory (a digest, and its shingles for near-copies), not the code.
+
+   Submissions are written out to a directory per question, or to a zip
+   or tar archive per question; directories can be written incrementally.
+
+   With a fingerprint store, submissions are also checked against those
+   of past years, and then added to it.
+
    @author: Richard Lobb, 22 August 2014.
    @author: Peter Sander (usability mods)
 '''
 
+from array import array
 from collections import defaultdict
-import os
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import hashlib
 from . import EXACT_COPIES_ONLY
 from . import IGNORE_IDENTIFIERS
+from . import SHINGLE_SIZE
+from . import MINHASH_PERMUTATIONS
+from . import LSH_BANDS
 from . import LANGUAGE_EXTENSIONS
 from . import ONE_LINE_COMMENTS
 from . import MULTI_LINE_COMMENTS
 from . import KEYWORDS
 from . import HEADERS_LANG
+from . import minhash
+from .dumps import open_dump
+from .store import FingerprintStore
 
+TOKEN = re.compile('[A-Za-z_][A-Za-z0-9_]*|[0-9]+|[^ \t\n]')
+# deleting the whitespace characters collapses all the runs of them, faster
+# than any regex
+WHITESPACE = str.maketrans('', '', ' \t\n')
+# responses read before they are normalised, all together
+CHUNK = 4096
 
 def setup(optionals):
     language = optionals['code_language']
@@ -40,58 +70,195 @@ def setup(optionals):
 
 
 #================ Now we begin ===================
+class Normaliser:
+    '''
+    Turns responses into fingerprints, with the patterns of the language
+    compiled once and for all. Picklable, for process pools.
+    '''
+
+    def __init__(self, optionals, language_stuff=None):
+        language_stuff = language_stuff or setup(optionals)
+        self.exact_copies_only = optionals['exact_copies_only']
+        self.replace_identifiers = optionals['replace_identifiers']
+        self.similarity = optionals.get('similarity')
+        self.one_line_comment = re.compile(language_stuff['ONE_LINE_COMMENT'])
+        self.multi_line_comment = re.compile(language_stuff['MULTI_LINE_COMMENT'],
+                                             flags=re.DOTALL)
+        self.identifier = re.compile(language_stuff['IDENTIFIER'])
+
+    def strip(self, s):
+        '''
+        Delete comments from s, and replace identifiers with 'xxx' if
+        need be.
+        '''
+        if not self.exact_copies_only:
+            s = self.one_line_comment.sub('', s)
+            s = self.multi_line_comment.sub('', s)
+            if self.replace_identifiers:
+                s = self.identifier.sub('xxx', s)
+        return s
+
+    def clean(self, s):
+        '''
+        Delete comments and blanklines from s.
+        Replace all identifiers with 'xxx', collapse all
+        whitespace.
+        '''
+        if not self.exact_copies_only:
+            s = self.strip(s).translate(WHITESPACE)
+        return s
+
+    def tokens(self, s):
+        '''
+        Split s into tokens, with comments and identifiers dealt with as
+        clean() does.
+        '''
+        return TOKEN.findall(self.strip(s))
+
+    def normalise(self, raw_code):
+        '''
+        The fingerprint of a response: the digest of the cleaned code, and
+        for near-copies its shingles, sorted, as an array (a fraction of the
+        size of a set), or else None. Both None for no answer.
+        '''
+        code = self.clean(raw_code)
+        if not self.similarity or code == '-':
+            return fingerprint(code), None
+        return fingerprint(code), array('Q', sorted(shingles(self.tokens(raw_code))))
+
 def clean(s, language_stuff, optionals):
     '''
     Delete comments and blanklines from s.
     Replace all identifiers with 'xxx', collapse all
     whitespace.
+    As Normaliser.clean, for a one-off.
     '''
-    if not optionals['exact_copies_only']:
-        s = re.sub(language_stuff['ONE_LINE_COMMENT'], '', s)
-        s = re.sub(language_stuff['MULTI_LINE_COMMENT'], '', s, flags=re.DOTALL)
-        if optionals['replace_identifiers']:
-            s = re.sub(language_stuff['IDENTIFIER'], 'xxx', s)
-        s = re.sub('[ \t\n]+', '', s, flags=re.DOTALL)
-    return s
+    return Normaliser(optionals, language_stuff).clean(s)
 
-def main(optionals):
-    language_stuff = setup(optionals)
-    input_file = optionals['input_file']
-    output_dir = '%s/SubmissionsQ%s' % (optionals['output_dir'], optionals['question'])
-    headers = HEADERS_LANG[optionals['moodle_language']]
-    first_name = headers['first_name']
-    surname = headers['surname']
-    response = headers['response'] + ' ' + optionals['question']
-    email_address = headers['email']
-    f = open(input_file, encoding='utf-8-sig')
-    print("COPIES: File '{}', Question {}\n".
-            format(input_file, optionals['question']))
-    rdr = csv.DictReader(f)
-    names = {}
-    progs = {}
-    if not os.path.isdir(output_dir):
-        os.mkdir(output_dir)
-    for row in rdr:
-        stud = row[email_address].split('@')[0]
-        names[stud] = row[first_name] + ' ' + row[surname]
-        raw_code = row[response]
-        open(output_dir + '/' + stud + language_stuff['LANGUAGE_EXT'], 'w').write(raw_code)
-        code = clean(raw_code, language_stuff, optionals)
-        progs[stud] = code
-
-    studs = list(progs)
-    studs.sort()
+def normalise_many(normaliser, raw_codes, executor=None, chunksize=256):
+    '''
+    The fingerprints of the responses, in order, spread over the processes
+    of the executor in chunks if there is one.
+    '''
+    if executor is None:
+        return [normaliser.normalise(raw_code) for raw_code in raw_codes]
+    return list(executor.map(normaliser.normalise, raw_codes,
+                             chunksize=chunksize))
+
+def fingerprint(code):
+    '''
+    The digest of a cleaned program, None for no answer ('-').
+    '''
+    if code == '-':
+        return None
+    return hashlib.blake2b(code.encode('utf-8'), digest_size=16).digest()
+
+def find_copies(fingerprints):
+    '''
+    Group students whose cleaned programs are identical, going by their
+    fingerprints, in one pass rather than comparing all pairs.
+    Returns the groups of two or more, each sorted, in order of their first
+    student. No answer is never a copy.
+    '''
+    groups = defaultdict(list)
+    for stud in sorted(fingerprints):
+        if fingerprints[stud] is not None:
+            groups[fingerprints[stud]].append(stud)
+    return sorted((studs for studs in groups.values() if len(studs) > 1),
+                  key=lambda studs: studs[0])
+
+def shingles(toks, k=SHINGLE_SIZE):
+    '''
+    The set of (hashes of) the runs of k consecutive tokens - just the one
+    run for programs shorter than that.
+    '''
+    runs = (' '.join(toks[i:i + k]) for i in range(max(len(toks) - k, 0) + 1))
+    return {int.from_bytes(hashlib.blake2b(run.encode('utf-8'),
+                                           digest_size=8).digest(), 'big')
+            for run in runs if run}
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b)
+
+def find_similar(sets, threshold, permutations=MINHASH_PERMUTATIONS,
+                 bands=LSH_BANDS):
+    '''
+    Group students whose shingles (a set, or any iterable) have a Jaccard
+    similarity of at least threshold, directly or through others in the
+    group. Students with no shingles (None) are left out.
+    Identical sets are put together first. Then each distinct set gets a
+    MinHash signature, split into bands: sets sharing a band go into the
+    same bucket and only those are compared, so time grows with the number
+    of students rather than of pairs of them.
+    Returns the groups of two or more, each sorted, in order of their first
+    student, as (student, best similarity with another in the group) pairs.
+    '''
+    identical = defaultdict(list)
+    for stud in sorted(sets):
+        if sets[stud]:
+            identical[frozenset(sets[stud])].append(stud)
+    distinct = list(identical)
+    buckets = defaultdict(list)
+    for i, shingled in enumerate(distinct):
+        signature = minhash.signature(shingled, permutations)
+        for band, values in enumerate(minhash.banded(signature, bands)):
+            buckets[band, values].append(i)
+    # union-find over the distinct sets
+    parent = list(range(len(distinct)))
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    best = [1.0 if len(identical[shingled]) > 1 else None
+            for shingled in distinct]
+    compared = set()
+    for bucket in buckets.values():
+        for n, i in enumerate(bucket):
+            for j in bucket[n + 1:]:
+                if (i, j) in compared:
+                    continue
+                compared.add((i, j))
+                similarity = jaccard(distinct[i], distinct[j])
+                if similarity >= threshold:
+                    best[i] = max(best[i] or 0.0, similarity)
+                    best[j] = max(best[j] or 0.0, similarity)
+                    parent[root(i)] = root(j)
+    groups = defaultdict(list)
+    for i, shingled in enumerate(distinct):
+        if best[i] is not None:
+            groups[root(i)] += [(stud, best[i]) for stud in identical[shingled]]
+    return sorted((sorted(group) for group in groups.values()),
+                  key=lambda group: group[0])
+
+def questions(fieldnames, response):
+    '''
+    The numbers of the questions with a response column, in order.
+    '''
+    pattern = re.compile(re.escape(response) + ' ([0-9]+)$')
+    return [m.group(1) for m in map(pattern.match, fieldnames) if m]
+
+def report(input_file, question, fingerprints, names, optionals):
+    '''
+    Print the copies of one question, and who's involved.
+    '''
+    print("COPIES: File '{}', Question {}\n".format(input_file, question))
     known = set()
 
-    for i, stud in enumerate(studs):
-        if progs[stud] == '-': continue
-        copiers = []
-        for other in studs[i + 1:]:
-            if progs[stud] == progs[other] and other not in known:
-                copiers.append(other)
-                known.add(other)
-                known.add(stud)
-        if copiers:
+    if optionals.get('similarity'):
+        sets = {stud: shingled for stud, (_, shingled) in fingerprints.items()}
+        for (stud, _), *copiers in find_similar(sets, optionals['similarity']):
+            known.add(stud)
+            print(stud, names[stud])
+            for bod, similarity in copiers:
+                known.add(bod)
+                print('    {} {} ({:.0%})'.format(bod, names[bod], similarity))
+            print()
+    else:
+        digests = {stud: digest for stud, (digest, _) in fingerprints.items()}
+        for stud, *copiers in find_copies(digests):
+            known.add(stud)
+            known.update(copiers)
             print(stud, names[stud])
             for bod in copiers:
                 print('    {} {}'.format(bod , names[bod]))
@@ -105,3 +272,104 @@ def main(optionals):
         email_list.append(stud + "@etu.unice.fr")
     print()
     print("Email list: ", ",".join(email_list))
+
+def report_past(store, question, fingerprints, names, optionals):
+    '''
+    Print the copies of one question from past years, then store its
+    fingerprints for the years to come.
+    '''
+    course, year = optionals['course'], optionals['year']
+    print()
+    print("PAST COPIES: Course '{}', Question {}\n".format(course, question))
+    if optionals.get('similarity'):
+        signatures = {stud: minhash.signature(shingled)
+                      for stud, (_, shingled) in fingerprints.items() if shingled}
+        found = store.near_copies(course, year, question, signatures,
+                                  optionals['similarity'])
+        unsigned = store.unsigned(course, year, question)
+        if unsigned:
+            print('Warning: {} submissions from past years were stored '
+                  'without --similarity, so near-copies of them can\'t be '
+                  'found\n'.format(unsigned))
+    else:
+        signatures = {}
+        found = store.copies(course, year, question,
+                             {stud: digest for stud, (digest, _) in fingerprints.items()
+                              if digest is not None})
+    for stud in sorted(found):
+        print(stud, names[stud])
+        for past in found[stud]:
+            if optionals.get('similarity'):
+                print('    {} {} ({:.0%})'.format(*past))
+            else:
+                print('    {} {}'.format(*past))
+        print()
+
+    print()
+    print("{} students copying from past years:".format(len(found)))
+    email_list = []
+    for stud in sorted(found):
+        print(' ', stud, names[stud])
+        email_list.append(stud + "@etu.unice.fr")
+    print()
+    print("Email list: ", ",".join(email_list))
+    store.add(course, year, question,
+              {stud: (digest, signatures.get(stud))
+               for stud, (digest, _) in fingerprints.items() if digest is not None})
+
+def main(optionals):
+    normaliser = Normaliser(optionals)
+    extension = setup(optionals)['LANGUAGE_EXT']
+    input_file = optionals['input_file']
+    headers = HEADERS_LANG[optionals['moodle_language']]
+    first_name = headers['first_name']
+    surname = headers['surname']
+    email_address = headers['email']
+    names = {}
+    jobs = optionals.get('jobs')
+    with contextlib.ExitStack() as stack:
+        f = stack.enter_context(open(input_file, encoding='utf-8-sig'))
+        executor = stack.enter_context(ProcessPoolExecutor(jobs)) if jobs else None
+        rdr = csv.DictReader(f)
+        if optionals.get('all_questions'):
+            numbers = questions(rdr.fieldnames, headers['response'])
+        else:
+            numbers = [optionals['question']]
+        dumps = {}
+        prints = {}
+        for question in numbers:
+            dumps[question] = stack.enter_context(open_dump(
+                    optionals['output_dir'], question, extension, optionals))
+            prints[question] = {}
+        pending = []
+        for row in rdr:
+            stud = row[email_address].split('@')[0]
+            names[stud] = row[first_name] + ' ' + row[surname]
+            for question in numbers:
+                raw_code = row[headers['response'] + ' ' + question]
+                dumps[question].write(stud, raw_code)
+                pending.append((question, stud, raw_code))
+            if len(pending) >= CHUNK:
+                normalise_pending(normaliser, pending, prints, executor)
+        normalise_pending(normaliser, pending, prints, executor)
+
+    with (FingerprintStore(optionals['store']) if optionals.get('store')
+          else contextlib.nullcontext()) as store:
+        for i, question in enumerate(numbers):
+            if i:
+                print()
+            fingerprints = prints.pop(question)
+            report(input_file, question, fingerprints, names, optionals)
+            if store:
+                report_past(store, question, fingerprints, names, optionals)
+
+def normalise_pending(normaliser, pending, prints, executor):
+    '''
+    Fingerprint the pending responses, by question and student, and clear
+    them.
+    '''
+    raw_codes = [raw_code for _, _, raw_code in pending]
+    for (question, stud, _), fingerprinted in zip(
+            pending, normalise_many(normaliser, raw_codes, executor)):
+        prints[question][stud] = fingerprinted
+    pending.clear()
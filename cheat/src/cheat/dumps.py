@@ -0,0 +1,126 @@
+'''Where the submissions of a question get written to, one file per
+   student: a directory, as always, or a zip or tar archive written in a
+   single streaming pass.
+
+   A directory can be written to incrementally: a manifest of the digests
+   of its files is kept in it, and files whose content hasn't changed
+   since the last run are left alone.
+'''
+
+import hashlib
+import io
+import json
+import os
+import tarfile
+import time
+import zipfile
+
+MANIFEST = '.manifest.json'
+
+
+def open_dump(output_dir, question, extension, optionals):
+    '''
+    The dump for the submissions of question, as the options would have it.
+    '''
+    path = '%s/SubmissionsQ%s' % (output_dir, question)
+    archive = optionals.get('archive')
+    if archive == 'zip':
+        return ZipDump(path + '.zip', extension)
+    if archive == 'tar':
+        return TarDump(path + '.tar', extension)
+    return DirectoryDump(path, extension, optionals.get('incremental'))
+
+
+class DirectoryDump:
+    '''
+    A file per student in a directory.
+    '''
+
+    def __init__(self, path, extension, incremental=False):
+        self.path = path
+        self.extension = extension
+        self.incremental = incremental
+        self.manifest = {}
+        if not os.path.isdir(path):
+            os.mkdir(path)
+        elif incremental:
+            try:
+                with open(os.path.join(path, MANIFEST)) as f:
+                    self.manifest = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, stud, raw_code):
+        name = stud + self.extension
+        file_path = os.path.join(self.path, name)
+        if self.incremental:
+            digest = hashlib.blake2b(raw_code.encode('utf-8'),
+                                     digest_size=16).hexdigest()
+            if self.manifest.get(name) == digest and os.path.exists(file_path):
+                return
+            self.manifest[name] = digest
+        with open(file_path, 'w') as code_file:
+            code_file.write(raw_code)
+
+    def close(self):
+        if self.incremental:
+            with open(os.path.join(self.path, MANIFEST), 'w') as f:
+                json.dump(self.manifest, f, indent=0, sort_keys=True)
+
+
+class ZipDump:
+    '''
+    A file per student in a zip archive, under the archive's name.
+    '''
+
+    def __init__(self, path, extension):
+        self.folder = os.path.basename(path)[:-len('.zip')]
+        self.extension = extension
+        self.archive = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, stud, raw_code):
+        self.archive.writestr(self.folder + '/' + stud + self.extension,
+                              raw_code)
+
+    def close(self):
+        self.archive.close()
+
+
+class TarDump:
+    '''
+    A file per student in a tar archive, under the archive's name.
+    '''
+
+    def __init__(self, path, extension):
+        self.folder = os.path.basename(path)[:-len('.tar')]
+        self.extension = extension
+        self.archive = tarfile.open(path, 'w')
+        self.mtime = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, stud, raw_code):
+        data = raw_code.encode('utf-8')
+        info = tarfile.TarInfo(self.folder + '/' + stud + self.extension)
+        info.size = len(data)
+        info.mtime = self.mtime
+        self.archive.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self.archive.close()
@@ -0,0 +1,37 @@
+'''MinHash signatures of sets of shingles, and their bands for
+   locality-sensitive hashing.
+
+   Shingles are 64-bit hashes already, so xor-ing them with a random
+   mask is as good as a permutation, and much cheaper. The masks are the
+   same from one run to the next, so that signatures can be stored.
+'''
+
+import functools
+import random
+from . import MINHASH_PERMUTATIONS
+from . import LSH_BANDS
+
+
+@functools.lru_cache()
+def masks(permutations):
+    rnd = random.Random(0)
+    return [rnd.getrandbits(64) for _ in range(permutations)]
+
+def signature(shingled, permutations=MINHASH_PERMUTATIONS):
+    '''
+    The MinHash signature of a (non-empty) set of shingles.
+    '''
+    return [min(map(mask.__xor__, shingled)) for mask in masks(permutations)]
+
+def banded(sig, bands=LSH_BANDS):
+    '''
+    A signature split into bands: sets sharing a band are candidates.
+    '''
+    rows = len(sig) // bands
+    return [tuple(sig[band * rows:(band + 1) * rows]) for band in range(bands)]
+
+def estimate(sig, other):
+    '''
+    The Jaccard similarity of two sets estimated from their signatures.
+    '''
+    return sum(a == b for a, b in zip(sig, other)) / len(sig)
@@ -0,0 +1,136 @@
+'''Fingerprints of past submissions, to catch copies of them.
+
+   Each submission's digest and, for near-copies, MinHash signature are
+   kept in an SQLite database, by course, year, question and student.
+   New submissions are looked up in it through indexes on the digests and
+   on the signatures' bands, so checking a cohort takes time in proportion
+   to the cohort, not to the database.
+'''
+
+from array import array
+import sqlite3
+from . import minhash
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS submissions (
+    course TEXT NOT NULL,
+    year TEXT NOT NULL,
+    question TEXT NOT NULL,
+    student TEXT NOT NULL,
+    digest BLOB NOT NULL,
+    signature BLOB,
+    PRIMARY KEY (course, year, question, student)
+);
+CREATE INDEX IF NOT EXISTS submissions_by_digest
+    ON submissions (course, question, digest);
+CREATE TABLE IF NOT EXISTS bands (
+    course TEXT NOT NULL,
+    year TEXT NOT NULL,
+    question TEXT NOT NULL,
+    student TEXT NOT NULL,
+    band INTEGER NOT NULL,
+    bucket BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bands_by_bucket
+    ON bands (course, question, band, bucket);
+CREATE INDEX IF NOT EXISTS bands_by_student
+    ON bands (course, year, question, student);
+'''
+
+
+def _bucket(band):
+    return array('Q', band).tobytes()
+
+
+class FingerprintStore:
+    '''
+    The fingerprint database at path, created if need be.
+    '''
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def add(self, course, year, question, fingerprints):
+        '''
+        Store fingerprints, (digest, signature or None) by student,
+        replacing what was there for the same students.
+        '''
+        with self.db:
+            for stud, (digest, sig) in fingerprints.items():
+                key = (course, year, question, stud)
+                self.db.execute(
+                    'INSERT OR REPLACE INTO submissions VALUES (?, ?, ?, ?, ?, ?)',
+                    key + (digest, sig and array('Q', sig).tobytes()))
+                self.db.execute(
+                    'DELETE FROM bands WHERE course = ? AND year = ? '
+                    'AND question = ? AND student = ?', key)
+                if sig:
+                    self.db.executemany(
+                        'INSERT INTO bands VALUES (?, ?, ?, ?, ?, ?)',
+                        (key + (band, _bucket(values))
+                         for band, values in enumerate(minhash.banded(sig))))
+
+    def copies(self, course, year, question, digests):
+        '''
+        The submissions of other years with the same digests, as
+        [(year, student)] by student.
+        '''
+        found = {}
+        for stud, digest in digests.items():
+            # sorted here: ORDER BY would steer SQLite away from the index
+            rows = sorted(self.db.execute(
+                'SELECT year, student FROM submissions WHERE course = ? '
+                'AND question = ? AND digest = ? AND year != ?',
+                (course, question, digest, year)))
+            if rows:
+                found[stud] = rows
+        return found
+
+    def unsigned(self, course, year, question):
+        '''
+        The number of submissions of other years stored without a signature
+        (checked for exact copies only), which near_copies can't find.
+        '''
+        count, = self.db.execute(
+            'SELECT COUNT(*) FROM submissions WHERE course = ? '
+            'AND question = ? AND year != ? AND signature IS NULL',
+            (course, question, year)).fetchone()
+        return count
+
+    def near_copies(self, course, year, question, signatures, threshold):
+        '''
+        The submissions of other years sharing a band with the signatures
+        and estimated to be at least threshold similar, as
+        [(year, student, similarity)] by student.
+        '''
+        found = {}
+        for stud, sig in signatures.items():
+            candidates = set()
+            for band, values in enumerate(minhash.banded(sig)):
+                candidates.update(self.db.execute(
+                    'SELECT year, student FROM bands WHERE course = ? '
+                    'AND question = ? AND band = ? AND bucket = ? '
+                    'AND year != ?',
+                    (course, question, band, _bucket(values), year)))
+            near = []
+            for past_year, past_stud in sorted(candidates):
+                stored, = self.db.execute(
+                    'SELECT signature FROM submissions WHERE course = ? '
+                    'AND year = ? AND question = ? AND student = ?',
+                    (course, past_year, question, past_stud)).fetchone()
+                similarity = minhash.estimate(sig, array('Q', stored))
+                if similarity >= threshold:
+                    near.append((past_year, past_stud, similarity))
+            if near:
+                found[stud] = near
+        return found
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import datetime
 from cheat import dumbcopiers
 
 def main():
@@ -8,15 +9,31 @@ def main():
 if __name__ == '__main__':
     from optparse import OptionParser
     parser = OptionParser()
+    parser.add_option('--archive', type='choice', choices=['zip', 'tar'],
+            dest='archive', default=None,
+            help='write student answer code files to a zip or tar archive '
+                 'per question rather than to a directory')
+    parser.add_option('-a', '--all_questions', action='store_true',
+            dest='all_questions', default=False,
+            help='compare student codes for every question, in one pass')
     parser.add_option('-c', '--code_language',
             dest='code_language', default='java',
             help='code language: [java (default) | python | c | matlab')
+    parser.add_option('--course',
+            dest='course', default='',
+            help='course the submissions are for, in the fingerprint store')
     parser.add_option('-e', '--exact_copies_only', action='store_true',
             dest='exact_copies_only', default=False,
             help='copies must be exactly the same to trigger an alert')
+    parser.add_option('--incremental', action='store_true',
+            dest='incremental', default=False,
+            help='only rewrite student answer code files that have changed')
     parser.add_option('-i', '--input_file',
             dest='input_file', default=False,
             help='student answers file exported from Moodle')
+    parser.add_option('-j', '--jobs', type='int',
+            dest='jobs', default=None,
+            help='processes to normalise student codes with (default none)')
     parser.add_option('-m', '--moodle_language',
             dest='moodle_language', default='french',
             help='Moodle language: [english | french (default)]')
@@ -29,13 +46,33 @@ if __name__ == '__main__':
     parser.add_option('-r', '--replace_identifiers', action='store_true',
             dest='replace_identifiers', default=False,
             help="all non-keyword identifiers are replaced by '###'")
+    parser.add_option('--store',
+            dest='store', default=None,
+            help='fingerprint database to check past years against, and to '
+                 'add these submissions to (default none)')
+    parser.add_option('-s', '--similarity', type='float',
+            dest='similarity', default=None,
+            help='also flag near-copies, at least this similar (0 to 1, '
+                 'eg 0.8); exact copies only by default')
+    parser.add_option('--year',
+            dest='year', default=str(datetime.date.today().year),
+            help='year of the submissions, in the fingerprint store '
+                 '(default this year)')
     (options, args) = parser.parse_args()
     optionals = {}
+    optionals['all_questions'] = options.all_questions
+    optionals['archive'] = options.archive
     optionals['code_language'] = options.code_language
+    optionals['course'] = options.course
     optionals['exact_copies_only'] = options.exact_copies_only
+    optionals['incremental'] = options.incremental
     optionals['input_file'] = options.input_file
+    optionals['jobs'] = options.jobs
     optionals['moodle_language'] = options.moodle_language
     optionals['output_dir'] = options.output_dir
     optionals['question'] = options.question
     optionals['replace_identifiers'] = options.replace_identifiers
+    optionals['similarity'] = options.similarity
+    optionals['store'] = options.store
+    optionals['year'] = options.year
     dumbcopiers.main(optionals)
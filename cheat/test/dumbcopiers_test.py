@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+'''Exercises the dumbcopiers.py copy detection.
+
+(cc) CC BY-NC 4.0 2016-2020 Peter Sander
+'''
+
+import contextlib
+import csv
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(sys.path[0], '../src'))
+import bench
+from cheat import dumbcopiers
+
+
+def find_copies(progs):
+    '''The copies found by digest, from the cleaned programs.
+    '''
+    return dumbcopiers.find_copies(
+        {stud: dumbcopiers.fingerprint(prog) for stud, prog in progs.items()})
+
+
+class CopiesTest(unittest.TestCase):
+    def assertSameAsPairs(self, progs):
+        self.assertEqual(find_copies(progs), bench.pair_loop(progs))
+
+    def test_cohorts(self):
+        for seed in range(5):
+            progs = bench.cohort(500, 100, seed)
+            self.assertTrue(find_copies(progs))
+            self.assertSameAsPairs(progs)
+
+    def test_groups(self):
+        progs = {'c': 'x=1;', 'a': 'x=1;', 'b': 'y=2;', 'd': 'y=2;',
+                 'e': 'x=1;', 'f': 'z=3;'}
+        self.assertSameAsPairs(progs)
+        self.assertEqual(find_copies(progs), [['a', 'c', 'e'], ['b', 'd']])
+
+    def test_no_students(self):
+        self.assertSameAsPairs({})
+        self.assertEqual(find_copies({}), [])
+
+    def test_single_student(self):
+        self.assertSameAsPairs({'a': 'x=1;'})
+        self.assertEqual(find_copies({'a': 'x=1;'}), [])
+
+    def test_no_copies(self):
+        progs = {'a': 'x=1;', 'b': 'y=2;', 'c': 'z=3;'}
+        self.assertSameAsPairs(progs)
+        self.assertEqual(find_copies(progs), [])
+
+    def test_no_answer_never_a_copy(self):
+        progs = {'a': '-', 'b': '-', 'c': 'x=1;', 'd': '-', 'e': 'x=1;'}
+        self.assertSameAsPairs(progs)
+        self.assertEqual(find_copies(progs), [['c', 'e']])
+        progs = {'a': '-', 'b': '-'}
+        self.assertSameAsPairs(progs)
+        self.assertEqual(find_copies(progs), [])
+
+    def test_empty_answers(self):
+        # an empty (cleaned) program is an answer, unlike '-'
+        progs = {'a': '', 'b': '', 'c': '-'}
+        self.assertSameAsPairs(progs)
+        self.assertEqual(find_copies(progs), [['a', 'b']])
+
+
+class SimilarTest(unittest.TestCase):
+    '''find_similar on sets of shingles (the MinHash masks, and so the
+    buckets, are the same from one run to the next).
+    '''
+    def test_identical(self):
+        shingled = set(range(100))
+        self.assertEqual(
+            dumbcopiers.find_similar({'b': shingled, 'a': set(shingled)}, 0.8),
+            [[('a', 1.0), ('b', 1.0)]])
+
+    def test_near_identical(self):
+        # 95 shingles in common out of 105
+        sets = {'a': set(range(100)), 'b': set(range(5, 105))}
+        self.assertEqual(dumbcopiers.find_similar(sets, 0.8),
+                         [[('a', 95 / 105), ('b', 95 / 105)]])
+
+    def test_not_similar_enough(self):
+        # 70 in common out of 130: close enough to share buckets maybe,
+        # but not to pass the threshold
+        sets = {'a': set(range(100)), 'b': set(range(30, 130))}
+        self.assertEqual(dumbcopiers.find_similar(sets, 0.8), [])
+
+    def test_dissimilar(self):
+        sets = {'a': set(range(100)), 'b': set(range(100, 200)),
+                'c': set(range(200, 300))}
+        self.assertEqual(dumbcopiers.find_similar(sets, 0.5), [])
+
+    def test_transitive(self):
+        # a and c are only 80 / 120 alike, but both are 90 / 110 like b
+        sets = {'a': set(range(100)), 'b': set(range(10, 110)),
+                'c': set(range(20, 120)), 'd': set(range(500, 600))}
+        self.assertLess(dumbcopiers.jaccard(sets['a'], sets['c']), 0.8)
+        self.assertEqual(dumbcopiers.find_similar(sets, 0.8),
+                         [[('a', 90 / 110), ('b', 90 / 110), ('c', 90 / 110)]])
+
+    def test_identical_and_near(self):
+        sets = {'a': set(range(100)), 'b': set(range(100)),
+                'c': set(range(5, 105))}
+        self.assertEqual(dumbcopiers.find_similar(sets, 0.8),
+                         [[('a', 1.0), ('b', 1.0), ('c', 95 / 105)]])
+
+    def test_no_answers_left_out(self):
+        sets = {'a': None, 'b': set(), 'c': None, 'd': set(range(10))}
+        self.assertEqual(dumbcopiers.find_similar(sets, 0.8), [])
+
+    def test_groups_in_order(self):
+        sets = {'z': set(range(100)), 'b': set(range(100)),
+                'y': set(range(200, 300)), 'a': set(range(200, 300))}
+        self.assertEqual(dumbcopiers.find_similar(sets, 0.8),
+                         [[('a', 1.0), ('y', 1.0)], [('b', 1.0), ('z', 1.0)]])
+
+    def test_shingles_of_near_copies(self):
+        normaliser = dumbcopiers.Normaliser(
+            {'code_language': 'java', 'exact_copies_only': False,
+             'replace_identifiers': True, 'similarity': 0.5})
+        code = 'int f(int n) { int s = 0; for (int i = 0; i < n; i++) ' \
+            's += i * i; return s; }'
+        renamed = code.replace('s', 'total') + ' // mine'
+        _, shingled = normaliser.normalise(code)
+        _, renamed_shingled = normaliser.normalise(renamed)
+        self.assertEqual(shingled, renamed_shingled)
+        _, changed = normaliser.normalise(code.replace('i * i', 'i * i * i'))
+        groups = dumbcopiers.find_similar(
+            {'a': shingled, 'b': renamed_shingled, 'c': changed}, 0.5)
+        self.assertEqual([[stud for stud, _ in group] for group in groups],
+                         [['a', 'b', 'c']])
+
+
+def optionals(**options):
+    '''The options dumbcopiers.main gets from the command line by default.
+    '''
+    defaults = {'all_questions': False, 'archive': None,
+                'code_language': 'java', 'course': '',
+                'exact_copies_only': False, 'incremental': False,
+                'input_file': None, 'jobs': None, 'moodle_language': 'french',
+                'output_dir': None, 'question': None,
+                'replace_identifiers': False, 'similarity': None,
+                'store': None, 'year': '2020'}
+    defaults.update(options)
+    return defaults
+
+
+class QuestionsTest(unittest.TestCase):
+    def test_response_columns(self):
+        fieldnames = ['Nom', 'Prénom', 'Adresse de courriel', 'État',
+                      'Note/10,00', 'Question 1', 'Réponse 1', 'Réponse 2',
+                      'Réponse 10', 'Réponse', 'Réponse x', 'Réponse 3 bis',
+                      'Réponses 4', 'Réponse juste 5']
+        self.assertEqual(dumbcopiers.questions(fieldnames, 'Réponse'),
+                         ['1', '2', '10'])
+
+    def test_language(self):
+        fieldnames = ['Surname', 'Response 2', 'Réponse 1', 'Response 1']
+        self.assertEqual(dumbcopiers.questions(fieldnames, 'Response'),
+                         ['2', '1'])
+
+    def test_none(self):
+        self.assertEqual(dumbcopiers.questions(['Nom', 'Prénom'], 'Réponse'),
+                         [])
+
+
+class AllQuestionsTest(unittest.TestCase):
+    '''Checking every question in one pass against one at a time.
+    '''
+    rows = [('ann', 'int x = 1;', 'return a;', '-'),
+            ('bob', 'int  x = 1; // mine', 'return b;', 'f();'),
+            ('cat', 'int y = 2;', 'return  a;', 'f();'),
+            ('dan', '-', 'return a;', 'g();')]
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.input_file = os.path.join(self.tmp.name, 'quiz.csv')
+        with open(self.input_file, 'w', encoding='utf-8-sig',
+                  newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Nom', 'Prénom', 'Adresse de courriel',
+                             'Réponse 1', 'Réponse 2', 'Réponse 3'])
+            for stud, *responses in self.rows:
+                writer.writerow([stud.title(), 'X', stud + '@etu.unice.fr']
+                                + responses)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_main(self, **options):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            dumbcopiers.main(optionals(input_file=self.input_file,
+                                       output_dir=self.tmp.name, **options))
+        return out.getvalue()
+
+    def test_same_as_one_at_a_time(self):
+        together = self.run_main(all_questions=True)
+        apart = [self.run_main(question=question)
+                 for question in ('1', '2', '3')]
+        self.assertEqual(together, '\n'.join(apart))
+
+    def test_reports_kept_apart(self):
+        reports = self.run_main(all_questions=True).split('COPIES: ')[1:]
+        self.assertEqual(len(reports), 3)
+        for question, copiers, report in zip(
+                '123', (['ann', 'bob'], ['ann', 'cat', 'dan'], ['bob', 'cat']),
+                reports):
+            self.assertTrue(report.startswith(
+                "File '%s', Question %s\n" % (self.input_file, question)))
+            self.assertIn("%d students involved" % len(copiers), report)
+            self.assertIn('Email list:  ' + ','.join(
+                stud + '@etu.unice.fr' for stud in copiers) + '\n', report)
+
+    def test_dumps_per_question(self):
+        self.run_main(all_questions=True)
+        for question in '123':
+            with open(os.path.join(self.tmp.name,
+                                   'SubmissionsQ' + question, 'bob.java')) as f:
+                self.assertEqual(f.read(), self.rows[1][int(question)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+'''Exercises writing submissions out to directories and archives.
+
+(cc) CC BY-NC 4.0 2016-2020 Peter Sander
+'''
+
+import json
+import os
+import sys
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+sys.path.append(os.path.join(sys.path[0], '../src'))
+from cheat import dumps
+
+
+class DumpsTest(unittest.TestCase):
+    submissions = {'ann': 'int x = 1;', 'bob': 'int y = 2; // é', 'cat': '-'}
+    # in the archives, under their names
+    names = ['SubmissionsQ3/ann.java', 'SubmissionsQ3/bob.java',
+             'SubmissionsQ3/cat.java']
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'SubmissionsQ3')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def dump(self, submissions, **optionals):
+        with dumps.open_dump(self.tmp.name, '3', '.java', optionals) as dump:
+            for stud, raw_code in submissions.items():
+                dump.write(stud, raw_code)
+        return dump
+
+    def test_directory(self):
+        self.assertIsInstance(self.dump(self.submissions), dumps.DirectoryDump)
+        self.assertEqual(sorted(os.listdir(self.path)),
+                         ['ann.java', 'bob.java', 'cat.java'])
+        for stud, raw_code in self.submissions.items():
+            with open(os.path.join(self.path, stud + '.java')) as f:
+                self.assertEqual(f.read(), raw_code)
+
+    def test_zip(self):
+        self.assertIsInstance(self.dump(self.submissions, archive='zip'),
+                              dumps.ZipDump)
+        with zipfile.ZipFile(self.path + '.zip') as archive:
+            self.assertEqual(archive.namelist(), self.names)
+            for stud, raw_code in self.submissions.items():
+                self.assertEqual(archive.read('SubmissionsQ3/%s.java' % stud),
+                                 raw_code.encode('utf-8'))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_tar(self):
+        self.assertIsInstance(self.dump(self.submissions, archive='tar'),
+                              dumps.TarDump)
+        with tarfile.open(self.path + '.tar') as archive:
+            self.assertEqual(archive.getnames(), self.names)
+            for stud, raw_code in self.submissions.items():
+                member = archive.extractfile('SubmissionsQ3/%s.java' % stud)
+                self.assertEqual(member.read().decode('utf-8'), raw_code)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_incremental(self):
+        self.dump(self.submissions, incremental=True)
+        with open(os.path.join(self.path, dumps.MANIFEST)) as f:
+            self.assertEqual(sorted(json.load(f)),
+                             ['ann.java', 'bob.java', 'cat.java'])
+        for name in os.listdir(self.path):
+            os.utime(os.path.join(self.path, name), (0, 0))
+        self.dump(dict(self.submissions, bob='int y = 3;', dan='int z;'),
+                  incremental=True)
+        # unchanged, so left alone
+        for name in ('ann.java', 'cat.java'):
+            self.assertEqual(os.path.getmtime(os.path.join(self.path, name)),
+                             0)
+        for stud, raw_code in (('bob', 'int y = 3;'), ('dan', 'int z;')):
+            with open(os.path.join(self.path, stud + '.java')) as f:
+                self.assertEqual(f.read(), raw_code)
+        with open(os.path.join(self.path, dumps.MANIFEST)) as f:
+            self.assertEqual(sorted(json.load(f)),
+                             ['ann.java', 'bob.java', 'cat.java', 'dan.java'])
+
+    def test_incremental_file_gone(self):
+        self.dump(self.submissions, incremental=True)
+        os.remove(os.path.join(self.path, 'ann.java'))
+        self.dump(self.submissions, incremental=True)
+        with open(os.path.join(self.path, 'ann.java')) as f:
+            self.assertEqual(f.read(), 'int x = 1;')
+
+    def test_not_incremental_rewrites(self):
+        self.dump(self.submissions)
+        os.utime(os.path.join(self.path, 'ann.java'), (0, 0))
+        self.dump(self.submissions)
+        self.assertNotEqual(
+            os.stat(os.path.join(self.path, 'ann.java')).st_mtime, 0)
+        self.assertFalse(os.path.exists(os.path.join(self.path,
+                                                     dumps.MANIFEST)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+'''Exercises the fingerprint store, and checking against past years.
+
+(cc) CC BY-NC 4.0 2016-2020 Peter Sander
+'''
+
+import contextlib
+import csv
+import io
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(sys.path[0], '../src'))
+from cheat import dumbcopiers
+from cheat import minhash
+from cheat.store import FingerprintStore
+
+
+# shingles are 64-bit hashes
+_rnd = random.Random(0)
+HASHES = [_rnd.getrandbits(64) for _ in range(1000)]
+
+
+def signature(first, last):
+    '''The signature of the shingles first to last.
+    '''
+    return minhash.signature(set(HASHES[first:last]))
+
+
+class StoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = FingerprintStore(os.path.join(self.tmp.name, 'fp.db'))
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_copies(self):
+        self.store.add('c', '2019', '1', {'ann': (b'a', None),
+                                          'bob': (b'b', None)})
+        self.store.add('c', '2018', '1', {'cat': (b'a', None)})
+        self.assertEqual(
+            self.store.copies('c', '2020', '1', {'dan': b'a', 'eve': b'x'}),
+            {'dan': [('2018', 'cat'), ('2019', 'ann')]})
+
+    def test_copies_same_course_and_question_only(self):
+        self.store.add('c', '2019', '1', {'ann': (b'a', None)})
+        self.assertEqual(self.store.copies('d', '2020', '1', {'dan': b'a'}),
+                         {})
+        self.assertEqual(self.store.copies('c', '2020', '2', {'dan': b'a'}),
+                         {})
+
+    def test_copies_not_from_this_year(self):
+        self.store.add('c', '2020', '1', {'ann': (b'a', None)})
+        self.assertEqual(self.store.copies('c', '2020', '1', {'bob': b'a'}),
+                         {})
+        self.assertEqual(self.store.copies('c', '2021', '1', {'bob': b'a'}),
+                         {'bob': [('2020', 'ann')]})
+
+    def test_near_copies(self):
+        self.store.add('c', '2019', '1', {'ann': (b'a', signature(0, 100)),
+                                          'bob': (b'b', signature(500, 600))})
+        (stud, ((year, past, similarity),)), = self.store.near_copies(
+            'c', '2020', '1', {'dan': signature(5, 105)}, 0.8).items()
+        self.assertEqual((stud, year, past), ('dan', '2019', 'ann'))
+        self.assertGreaterEqual(similarity, 0.8)
+        self.assertEqual(self.store.near_copies(
+            'c', '2020', '1', {'dan': signature(50, 150)}, 0.8), {})
+
+    def test_near_copies_not_from_this_year(self):
+        self.store.add('c', '2020', '1', {'ann': (b'a', signature(0, 100))})
+        self.assertEqual(self.store.near_copies(
+            'c', '2020', '1', {'bob': signature(0, 100)}, 0.8), {})
+        self.assertEqual(self.store.near_copies(
+            'c', '2021', '1', {'bob': signature(0, 100)}, 0.8),
+            {'bob': [('2020', 'ann', 1.0)]})
+
+    def test_add_replaces(self):
+        self.store.add('c', '2019', '1', {'ann': (b'a', signature(0, 100))})
+        self.store.add('c', '2019', '1', {'ann': (b'b', None)})
+        self.assertEqual(self.store.copies('c', '2020', '1', {'dan': b'a'}),
+                         {})
+        self.assertEqual(self.store.copies('c', '2020', '1', {'dan': b'b'}),
+                         {'dan': [('2019', 'ann')]})
+        # its bands went with it
+        self.assertEqual(self.store.near_copies(
+            'c', '2020', '1', {'dan': signature(0, 100)}, 0.8), {})
+        self.assertEqual(self.store.db.execute(
+            'SELECT COUNT(*) FROM submissions').fetchone(), (1,))
+
+    def test_unsigned(self):
+        self.store.add('c', '2019', '1', {'ann': (b'a', None),
+                                          'bob': (b'b', signature(0, 100))})
+        self.store.add('c', '2020', '1', {'cat': (b'c', None)})
+        self.assertEqual(self.store.unsigned('c', '2020', '1'), 1)
+        self.assertEqual(self.store.unsigned('c', '2021', '1'), 2)
+        self.assertEqual(self.store.unsigned('c', '2020', '2'), 0)
+
+
+class PastYearsTest(unittest.TestCase):
+    '''dumbcopiers.main with a fingerprint store.
+    '''
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = os.path.join(self.tmp.name, 'fp.db')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_main(self, year, rows, **options):
+        input_file = os.path.join(self.tmp.name, 'quiz%s.csv' % year)
+        with open(input_file, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Nom', 'Prénom', 'Adresse de courriel',
+                             'Réponse 1'])
+            for stud, response in rows:
+                writer.writerow([stud.title(), 'X', stud + '@etu.unice.fr',
+                                 response])
+        optionals = {'all_questions': False, 'archive': None,
+                     'code_language': 'java', 'course': 'c',
+                     'exact_copies_only': False, 'incremental': False,
+                     'input_file': input_file, 'jobs': None,
+                     'moodle_language': 'french',
+                     'output_dir': self.tmp.name, 'question': '1',
+                     'replace_identifiers': False, 'similarity': None,
+                     'store': self.store, 'year': year}
+        optionals.update(options)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            dumbcopiers.main(optionals)
+        return out.getvalue().split('PAST COPIES: ')[1]
+
+    code = 'int f(int n) { int s = 0; for (int i = 0; i < n; i++) ' \
+        's += i * i; return s; }'
+
+    def test_without_similarity(self):
+        self.run_main('2019', [('ann', self.code), ('bob', 'int x;')])
+        past = self.run_main('2020', [('cat', self.code + ' // mine'),
+                                      ('dan', 'int y;')])
+        self.assertIn('cat X Cat\n    2019 ann\n', past)
+        self.assertIn('1 students copying from past years', past)
+        # and this year's went in with them
+        with FingerprintStore(self.store) as store:
+            self.assertEqual(store.db.execute(
+                'SELECT year, student FROM submissions ORDER BY student'
+                ).fetchall(),
+                [('2019', 'ann'), ('2019', 'bob'), ('2020', 'cat'),
+                 ('2020', 'dan')])
+
+    def test_with_similarity(self):
+        self.run_main('2019', [('ann', self.code)], similarity=0.5)
+        past = self.run_main(
+            '2020', [('cat', self.code.replace('i * i', 'i * i * i'))],
+            similarity=0.5)
+        self.assertIn('cat X Cat\n    2019 ann (', past)
+        self.assertNotIn('Warning', past)
+
+    def test_warns_of_past_years_without_signatures(self):
+        self.run_main('2019', [('ann', self.code)])
+        past = self.run_main('2020', [('cat', self.code)], similarity=0.5)
+        self.assertIn('Warning: 1 submissions from past years were stored '
+                      'without --similarity', past)
+
+
+if __name__ == '__main__':
+    unittest.main()
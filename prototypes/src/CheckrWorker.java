@@ -0,0 +1,359 @@
+/*
+ * Long-lived compile-and-run worker for java_code_checkr.py.
+ *
+ * Every compile_and_* call otherwise pays for two fresh JVMs (javac, then
+ * java foobar.Tester). This worker stays up, compiles with the in-process
+ * compiler API and runs main methods in a fresh, isolated class loader, so
+ * a request only costs the compiling and executing. Tools such as FindBugs
+ * run in it too, saving a JVM each (though not their class loading: they
+ * get a fresh class loader every time), and the JUnit launcher stays
+ * loaded from one request to the next.
+ *
+ * This is NOT a CodeRunner support file - it runs on the grading server,
+ * eg:
+ *     javac -d /opt/checkr CheckrWorker.java
+ *     java -cp /opt/checkr checkr.CheckrWorker 7878
+ * and java_code_checkr.py is told about it with, eg,
+ *     JAVA_CHECKR_WORKER=localhost:7878
+ * If the worker isn't running, java_code_checkr.py falls back to
+ * starting javac and java as subprocesses.
+ *
+ * Student code runs inside the worker, so a student System.exit() takes
+ * the worker down with it: run it under something that restarts it
+ * (systemd, supervisord...). A main that runs past its timeout can't be
+ * stopped cleanly either: the worker answers with status 124 and then
+ * halts, to be restarted likewise. So does one whose main returns leaving
+ * threads behind: the worker waits for those that aren't daemons (as the
+ * JVM would before exiting) until the timeout, and halts after answering
+ * if any are still going, daemons included. Requests are handled one at a
+ * time since System.out and System.err are shared by the whole JVM.
+ *
+ * Nor can the worker change directory (the JVM resolves relative paths
+ * against the directory it started in, whatever user.dir says), so
+ * java_code_checkr.py only sends it java and junit requests when the
+ * question has no data files tests could open by a relative path.
+ *
+ * Protocol (all integers are big-endian 32 bits):
+ *   request:  number of fields, then each field as length + UTF-8 bytes;
+ *             the first field is the command
+ *     javac <javac args...>
+ *     java <classpath> <main class> <stdin> [<timeout ms>]
+ *     tool <jar> <timeout ms> <args...>
+ *     junit <console launcher jar> <timeout ms> <args...>
+ *   response: exit status, stdout as length + bytes, stderr as length + bytes
+ *
+ * (cc) CC BY-NC 4.0 2016-2020 Peter Sander
+ */
+package checkr;
+
+import java.io.ByteArrayInputStream;
+import java.io.ByteArrayOutputStream;
+import java.io.DataInputStream;
+import java.io.DataOutputStream;
+import java.io.File;
+import java.io.IOException;
+import java.io.InputStream;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.net.InetAddress;
+import java.net.ServerSocket;
+import java.net.Socket;
+import java.net.URL;
+import java.net.URLClassLoader;
+import java.nio.charset.StandardCharsets;
+import java.util.Arrays;
+import java.util.Collections;
+import java.util.HashMap;
+import java.util.IdentityHashMap;
+import java.util.Map;
+import java.util.Set;
+import java.util.jar.Attributes;
+import java.util.jar.JarFile;
+import javax.tools.JavaCompiler;
+import javax.tools.ToolProvider;
+
+public class CheckrWorker {
+    private static final JavaCompiler JAVAC = ToolProvider.getSystemJavaCompiler();
+
+    private static final int TIMED_OUT = 124;
+    // class loaders of the JUnit launchers run so far, by jar
+    private static final Map<String, URLClassLoader> LAUNCHERS = new HashMap<>();
+    // whether the last run left threads behind, which there's no stopping
+    private static boolean threadsLeft;
+
+    public static void main(String[] args) throws IOException, InterruptedException {
+        int port = args.length > 0 ? Integer.parseInt(args[0]) : 7878;
+        try (ServerSocket server = new ServerSocket(port, 50, InetAddress.getLoopbackAddress())) {
+            while (true) {
+                try (Socket client = server.accept()) {
+                    serve(client);
+                } catch (IOException e) {
+                    // client went away - nothing to be done, wait for the next one
+                    e.printStackTrace();
+                }
+            }
+        }
+    }
+
+    private static void serve(Socket client) throws IOException, InterruptedException {
+        DataInputStream in = new DataInputStream(client.getInputStream());
+        String[] fields = new String[in.readInt()];
+        for (int i = 0; i < fields.length; i++) {
+            byte[] field = new byte[in.readInt()];
+            in.readFully(field);
+            fields[i] = new String(field, StandardCharsets.UTF_8);
+        }
+        ByteArrayOutputStream out = new ByteArrayOutputStream();
+        ByteArrayOutputStream err = new ByteArrayOutputStream();
+        int status;
+        switch (fields[0]) {
+            case "javac":
+                status = JAVAC.run(null, out, err, Arrays.copyOfRange(fields, 1, fields.length));
+                break;
+            case "java":
+                long timeout = fields.length > 4 ? Long.parseLong(fields[4]) : 0;
+                status = java(fields[1], fields[2], fields[3], timeout, out, err);
+                break;
+            case "tool":
+                status = tool(fields[1], Long.parseLong(fields[2]),
+                              Arrays.copyOfRange(fields, 3, fields.length), out, err);
+                break;
+            case "junit":
+                status = junit(fields[1], Long.parseLong(fields[2]),
+                               Arrays.copyOfRange(fields, 3, fields.length), out, err);
+                break;
+            default:
+                err.write(("Unknown command " + fields[0] + "\n").getBytes(StandardCharsets.UTF_8));
+                status = 2;
+        }
+        DataOutputStream reply = new DataOutputStream(client.getOutputStream());
+        reply.writeInt(status);
+        reply.writeInt(out.size());
+        out.writeTo(reply);
+        reply.writeInt(err.size());
+        err.writeTo(reply);
+        reply.flush();
+        if (status == TIMED_OUT || threadsLeft) {
+            // the student threads are still going and there's no stopping them
+            Runtime.getRuntime().halt(status == TIMED_OUT ? TIMED_OUT : 1);
+        }
+    }
+
+    /*
+     * Runs the main method of the given class as `java -cp classpath main`
+     * would, but in this JVM. The class loader is created afresh for each
+     * run so nothing (statics included) leaks from one student to the next.
+     */
+    private static int java(String classpath, String mainClass, String stdin, long timeout,
+                            ByteArrayOutputStream out, ByteArrayOutputStream err)
+            throws IOException, InterruptedException {
+        String[] entries = classpath.split(File.pathSeparator);
+        URL[] urls = new URL[entries.length];
+        for (int i = 0; i < entries.length; i++) {
+            urls[i] = new File(entries[i]).toURI().toURL();
+        }
+        try (URLClassLoader loader = new URLClassLoader(urls, ClassLoader.getPlatformClassLoader())) {
+            Method main = loader.loadClass(mainClass).getMethod("main", String[].class);
+            return run(loader, () -> {
+                main.invoke(null, (Object) new String[0]);
+                return 0;
+            }, mainClass, stdin, timeout, out, err);
+        } catch (ReflectiveOperationException e) {
+            err.write(("Error: could not run " + mainClass + ": " + e + "\n").getBytes(StandardCharsets.UTF_8));
+            return 1;
+        }
+    }
+
+    /*
+     * Runs a tool (FindBugs...) as `java -jar jar args` would, but in this
+     * JVM. Tools aren't made to be run more than once per JVM: FindBugs
+     * keeps its detector factories, analysis context and caches in
+     * statics, and so does BCEL its repository of the classes analysed.
+     * So each run gets a class loader of its own (the classes on the jar's
+     * Class-Path included), just as it would get a JVM of its own, and
+     * nothing carries over from one student's classes to the next's.
+     */
+    private static int tool(String jar, long timeout, String[] args,
+                            ByteArrayOutputStream out, ByteArrayOutputStream err)
+            throws IOException, InterruptedException {
+        String mainClass;
+        try (JarFile jarFile = new JarFile(jar)) {
+            mainClass = jarFile.getManifest().getMainAttributes().getValue(Attributes.Name.MAIN_CLASS);
+        }
+        try (URLClassLoader loader = loader(jar)) {
+            Method main = loader.loadClass(mainClass).getMethod("main", String[].class);
+            return run(loader, () -> {
+                main.invoke(null, (Object) args);
+                return 0;
+            }, mainClass, "", timeout, out, err);
+        } catch (ReflectiveOperationException e) {
+            err.write(("Error: could not run " + mainClass + ": " + e + "\n").getBytes(StandardCharsets.UTF_8));
+            return 1;
+        }
+    }
+
+    /*
+     * Runs the JUnit console launcher as `java -jar jar args` would, but
+     * through ConsoleLauncher.execute rather than main, which would exit.
+     * The launcher loads the classes under test (from its -cp argument)
+     * in a class loader of its own, and is made to be run over and over
+     * (by build tools), so its own class loader is kept.
+     */
+    private static int junit(String jar, long timeout, String[] args,
+                             ByteArrayOutputStream out, ByteArrayOutputStream err)
+            throws IOException, InterruptedException {
+        try {
+            Method execute = launcherLoader(jar).loadClass("org.junit.platform.console.ConsoleLauncher")
+                .getMethod("execute", PrintStream.class, PrintStream.class, String[].class);
+            return run(launcherLoader(jar), () -> {
+                Object result = execute.invoke(null, System.out, System.err, (Object) args);
+                return (Integer) result.getClass().getMethod("getExitCode").invoke(result);
+            }, null, "", timeout, out, err);
+        } catch (ReflectiveOperationException e) {
+            err.write(("Error: could not run JUnit: " + e + "\n").getBytes(StandardCharsets.UTF_8));
+            return 1;
+        }
+    }
+
+    private static URLClassLoader launcherLoader(String jar) throws IOException {
+        URLClassLoader loader = LAUNCHERS.get(jar);
+        if (loader == null) {
+            loader = loader(jar);
+            LAUNCHERS.put(jar, loader);
+        }
+        return loader;
+    }
+
+    /*
+     * A fresh class loader for the classes of a jar, and those on its
+     * Class-Path.
+     */
+    private static URLClassLoader loader(String jar) throws IOException {
+        return new URLClassLoader(new URL[] {new File(jar).toURI().toURL()},
+                                  ClassLoader.getPlatformClassLoader());
+    }
+
+    /*
+     * What gets run by run: a main method or some such, returning the
+     * exit status.
+     */
+    private interface Invocation {
+        int invoke() throws ReflectiveOperationException;
+    }
+
+    /*
+     * Runs the invocation with stdin, stdout and stderr redirected. It runs
+     * in a thread of its own, called main, so that it can be timed out (0
+     * for no timeout), in a thread group of its own so that the threads it
+     * starts can be waited for. Uncaught exceptions are reported as the
+     * JVM would, their stack traces ending with the main method of
+     * mainClass (if any) rather than with the worker's own frames.
+     */
+    private static int run(ClassLoader loader, Invocation invocation, String mainClass, String stdin,
+                           long timeout, ByteArrayOutputStream out, ByteArrayOutputStream err)
+            throws IOException, InterruptedException {
+        InputStream stdinBefore = System.in;
+        PrintStream stdoutBefore = System.out;
+        PrintStream stderrBefore = System.err;
+        PrintStream stdout = new PrintStream(out, true, "UTF-8");
+        PrintStream stderr = new PrintStream(err, true, "UTF-8");
+        long deadline = timeout > 0 ? System.currentTimeMillis() + timeout : 0;
+        threadsLeft = false;
+        try {
+            System.setIn(new ByteArrayInputStream(stdin.getBytes(StandardCharsets.UTF_8)));
+            System.setOut(stdout);
+            System.setErr(stderr);
+            int[] status = new int[1];
+            Throwable[] uncaught = new Throwable[1];
+            ThreadGroup group = new ThreadGroup("main");
+            Thread runner = new Thread(group, () -> {
+                try {
+                    status[0] = invocation.invoke();
+                } catch (InvocationTargetException e) {
+                    uncaught[0] = e.getCause();
+                } catch (ReflectiveOperationException e) {
+                    uncaught[0] = e;
+                }
+            }, "main");
+            runner.setContextClassLoader(loader);
+            // not a daemon, like the JVM's main, so neither are the threads it starts
+            runner.setDaemon(false);
+            runner.start();
+            runner.join(timeout);
+            if (runner.isAlive()) {
+                return TIMED_OUT;
+            }
+            if (uncaught[0] != null) {
+                // what the JVM would print for an uncaught exception
+                trim(uncaught[0], mainClass, Collections.newSetFromMap(new IdentityHashMap<>()));
+                stderr.print("Exception in thread \"main\" ");
+                uncaught[0].printStackTrace(stderr);
+                status[0] = 1;
+            }
+            if (!awaitThreads(group, deadline)) {
+                return TIMED_OUT;
+            }
+            threadsLeft = live(group, true).length > 0;
+            return status[0];
+        } finally {
+            stdout.flush();
+            stderr.flush();
+            System.setIn(stdinBefore);
+            System.setOut(stdoutBefore);
+            System.setErr(stderrBefore);
+        }
+    }
+
+    /*
+     * Cuts the frames below the main method of mainClass (reflection, the
+     * worker's) off the stack trace, and off those of its causes and
+     * suppressed exceptions.
+     */
+    private static void trim(Throwable thrown, String mainClass, Set<Throwable> seen) {
+        if (thrown == null || mainClass == null || !seen.add(thrown)) {
+            return;
+        }
+        StackTraceElement[] trace = thrown.getStackTrace();
+        for (int i = trace.length - 1; i >= 0; i--) {
+            if (trace[i].getClassName().equals(mainClass) && trace[i].getMethodName().equals("main")) {
+                thrown.setStackTrace(Arrays.copyOf(trace, i + 1));
+                break;
+            }
+        }
+        trim(thrown.getCause(), mainClass, seen);
+        for (Throwable suppressed : thrown.getSuppressed()) {
+            trim(suppressed, mainClass, seen);
+        }
+    }
+
+    /*
+     * Waits, as the JVM would before exiting, for the threads of the group
+     * that aren't daemons, until the deadline (0 for none).
+     * Returns whether they're all done.
+     */
+    private static boolean awaitThreads(ThreadGroup group, long deadline) throws InterruptedException {
+        while (true) {
+            Thread[] threads = live(group, false);
+            if (threads.length == 0) {
+                return true;
+            }
+            long left = deadline == 0 ? 0 : deadline - System.currentTimeMillis();
+            if (deadline != 0 && left <= 0) {
+                return false;
+            }
+            threads[0].join(left);
+        }
+    }
+
+    /*
+     * The threads of the group still going, daemons too or not.
+     */
+    private static Thread[] live(ThreadGroup group, boolean daemons) {
+        Thread[] threads = new Thread[group.activeCount() + 16];
+        int count = group.enumerate(threads, true);
+        return Arrays.stream(threads, 0, count)
+            .filter(thread -> thread.isAlive() && (daemons || !thread.isDaemon()))
+            .toArray(Thread[]::new);
+    }
+}
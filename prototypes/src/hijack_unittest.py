@@ -7,25 +7,299 @@ and prints an ***Error*** message. This interferes with unittest's
 expected output.
 Second, unittest outputs the time taken for tests. This has to be neutralized
 because it can vary for different users.
+
+The tests are run with a result that records the outcome and duration of
+each test as it goes, and the report is put together from what's been
+recorded, with the time taken written as X.XXX from the start.
+The TestCase classes can also be spread over a pool of processes.
+The tests can also be profiled, out of sight of the graded output: wall
+and CPU time, peak memory and the time taken by setUp and tearDown for
+each test are appended, a JSON line per test, to the file given by the
+HIJACK_PROFILE environment variable (or the profile argument).
 :author: Peter Sander
 '''
 import contextlib
 import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+import tracemalloc
 import unittest
+import warnings
+
+# the tests of each TestCase class, for the processes of the pool to run
+_groups = []
+# whether the tests are being profiled
+_profiling = False
+
+
+def hijack(as_json=False, processes=None, profile=None):
+    '''Runs all the tests in the main module and prints the report
+    TextTestRunner would, bar the time taken. Or, as_json, the outcome
+    and duration of each test.
+    With processes, the TestCase classes are run in parallel in that many
+    processes (forked, so the main module doesn't need importing again),
+    for test classes that don't depend on one another.
+    With a profile file (by default, $HIJACK_PROFILE, if set), the tests'
+    profiles get appended to it.
+    '''
+    global _profiling
+    profile = profile or os.environ.get('HIJACK_PROFILE')
+    _profiling = bool(profile)
+    # find all tests in the main module - looked up now rather than when
+    # imported, as a forkserver may have imported this long before
+    suite = unittest.TestLoader().loadTestsFromModule(sys.modules['__main__'])
+    if processes:
+        _groups[:] = _by_class(suite)
+        with multiprocessing.get_context('fork').Pool(processes) as pool:
+            runs = pool.map(_run_group, range(len(_groups)))
+    else:
+        runs = [_run(suite)]
+    if profile:
+        _write_profile(profile, runs)
+    if as_json:
+        print(json.dumps(_summary(runs), indent=2))
+    else:
+        print(_report(runs))
+
+
+def _write_profile(profile, runs):
+    '''Appends a JSON line per test to the profile file.
+    Profiling is no reason to fail the tests, hence the silence if the
+    file can't be written to.
+    '''
+    try:
+        with open(profile, 'a') as f:
+            for run in runs:
+                for record in run['records']:
+                    print(json.dumps(record), file=f)
+    except OSError:
+        pass
+
+
+def _by_class(suite):
+    '''Splits the suite up into a suite per TestCase class, in the order
+    the classes come in.
+    '''
+    groups = {}
+    for test in _flatten(suite):
+        groups.setdefault(type(test), unittest.TestSuite()).addTest(test)
+    return list(groups.values())
+
+
+def _flatten(suite):
+    '''The tests in a suite, suites within it included.
+    '''
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            yield from _flatten(test)
+        else:
+            yield test
 
-# find all tests in this module
-import __main__
 
-def hijack():
-    suite = unittest.TestLoader().loadTestsFromModule(__main__)
+def _run_group(i):
+    return _run(_groups[i])
+
+
+def _run(suite):
+    '''Runs a suite, catching everything it prints.
+    Returns what's needed to report on it, as plain data so that it can
+    be sent back from another process.
+    '''
     with io.StringIO() as buf:
-        # run the tests
-        with contextlib.redirect_stdout(buf):
-            unittest.TextTestRunner(stream=buf).run(suite)
-        # process the results - neutralise the time taken
-        # since this can vary depending on the phases of the moon
-        result = buf.getvalue()
-        start = result.find(' in ') + len(' in ')
-        end = result.find('s', start, len(result))
-        result = result.replace(result[start:end], 'X.XXX')
-        print(result)
\ No newline at end of file
+        result = _Result(_Stream(buf), True, 1)
+        with contextlib.redirect_stdout(buf), warnings.catch_warnings():
+            # as TextTestRunner does
+            if not sys.warnoptions:
+                warnings.simplefilter('default')
+            tracing = _profiling and not tracemalloc.is_tracing()
+            if tracing:
+                tracemalloc.start()
+            result.startTestRun()
+            try:
+                suite(result)
+            finally:
+                result.stopTestRun()
+                if tracing:
+                    tracemalloc.stop()
+        return {
+            'progress': buf.getvalue(),
+            'run': result.testsRun,
+            'errors': [(result.getDescription(test), text)
+                       for test, text in result.errors],
+            'failures': [(result.getDescription(test), text)
+                         for test, text in result.failures],
+            'unexpected_successes': [result.getDescription(test)
+                                     for test in result.unexpectedSuccesses],
+            'expected_failures': len(result.expectedFailures),
+            'skipped': len(result.skipped),
+            'records': result.records,
+        }
+
+
+def _report(runs):
+    '''What TextTestRunner would have printed for the runs, put together,
+    with X.XXX for the time taken.
+    '''
+    separator1, separator2 = '=' * 70, '-' * 70
+    lines = [''.join(run['progress'] for run in runs)]
+    for flavour, key in (('ERROR', 'errors'), ('FAIL', 'failures')):
+        for run in runs:
+            for description, text in run[key]:
+                lines += [separator1, '%s: %s' % (flavour, description),
+                          separator2, text]
+    unexpected_successes = [description for run in runs
+                            for description in run['unexpected_successes']]
+    if unexpected_successes:
+        lines.append(separator1)
+        lines += ['UNEXPECTED SUCCESS: %s' % description
+                  for description in unexpected_successes]
+    summary = _summary(runs)
+    lines += [separator2, 'Ran %d test%s in X.XXXs' % (
+        summary['run'], '' if summary['run'] == 1 else 's'), '']
+    infos = []
+    if summary['successful']:
+        status = 'OK'
+    else:
+        status = 'FAILED'
+        if summary['failures']:
+            infos.append('failures=%d' % summary['failures'])
+        if summary['errors']:
+            infos.append('errors=%d' % summary['errors'])
+    for key, name in (('skipped', 'skipped'),
+                      ('expected_failures', 'expected failures'),
+                      ('unexpected_successes', 'unexpected successes')):
+        if summary[key]:
+            infos.append('%s=%d' % (name, summary[key]))
+    lines.append('%s (%s)' % (status, ', '.join(infos)) if infos else status)
+    return '\n'.join(lines) + '\n'
+
+
+def _summary(runs):
+    '''The counts for the runs, put together, and a record per test.
+    '''
+    summary = {'run': sum(run['run'] for run in runs)}
+    for key in ('errors', 'failures', 'unexpected_successes'):
+        summary[key] = sum(len(run[key]) for run in runs)
+    for key in ('expected_failures', 'skipped'):
+        summary[key] = sum(run[key] for run in runs)
+    summary['successful'] = not (summary['errors'] or summary['failures']
+                                 or summary['unexpected_successes'])
+    # profiles are kept out of it
+    summary['tests'] = [{key: record[key]
+                         for key in ('test', 'outcome', 'duration')}
+                        for run in runs for record in run['records']]
+    return summary
+
+
+class _Stream:
+    '''What TextTestResult expects to write to.
+    '''
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        self.stream.write(text)
+
+    def writeln(self, text=''):
+        self.stream.write(text + '\n')
+
+    def flush(self):
+        self.stream.flush()
+
+
+class _Result(unittest.TextTestResult):
+    '''Records the outcome and duration of each test as it's run:
+    records are dicts of the test's id, outcome (success, failure, error,
+    skipped, expected failure or unexpected success) and duration (s).
+    Errors outside of tests (eg, in setUpClass) get a record too.
+    When profiling, records also get the test's CPU time (s), peak memory
+    allocated over what there was at the start (bytes, as traced by
+    tracemalloc), and the time its setUp and tearDown took (s).
+    '''
+
+    def __init__(self, stream, descriptions, verbosity):
+        super().__init__(stream, descriptions, verbosity)
+        self.records = []
+        self._start = None
+
+    def startTest(self, test):
+        self.records.append({'test': test.id(), 'outcome': 'success',
+                             'duration': 0.0})
+        if _profiling:
+            self._profile(test, self.records[-1])
+        self._start = time.perf_counter()
+        super().startTest(test)
+
+    def stopTest(self, test):
+        super().stopTest(test)
+        record = self.records[-1]
+        record['duration'] = time.perf_counter() - self._start
+        if _profiling:
+            record['cpu'] = time.process_time() - record['cpu']
+            if tracemalloc.is_tracing():
+                record['memory'] = tracemalloc.get_traced_memory()[1] \
+                    - record['memory']
+
+    def _profile(self, test, record):
+        '''Starts profiling a test: times its setUp and tearDown (by
+        wrapping them for this test only), and starts counting CPU time
+        and memory.
+        '''
+        for fixture in ('setUp', 'tearDown'):
+            record[fixture] = 0.0
+            setattr(test, fixture,
+                    _timed(getattr(test, fixture), record, fixture))
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            record['memory'] = tracemalloc.get_traced_memory()[0]
+        record['cpu'] = time.process_time()
+
+    def _outcome(self, test, outcome):
+        if self.records and self.records[-1]['test'] == test.id():
+            self.records[-1]['outcome'] = outcome
+        else:
+            self.records.append({'test': test.id(), 'outcome': outcome,
+                                 'duration': 0.0})
+
+    def addError(self, test, err):
+        super().addError(test, err)
+        self._outcome(test, 'error')
+
+    def addFailure(self, test, err):
+        super().addFailure(test, err)
+        self._outcome(test, 'failure')
+
+    def addSubTest(self, test, subtest, err):
+        super().addSubTest(test, subtest, err)
+        if err is not None:
+            self._outcome(test, 'failure'
+                          if issubclass(err[0], test.failureException)
+                          else 'error')
+
+    def addSkip(self, test, reason):
+        super().addSkip(test, reason)
+        self._outcome(test, 'skipped')
+
+    def addExpectedFailure(self, test, err):
+        super().addExpectedFailure(test, err)
+        self._outcome(test, 'expected failure')
+
+    def addUnexpectedSuccess(self, test):
+        super().addUnexpectedSuccess(test)
+        self._outcome(test, 'unexpected success')
+
+
+def _timed(fixture, record, key):
+    '''The fixture, recording the time it takes in the record.
+    '''
+    def timed():
+        start = time.perf_counter()
+        try:
+            fixture()
+        finally:
+            record[key] = time.perf_counter() - start
+    return timed
@@ -36,6 +36,9 @@ Works (mostly) by:
 - compiling Tester.java and then delegating static code analysis
   heavy lifting to FindBugs (see below in this file)
   - see http://findbugs.sourceforge.net/
+- optionally handing the compiling and running over to a long-lived
+  worker JVM instead of starting fresh JVMs every time
+  - see CheckrWorker.java
 
 Limitations and works-by are sufficient for my current needs;
 I may gradually be adding additional stuff.
@@ -43,10 +46,32 @@ I may gradually be adding additional stuff.
 (cc) CC BY-NC 4.0 2016-2020 Peter Sander
 '''
 
+import concurrent.futures
+import contextlib
+import functools
+import glob
+import hashlib
+import hmac
+import io
+import json
+import locale
 import os
 import re
+import resource
+import secrets
+import selectors
+import shutil
+import signal
+import socket
+import stat
+import struct
 import subprocess
 import sys
+import tempfile
+import time
+import traceback
+import xml.etree.ElementTree
+import zipfile
 
 
 # arbitrary names
@@ -56,31 +81,185 @@ _testfile = 'Tester.java'
 
 # to be adapted to wherever your findbugs stuff lives
 _findbugs = '/opt/findbugs-3.0.1/lib/findbugs.jar'
+# the FindBugs filter, a support file
+_findbugs_filter = 'fb_exclude_filter.xml'
 
 # to be adapted to wherever your junit stuff lives
 # note that we're taling JUnit5 here
 _junit = '/usr/share/java/junit-platform-console-standalone.jar'
 
+# host:port of a running CheckrWorker, eg, localhost:7878
+# if not set, or if nothing's listening there, javac and java get started
+# as subprocesses
+_worker = os.environ.get('JAVA_CHECKR_WORKER')
+
+# compiled Tester classes (and compile errors) are cached here, keyed by
+# what went into the compilation - set to '' to do without
+# only a directory of the user's own, that no one else can write to, is
+# used
+_cache_dir = os.environ.get(
+    'JAVA_CHECKR_CACHE',
+    os.path.join(tempfile.gettempdir(),
+                 'java_code_checkr_cache-%d' % os.getuid()))
+# student code runs as the grader, so it could write to the cache too:
+# entries are signed with this key, and not used unless the signature
+# checks out
+# the key's taken from the environment (and out of it, so that the
+# processes started don't get it) for a cache shared by the grading
+# processes that have it; failing that, a key of the process's own makes
+# for a cache of the process's own
+_cache_secret = os.environ.pop('JAVA_CHECKR_CACHE_KEY', '').encode('utf-8') \
+    or secrets.token_bytes(32)
+# the least recently used entries go once the cache grows past this
+_cache_size = 256 * 1024 * 1024
+
+# assembled support files, for as long as they stay the same
+_support_memo = {}
+
+# digests of files read over and over, by path, for as long as they stay
+# the same
+_digest_memo = {}
+
+# where the per-call workspaces go: tmpfs if there is one, else the
+# usual temp directory
+_workspace_root = os.environ.get(
+    'JAVA_CHECKR_WORKSPACE',
+    '/dev/shm' if os.access('/dev/shm', os.W_OK) else None)
+
+# limits on the javac, java and FindBugs processes, for each phase:
+# - wall: wall-clock time (s)
+# - cpu: CPU time (s)
+# - memory: heap size for the JVM (bytes)
+# - processes: processes (threads included) for the user (beware, JVMs
+#   need a few dozen threads)
+# - output: stdout and stderr between them (bytes), past which the
+#   process is killed and the rest of its output dropped
+# None for no limit
+_limits = {
+    'compile': {'wall': 60, 'cpu': 60,
+                'memory': 1024 * 1024 * 1024, 'processes': None,
+                'output': 4 * 1024 * 1024},
+    'run': {'wall': 10, 'cpu': 10,
+            'memory': 512 * 1024 * 1024, 'processes': None,
+            'output': 4 * 1024 * 1024},
+    'analysis': {'wall': 120, 'cpu': 120,
+                 'memory': 1024 * 1024 * 1024, 'processes': None,
+                 'output': 4 * 1024 * 1024},
+}
+
+# printed in place of the output of a test that went past its limits
+_time_limit_message = '** Time limit exceeded **'
+_memory_limit_message = '** Memory limit exceeded **'
+_output_limit_message = '** Output limit exceeded **'
+
+# exit status of the worker for a test that ran out of time
+_worker_timed_out = 124
+
+
+# what Java source gets split up into by _tokenize
+_token_pattern = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<comment>//[^\n]*|/\*.*?(?:\*/|\Z))
+  | (?P<string>"""(?:\\.|.)*?(?:"""|\Z)
+      | "(?:\\.|[^"\\\n])*"?
+      | '(?:\\.|[^'\\\n])*'?)
+  | (?P<word>(?:[^\W\d]|\$)[\w$]*)
+  | (?P<number>\.?\d[\w.]*)
+  | (?P<symbol>->|::|\.\.\.|.)
+''', re.VERBOSE | re.DOTALL)
+
+# the JUnit5 annotations that make a test
+_test_annotations = {'Test', 'ParameterizedTest', 'RepeatedTest',
+                     'TestFactory', 'TestTemplate'}
+
+# what may come between public and the kind of type being declared
+_type_modifiers = {'abstract', 'final', 'static', 'strictfp',
+                   'sealed', 'non', '-', '@'}
+
+
+@functools.lru_cache(maxsize=16)
+def _tokenize(source):
+    '''Splits Java source up into (kind, text, start) tokens in a single
+    pass, kind being one of space, comment, string (including char
+    literals and text blocks), word (identifiers and keywords), number
+    and symbol. Unterminated comments and literals just run to the end
+    (of the source or line), so this is linear whatever the input.
+    Tokens are cached so that the passes over one answer share the scan.
+    '''
+    return tuple((m.lastgroup, m.group(), m.start())
+                 for m in _token_pattern.finditer(source))
+
+
+@functools.lru_cache(maxsize=16)
+def _code_tokens(source):
+    '''The tokens of the source less spaces and comments.
+    '''
+    return tuple(token for token in _tokenize(source)
+                 if token[0] not in ('space', 'comment'))
+
+
+def _declares_type(code, i):
+    '''Whether the code tokens from i on declare a class, interface,
+    enum or record, perhaps after some more modifiers.
+    '''
+    while i < len(code):
+        text = code[i][1]
+        if text in ('class', 'interface', 'enum'):
+            return True
+        if text == 'record':
+            return i + 1 < len(code) and code[i + 1][0] == 'word'
+        if text not in _type_modifiers:
+            return False
+        i += 1
+    return False
+
+
+def _cruft_free(student_answer):
+    '''Filters the student answer, mostly to get rid of expressions
+    and keywords that would be incompatible with all the code being
+    smushed into one single file:
+    - public goes from class, interface, enum and record declarations
+    - package and import declarations get commented out
+    Goes by the tokens so that comments and string literals are left be.
+    Returns the filtered answer in pieces, ready for joining.
+    '''
+    pieces = []
+    done = 0
+    depth = 0
+    previous = ';'
+    code = _code_tokens(student_answer)
+    for i, (kind, text, start) in enumerate(code):
+        if kind == 'word':
+            if text in ('package', 'import') \
+                    and depth == 0 and previous in (';', '}'):
+                pieces += [student_answer[done:start], '// ']
+                done = start
+            elif text == 'public' and _declares_type(code, i + 1):
+                pieces.append(student_answer[done:start])
+                done = start + len(text)
+                # along with the spaces after it, but not the newlines
+                while student_answer[done:done + 1] in (' ', '\t'):
+                    done += 1
+        elif text == '{':
+            depth += 1
+        elif text == '}':
+            depth = max(depth - 1, 0)
+        previous = text
+    pieces.append(student_answer[done:])
+    return pieces
+
 
 def _remove_cruft(student_answer):
     '''Filters the student answer, mostly to get rid of expressions
     and keywords that would be incompatible with all the code being
-    smushed into one single file.
+    smushed into one single file (see _cruft_free).
     '''
-    return student_answer \
-        .replace('public class ', 'class ') \
-        .replace('public abstract class ', 'abstract class ') \
-        .replace('abstract public class ', 'abstract class ') \
-        .replace('public final class ', 'final class ') \
-        .replace('final public class ', 'final class ') \
-        .replace('public interface ', 'interface ') \
-        .replace('public enum ', 'enum ') \
-        .replace('package ', '// package ') \
-        .replace('import ', '// import ')
+    return ''.join(_cruft_free(student_answer))
 
 
-def _add_cruft(student_answer, import_static=None):
-    '''Adds expressions needed for the single code file.
+def _cruft(import_static=None):
+    '''Expressions needed for the single code file, to go before the
+    student answer.
     Code goes into an arbitrary package because Java hates
     having code in the default package (with nasty things happening
     to import static statements).
@@ -116,38 +295,146 @@ import static org.junit.jupiter.api.Assertions.fail;
 // if you need a static import, it'll be put here
 %s
 // finally, the student-submitted code
-%s
-""" % (_package, import_static, student_answer)
+""" % (_package, import_static)
+
+
+def _add_cruft(student_answer, import_static=None):
+    '''Adds expressions needed for the single code file.
+    '''
+    return ''.join((_cruft(import_static), student_answer, '\n'))
 
 
 def _assemble_student_answer(student_answer, import_static=None):
-    '''Removes 'unneeded' expressions and adds necessary expressions.
+    '''Removes 'unneeded' expressions and adds necessary expressions,
+    in one go.
+    '''
+    return ''.join([_cruft(import_static),
+                    *_cruft_free(student_answer), '\n'])
+
+
+def _support_signature():
+    '''Identifies the current state of the support files: their names,
+    modification times and sizes.
+    Leaves out the tester file left behind by a previous run.
     '''
-    return _add_cruft(_remove_cruft(student_answer), import_static)
+    with os.scandir() as scan:
+        return tuple(sorted(
+            (f.name, f.stat().st_mtime_ns, f.stat().st_size)
+            for f in scan
+            if f.name.endswith('.java') and f.name != _testfile
+            and f.is_file()))
 
 
 def _assemble_support_files(ncoding='utf-8'):
     '''Inputs support files, assembles files into a string,
     then filters out cruft.
+    The result is kept for as long as the support files don't change.
+    '''
+    key = (_support_signature(), ncoding)
+    if key not in _support_memo:
+        support_files = []
+        for name, _, _ in key[0]:
+            with open(name, encoding=ncoding) as f:
+                support_files.append(f.read())
+        _support_memo.clear()
+        _support_memo[key] = _remove_cruft('\n\n\n'.join(support_files))
+    return _support_memo[key]
+
+
+def _support_library(support_files, ncoding='utf-8', workspace='.'):
+    '''Compiles the (assembled) support files once and for all into a
+    jar in the cache, so that only the student answer and tester class
+    need compiling for each test.
+    Returns the jar, copied into the workspace once its signature checks
+    out, or None if there's no cache or the support files can't be
+    compiled on their own (eg, they use classes from the student answer),
+    in which case they get smushed in with the student answer as usual.
+    '''
+    cache = _trusted_cache()
+    if not cache or not support_files.strip():
+        return None
+    digest = hashlib.sha256()
+    for part in (_javac_identity(), _junit, ncoding, support_files):
+        digest.update(part.encode('utf-8') + b'\0')
+    name = 'support-%s' % digest.hexdigest()
+    library = os.path.join(os.path.abspath(workspace), name + '.jar')
+    jar = _cache_read(name + '.jar')
+    if jar is None:
+        # a forged one would only mean compiling the support files with
+        # the student answer
+        if os.path.exists(os.path.join(cache, name + '.failed')):
+            return None
+        try:
+            build = tempfile.mkdtemp(dir=cache, prefix='.new-')
+        except OSError:
+            return None
+        try:
+            source = os.path.join(build, 'Support.java')
+            with open(source, mode='w', encoding=ncoding) as f:
+                print(_add_cruft(support_files), file=f)
+            classes = os.path.join(build, 'classes')
+            os.mkdir(classes)
+            status, _, _ = _javac_into(classes, ncoding, source)
+            if status:
+                # not to be tried again
+                open(os.path.join(cache, name + '.failed'), 'w').close()
+                return None
+            built = io.BytesIO()
+            with zipfile.ZipFile(built, 'w') as z:
+                for path, _, files in os.walk(classes):
+                    for f in files:
+                        z.write(os.path.join(path, f), os.path.relpath(
+                            os.path.join(path, f), classes))
+            jar = built.getvalue()
+            _cache_write(name + '.jar', jar)
+        except OSError:
+            return None
+        finally:
+            shutil.rmtree(build, ignore_errors=True)
+    try:
+        with open(library, 'wb') as f:
+            f.write(jar)
+    except OSError:
+        return None
+    return library
+
+
+def _test_body(testcode, xception=None):
+    '''The code run for one test case: the test code itself or,
+    when the student answer is expected to throw an exception,
+    the test code wrapped up to check for that exception.
+    '''
+    if not xception:
+        # not expecting to deal with exceptions
+        return testcode
+    # expecting student answer to throw an exception
+    return '''try {
+            %s
+            // this is not normal - we were expecting an exception
+            System.out.println("Didn't raise any exception");
+        } catch (%s e) {
+            System.out.println(e.getMessage());
+        } catch (Exception e) {
+            System.out.println("Didn't raise expected %s");
+        }''' % (testcode, xception, xception)
+
+
+def _write_tester(tester, ncoding='utf-8', workspace='.'):
+    '''Writes out the string containing all the classes into a file.
     '''
-    support_files = '\n\n\n'.join([
-        open(f, encoding=ncoding).read()
-        for f in os.listdir()
-        if f.endswith('.java')
-    ])
-    return _remove_cruft(support_files)
+    with open(os.path.join(workspace, _testfile), mode='w',
+              encoding=ncoding) as f:
+        print(tester, file=f)
 
 
 def _assemble_tester(student_answer, testcode, support_files,
-                     xception=None, ncoding='utf-8'):
+                     xception=None, ncoding='utf-8', workspace='.'):
     '''Smushes student answer and support files together with an
     executable tester class and writes everything out into one file.
     The resultant code goes into an arbitrary package because
     Java just doesn't like code in the default package.
     '''
-    if not xception:
-        # not expecting to deal with exceptions
-        tester = '''
+    _write_tester('''
 %s
 %s
 public class Tester {
@@ -155,97 +442,986 @@ public class Tester {
         %s
     }
 }
-''' % (student_answer, support_files, testcode)
+''' % (student_answer, support_files, _test_body(testcode, xception)),
+        ncoding, workspace)
 
-    else:
-        # expecting student answer to throw an exception
-        tester = '''
+
+def _assemble_batch_tester(student_answer, testcodes, support_files,
+                           xception=None, ncoding='utf-8', workspace='.'):
+    '''As _assemble_tester, but for a whole batch of test cases.
+    Each test case gets its own method. The main method runs the
+    cases from args[0] on, each one:
+    - in a fresh class loader, so statics start afresh as they would
+      in a JVM of its own
+    - in its own thread called main, so an uncaught exception is
+      reported just as the JVM would report it, its stack trace made to
+      look as it would in a tester of its own: the test method becomes
+      main again, with the same line numbers, and the frames of the
+      batch machinery below it go
+    - with a timeout of args[2] ms (0 for none)
+    - preceded on stdout and stderr by a marker made of args[1] and
+      the case number, so that the output can be split up again
+    '''
+    # where the test code would be in a tester of its own...
+    main_line = ('\n%s\n%s\npublic class Tester {\n'
+                 '    public static void main(String[] args) {\n'
+                 % (student_answer, support_files)).count('\n') + 1
+    # ...and where each test case's is in this one
+    tests = ''
+    first_lines, last_lines = [], []
+    line = ('\n%s\n%s\npublic class Tester {\n'
+            % (student_answer, support_files)).count('\n') + 1
+    for i, testcode in enumerate(testcodes):
+        test = '''
+    public static void test%d(String[] args) {
+        %s
+    }
+''' % (i, _test_body(testcode, xception))
+        first_lines.append(line + 2)
+        line += test.count('\n')
+        last_lines.append(line - 2)
+        tests += test
+    _write_tester('''
 %s
 %s
 public class Tester {
-    public static void main(String[] args) {
-        try {
-            %s
-            // this is not normal - we were expecting an exception
-            System.out.println("Didn't raise any exception");
-        } catch (%s e) {
-            System.out.println(e.getMessage());
-        } catch (Exception e) {
-            System.out.println("Didn't raise expected %s");
+%s
+    public static void main(String[] args) throws Exception {
+        String marker = args[1];
+        long timeout = Long.parseLong(args[2]);
+        String[] path = System.getProperty("java.class.path")
+            .split(java.io.File.pathSeparator);
+        java.net.URL[] urls = new java.net.URL[path.length];
+        for (int i = 0; i < path.length; i++) {
+            urls[i] = new java.io.File(path[i]).toURI().toURL();
+        }
+        for (int i = Integer.parseInt(args[0]); i < %d; i++) {
+            System.out.print(marker + i + marker);
+            System.out.flush();
+            System.err.print(marker + i + marker);
+            System.err.flush();
+            int number = i;
+            java.lang.reflect.Method test = new java.net.URLClassLoader(
+                    urls, ClassLoader.getPlatformClassLoader())
+                .loadClass("%s").getMethod("test" + i, String[].class);
+            java.lang.Thread thread = new java.lang.Thread(() -> {
+                try {
+                    test.invoke(null, (Object) new String[0]);
+                } catch (java.lang.reflect.InvocationTargetException e) {
+                    Throwable uncaught = e.getCause();
+                    asOwnTester(uncaught, test.getDeclaringClass(), number,
+                                new java.util.IdentityHashMap<>());
+                    System.err.print("Exception in thread \\"main\\" ");
+                    uncaught.printStackTrace();
+                } catch (IllegalAccessException e) {
+                    throw new IllegalStateException(e);
+                }
+            }, "main");
+            thread.start();
+            thread.join(timeout);
+            System.out.flush();
+            if (thread.isAlive()) {
+                System.err.println("%s");
+                System.err.flush();
+                // the only sure way of stopping the test
+                Runtime.getRuntime().halt(1);
+            }
+        }
+    }
+
+    // lines of the code of each test, and of the code of a tester of
+    // its own
+    private static final int[] FIRST_LINES = {%s};
+    private static final int[] LAST_LINES = {%s};
+    private static final int MAIN_LINE = %d;
+
+    // the stack traces of an exception (its causes and suppressed
+    // exceptions included) as they would be in a tester of its own
+    private static void asOwnTester(Throwable e, Class<?> tester, int test,
+                                    java.util.Map<Throwable, Object> seen) {
+        if (e == null || seen.put(e, e) != null) {
+            return;
+        }
+        StackTraceElement[] frames = e.getStackTrace();
+        int end = frames.length;
+        while (end > 0
+               && !(frames[end - 1].getClassName().equals(tester.getName())
+                    && frames[end - 1].getMethodName().equals("test" + test))) {
+            end--;
+        }
+        // no frames below the test method, if it's there at all
+        frames = java.util.Arrays.copyOf(frames, end > 0 ? end : frames.length);
+        for (int i = 0; i < frames.length; i++) {
+            frames[i] = asOwnTester(frames[i], tester, test);
+        }
+        e.setStackTrace(frames);
+        asOwnTester(e.getCause(), tester, test, seen);
+        for (Throwable suppressed : e.getSuppressed()) {
+            asOwnTester(suppressed, tester, test, seen);
+        }
+    }
+
+    // a frame of the test code as it would be in a tester of its own:
+    // in main (and main's lambdas, anonymous and local classes, numbered
+    // from the first of the test's), at the same line
+    private static StackTraceElement asOwnTester(StackTraceElement frame,
+                                                 Class<?> tester, int test) {
+        String name = frame.getClassName();
+        int line = frame.getLineNumber();
+        if (!(name.equals(tester.getName())
+              || name.startsWith(tester.getName() + "$"))
+            || line < FIRST_LINES[test] || line > LAST_LINES[test]) {
+            return frame;
+        }
+        String method = frame.getMethodName();
+        if (method.equals("test" + test)) {
+            method = "main";
+        } else if (method.startsWith("lambda$test" + test + "$")) {
+            int n = Integer.parseInt(
+                method.substring(method.lastIndexOf('$') + 1));
+            int before = 0;
+            for (java.lang.reflect.Method m : tester.getDeclaredMethods()) {
+                if (m.getName().startsWith("lambda$")
+                    && testOf(m.getName()) >= 0
+                    && testOf(m.getName()) < test) {
+                    before++;
+                }
+            }
+            method = "lambda$main$" + (n - before);
+        }
+        if (!name.equals(tester.getName())) {
+            // Tester$<n><local class name>[$<nested classes>]
+            String rest = name.substring(tester.getName().length() + 1);
+            int digits = 0;
+            while (digits < rest.length()
+                   && Character.isDigit(rest.charAt(digits))) {
+                digits++;
+            }
+            int nested = rest.indexOf('$', digits);
+            String local = rest.substring(digits,
+                                          nested < 0 ? rest.length() : nested);
+            if (digits > 0) {
+                int before = 0;
+                for (int k = 1; ; k++) {
+                    Class<?> c;
+                    try {
+                        c = Class.forName(tester.getName() + "$" + k + local,
+                                          false, tester.getClassLoader());
+                    } catch (ClassNotFoundException e) {
+                        break;
+                    }
+                    java.lang.reflect.Method enclosing = c.getEnclosingMethod();
+                    if (enclosing != null && testOf(enclosing.getName()) >= 0
+                        && testOf(enclosing.getName()) < test) {
+                        before++;
+                    }
+                }
+                name = tester.getName() + "$"
+                    + (Integer.parseInt(rest.substring(0, digits)) - before)
+                    + rest.substring(digits);
+            }
         }
+        return new StackTraceElement(
+            frame.getClassLoaderName(), frame.getModuleName(),
+            frame.getModuleVersion(), name, method, frame.getFileName(),
+            line - FIRST_LINES[test] + MAIN_LINE);
+    }
+
+    // the number of the test of a method: test3, lambda$test3$0... or -1
+    private static int testOf(String method) {
+        String name = method.startsWith("lambda$")
+            ? method.substring("lambda$".length()) : method;
+        int end = "test".length();
+        while (end < name.length() && Character.isDigit(name.charAt(end))) {
+            end++;
+        }
+        if (!name.startsWith("test") || end == "test".length()) {
+            return -1;
+        }
+        return Integer.parseInt(name.substring("test".length(), end));
     }
 }
-''' % (student_answer, support_files, testcode, xception, xception)
-    # write out the string containing all the classes into a file
-    with open(_testfile, mode='w', encoding=ncoding) as f:
-        print(tester, file=f)
+''' % (student_answer, support_files, tests, len(testcodes),
+           _testclass, _time_limit_message,
+           ', '.join(map(str, first_lines)), ', '.join(map(str, last_lines)),
+           main_line), ncoding, workspace)
+
+
+def _call(args, phase, cases=1, input=None):
+    '''Runs a child process within the limits for the phase (times and
+    output multiplied by the number of test cases it runs), its output
+    captured.
+    The whole process group is killed if it runs out of time, or prints
+    more than it may.
+    It's given input as its stdin if any, else it shares ours.
+    Returns its exit status, stdout and stderr, the latter ending with a
+    message when a limit was hit.
+    '''
+    limits = _limits[phase]
+    if limits['memory']:
+        heap = '-Xmx%dk' % (limits['memory'] // 1024)
+        args = args[:1] + ['-J' + heap if args[0] == 'javac' else heap] \
+            + args[1:]
+    wall = limits['wall'] * cases if limits['wall'] else None
+    output = limits['output'] * cases if limits['output'] else None
+    process = subprocess.Popen(
+        args, stdin=None if input is None else subprocess.PIPE,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        start_new_session=True,
+        preexec_fn=functools.partial(_set_rlimits, limits, cases))
+    with process:
+        encoding = locale.getpreferredencoding(False)
+        out, err, hit = _communicate(
+            process, None if input is None else input.encode(encoding),
+            wall, output)
+        if hit:
+            with contextlib.suppress(OSError):
+                os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+    # as text=True would have it
+    out, err = (data.decode(encoding, errors='replace')
+                .replace('\r\n', '\n').replace('\r', '\n')
+                for data in (out, err))
+    if hit:
+        return process.returncode, out, err + hit + '\n'
+    return (process.returncode, out,
+            _limit_messages(process.returncode, err, limits))
+
+
+def _communicate(process, input, wall, output):
+    '''Feeds the process its input and reads its stdout and stderr until it
+    closes them, as process.communicate would, but only for so long (wall
+    seconds) and so much (output bytes between the two).
+    Returns stdout, stderr and the message for the limit hit, if any.
+    '''
+    deadline = time.monotonic() + wall if wall else None
+    chunks = {process.stdout: [], process.stderr: []}
+    size = 0
+    with selectors.DefaultSelector() as selector:
+        for stream in chunks:
+            selector.register(stream, selectors.EVENT_READ)
+        if input is not None:
+            selector.register(process.stdin, selectors.EVENT_WRITE)
+            input = memoryview(input)
+        while selector.get_map():
+            timeout = None if deadline is None \
+                else deadline - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                return b''.join(chunks[process.stdout]), \
+                    b''.join(chunks[process.stderr]), _time_limit_message
+            for key, _ in selector.select(timeout):
+                if key.fileobj is process.stdin:
+                    try:
+                        input = input[os.write(key.fd, input[:65536]):]
+                    except BrokenPipeError:
+                        input = input[:0]
+                    if not input:
+                        selector.unregister(process.stdin)
+                        process.stdin.close()
+                    continue
+                chunk = os.read(key.fd, 65536)
+                if not chunk:
+                    selector.unregister(key.fileobj)
+                    continue
+                if output is not None and size + len(chunk) > output:
+                    chunks[key.fileobj].append(chunk[:output - size])
+                    return b''.join(chunks[process.stdout]), \
+                        b''.join(chunks[process.stderr]), \
+                        _output_limit_message
+                chunks[key.fileobj].append(chunk)
+                size += len(chunk)
+    out, err = b''.join(chunks[process.stdout]), \
+        b''.join(chunks[process.stderr])
+    # it may have closed them and still be going
+    try:
+        process.wait(None if deadline is None
+                     else max(deadline - time.monotonic(), 0))
+    except subprocess.TimeoutExpired:
+        return out, err, _time_limit_message
+    return out, err, None
+
+
+def _set_rlimits(limits, cases=1):
+    '''Sets the limits of a child process, just before it gets going.
+    The JVM manages its own memory (see -Xmx in _call): it reserves far
+    more address space than it uses, so RLIMIT_AS would only stop it
+    starting.
+    '''
+    if limits['cpu']:
+        cpu = limits['cpu'] * cases
+        # SIGXCPU when the time's up, SIGKILL if that's ignored
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu + 1))
+    if limits['processes']:
+        resource.setrlimit(resource.RLIMIT_NPROC,
+                           (limits['processes'], limits['processes']))
+
+
+def _limit_messages(status, err, limits):
+    '''Adds a message to stderr saying which limit a process hit, if any.
+    '''
+    if limits['cpu'] and status in (-signal.SIGXCPU, -signal.SIGKILL,
+                                    _worker_timed_out):
+        return err + _time_limit_message + '\n'
+    if 'java.lang.OutOfMemoryError' in err:
+        return err + _memory_limit_message + '\n'
+    return err
+
+
+def _worker_call(*fields, timeout=None):
+    '''Sends a request to the CheckrWorker, if there is one.
+    Returns (status, stdout, stderr), or None when there's no worker
+    to talk to (or it died on us, or didn't answer in time) so that the
+    caller can fall back to a subprocess.
+    '''
+    if not _worker:
+        return None
+    host, _, port = _worker.rpartition(':')
+    request = [struct.pack('>i', len(fields))]
+    for field in fields:
+        data = field.encode('utf-8')
+        request += [struct.pack('>i', len(data)), data]
+    try:
+        address = (host or 'localhost', int(port))
+        with socket.create_connection(address, timeout) as sock:
+            sock.sendall(b''.join(request))
+            with sock.makefile('rb') as response:
+                status, = struct.unpack('>i', response.read(4))
+                return (status, _read_blob(response), _read_blob(response))
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def _read_blob(response):
+    '''Reads one length-prefixed chunk of worker output.
+    '''
+    size, = struct.unpack('>i', response.read(4))
+    blob = response.read(size)
+    if len(blob) != size:
+        raise ValueError('truncated worker response')
+    return blob.decode('utf-8', errors='replace')
+
+
+def _echo(status, out, err):
+    '''Passes on output received from the worker as though it had come
+    straight from a subprocess.
+    '''
+    print(out, end='', flush=True)
+    print(err, end='', file=sys.stderr, flush=True)
+    return status
+
+
+def _stdin():
+    '''Standard input to hand on to the worker.
+    CodeRunner gives tests their stdin as a file; anything else
+    (a terminal, a pipe) isn't forwarded since reading it could block:
+    None then, and a subprocess shares our stdin instead.
+    '''
+    try:
+        if stat.S_ISREG(os.fstat(sys.stdin.fileno()).st_mode):
+            return sys.stdin.read()
+    except (AttributeError, OSError, ValueError):
+        pass
+    return None
+
+
+def _worker_can_run(workspace='.'):
+    '''Whether tests can run in the worker: it can't change directory, so
+    not when the current directory holds data files (anything but Java
+    source) that tests might open by a relative path.
+    '''
+    if not _worker:
+        return False
+    workspace = os.path.abspath(workspace)
+    with os.scandir() as scan:
+        return all(f.name.endswith('.java') or f.name == _findbugs_filter
+                   or os.path.abspath(f.path) == workspace for f in scan)
+
+
+def _javac(ncoding='utf-8', library=None, workspace='.'):
+    '''Compiles the tester file in the workspace (against the support
+    library, if any), unless the very same compilation is in the cache
+    already. The classes end up in the workspace too.
+    Returns javac's exit status and what it had to say on stdout and
+    stderr.
+    '''
+    workspace = os.path.abspath(workspace)
+    source = os.path.join(workspace, _testfile)
+    if not _trusted_cache():
+        return _javac_into(workspace, ncoding, source, library)
+    key = _cache_key(ncoding, library, workspace)
+    result = _cache_get(key, workspace)
+    if result is None:
+        # compile apart so as to know which classes came out of it
+        classes = tempfile.mkdtemp(prefix='classes-', dir=workspace)
+        try:
+            result = _javac_into(classes, ncoding, source, library)
+            _cache_put(key, result, classes)
+            _move_tree(classes, workspace)
+        finally:
+            shutil.rmtree(classes, ignore_errors=True)
+    return result
+
+
+def _javac_into(classes, ncoding='utf-8', source=_testfile, library=None):
+    '''Compiles the source file into the (absolute) classes directory,
+    in the worker if there is one.
+    '''
+    source = os.path.abspath(source)
+    args = ['-d', classes, '-encoding', ncoding,
+            '-cp', _classpath(_junit, library), source]
+    result = _worker_call('javac', *args, timeout=_limits['compile']['wall'])
+    if result is None:
+        result = _call(['javac'] + args, 'compile')
+    status, out, err = result
+    # javac needs absolute paths, students don't need to see them
+    return status, out, err.replace(os.path.dirname(source) + os.sep, '')
+
+
+def _javac_identity():
+    '''Identifies the compiler without starting up a JVM to ask it
+    its version: where javac really lives and when it was installed,
+    or which worker does the compiling.
+    '''
+    javac = shutil.which('javac')
+    if not javac:
+        return str(_worker)
+    javac = os.path.realpath(javac)
+    javac_stat = os.stat(javac)
+    return '%s %s %d %d' % (_worker, javac,
+                            javac_stat.st_mtime_ns, javac_stat.st_size)
+
+
+def _cache_key(ncoding='utf-8', library=None, workspace='.'):
+    '''Hash of everything that goes into compiling the tester file.
+    '''
+    digest = hashlib.sha256()
+    # the support library's named after its contents, wherever it is
+    for part in (_javac_identity(),
+                 _classpath(_junit, library and os.path.basename(library)),
+                 ncoding):
+        digest.update(part.encode('utf-8') + b'\0')
+    with open(os.path.join(workspace, _testfile), 'rb') as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _cache_get(key, workspace='.'):
+    '''Restores the classes of a cached compilation into the workspace
+    and returns its (status, stdout, stderr), or None if it isn't in the
+    cache.
+    '''
+    entry = _cache_read(key + '.zip')
+    if entry is None:
+        return None
+    try:
+        with zipfile.ZipFile(io.BytesIO(entry)) as z:
+            result = tuple(json.loads(z.read('result.json')))
+            z.extractall(workspace, [name for name in z.namelist()
+                                     if name != 'result.json'])
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return None
+    return result
+
+
+def _cache_put(key, result, classes):
+    '''Caches the result of a compilation and the classes it produced.
+    '''
+    entry = io.BytesIO()
+    with zipfile.ZipFile(entry, 'w') as z:
+        z.writestr('result.json', json.dumps(result))
+        for path, _, files in os.walk(classes):
+            for f in files:
+                z.write(os.path.join(path, f), os.path.relpath(
+                    os.path.join(path, f), classes))
+    _cache_write(key + '.zip', entry.getvalue())
+
+
+def _trusted_cache():
+    '''The cache directory, made if need be, or None if there's to be no
+    cache: none set, or one that can't be trusted - anything but a
+    directory of the user's own that no one else can write to.
+    '''
+    if not _cache_dir:
+        return None
+    try:
+        os.makedirs(_cache_dir, mode=0o700, exist_ok=True)
+        cache_stat = os.lstat(_cache_dir)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(cache_stat.st_mode) \
+            or cache_stat.st_uid != os.getuid() \
+            or cache_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        return None
+    return _cache_dir
+
+
+def _signature(name, data):
+    '''The signature of a cache entry, which goes for that entry only.
+    '''
+    return hmac.new(_cache_secret, name.encode('utf-8') + b'\0' + data,
+                    hashlib.sha256).digest()
+
+
+def _cache_read(name):
+    '''The contents of the cache entry called name, or None if there's
+    no such entry, or none to be trusted: in an untrusted cache, or not
+    signed as it should be.
+    '''
+    cache = _trusted_cache()
+    if not cache:
+        return None
+    path = os.path.join(cache, name)
+    try:
+        with open(path, 'rb') as f:
+            entry = f.read()
+    except OSError:
+        return None
+    signature, data = entry[:32], entry[32:]
+    if not hmac.compare_digest(signature, _signature(name, data)):
+        return None
+    # for the LRU
+    with contextlib.suppress(OSError):
+        os.utime(path)
+    return data
+
+
+def _cache_write(name, data):
+    '''Signs data and caches it as the entry called name, if there's a
+    cache to be trusted.
+    '''
+    cache = _trusted_cache()
+    if not cache:
+        return
+    try:
+        fd, new_entry = tempfile.mkstemp(dir=cache, prefix='.new-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_signature(name, data) + data)
+        os.replace(new_entry, os.path.join(cache, name))
+        _cache_evict()
+    except OSError:
+        # a cache that can't be written to is no reason to stop grading
+        pass
+
+
+def _cache_evict():
+    '''Evicts the least recently used entries until the cache is back
+    down to size.
+    '''
+    entries = []
+    with os.scandir(_cache_dir) as scan:
+        for entry in scan:
+            if entry.name.endswith(('.zip', '.jar', '.json')) \
+                    and not entry.name.startswith('.'):
+                entry_stat = entry.stat()
+                entries.append((entry_stat.st_mtime, entry_stat.st_size,
+                                entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= _cache_size:
+            break
+        with contextlib.suppress(OSError):
+            os.remove(path)
+        total -= size
+
+
+def _move_tree(source, destination):
+    '''Moves the files under source into the same places under
+    destination.
+    '''
+    for path, _, files in os.walk(source):
+        target = os.path.join(destination, os.path.relpath(path, source))
+        os.makedirs(target, exist_ok=True)
+        for f in files:
+            os.replace(os.path.join(path, f), os.path.join(target, f))
+
+
+def _compile(ncoding='utf-8', library=None, workspace='.'):
+    '''Compiles the tester file, passing on javac's output.
+    Returns javac's exit status.
+    '''
+    return _echo(*_javac(ncoding, library, workspace))
+
+
+def _classpath(*entries):
+    '''Joins up the classpath entries there are.
+    '''
+    return os.pathsep.join(entry for entry in entries if entry)
+
+
+def _java(library=None, workspace='.'):
+    '''The java command line for running classes in the workspace
+    (with the support library, if any).
+    '''
+    return ['java', '-cp', _classpath(workspace, library)]
+
+
+def _run(mainclass=_testclass, library=None, workspace='.'):
+    '''Runs the compiled tester class, in the worker if there is one.
+    '''
+    wall = _limits['run']['wall']
+    # read once, whichever runs it
+    stdin = _stdin()
+    result = None
+    if _worker_can_run(workspace):
+        result = _worker_call(
+            'java', _classpath(os.path.abspath(workspace), library),
+            mainclass, stdin or '', str(int((wall or 0) * 1000)),
+            # leave the worker time to say it's timed out
+            timeout=wall + 10 if wall else None)
+    if result is None:
+        return _echo(*_call(_java(library, workspace) + [mainclass], 'run',
+                            input=stdin))
+    status, out, err = result
+    return _echo(status, out, _limit_messages(status, err, _limits['run']))
+
+
+@contextlib.contextmanager
+def _workspace(workspace=None):
+    '''The directory for the files of one call: the tester file, its
+    classes, FindBugs output... so that calls don't trip over each other.
+    Without a given workspace, a fresh one is made, and cleaned up
+    afterwards.
+    Support files are still read from (and tests still run in) the
+    current directory.
+    '''
+    if workspace:
+        os.makedirs(workspace, exist_ok=True)
+        yield os.path.abspath(workspace)
+    else:
+        with tempfile.TemporaryDirectory(prefix='java_code_checkr-',
+                                         dir=_workspace_root) as workspace:
+            yield workspace
+
 
+def _assemble(student_answer, testcode, import_static=None, xception=None,
+              ncoding='utf-8', workspace='.'):
+    '''Assembles code (student answer, support files, tester class)
+    into the tester file.
+    Returns the support library the tester is to be compiled against,
+    or None if the support files are in the tester file itself.
+    '''
+    student_answer = _assemble_student_answer(student_answer, import_static)
+    support_files = _assemble_support_files(ncoding)
+    library = _support_library(support_files, ncoding, workspace)
+    _assemble_tester(student_answer, testcode,
+                     '' if library else support_files, xception, ncoding,
+                     workspace)
+    return library
 
-def compile_and_run(student_answer, testcode,
-                    import_static=None, xception=None, ncoding='utf-8'):
+
+def compile_and_run(student_answer, testcode, import_static=None,
+                    xception=None, ncoding='utf-8', workspace=None):
     '''Assembles code (student answer, support files, tester class.
     Then compiles and (hopefully) runs the tester code.
     '''
+    with _workspace(workspace) as workspace:
+        library = _assemble(student_answer, testcode,
+                            import_static, xception, ncoding, workspace)
+        if _compile(ncoding, library, workspace):
+            # code didn't compile
+            print('** Further testing aborted **', file=sys.stderr)
+        else:
+            _run(library=library, workspace=workspace)
+
+
+def compile_and_run_many(student_answer, testcodes, import_static=None,
+                         xception=None, timeout=None, separator=None,
+                         ncoding='utf-8', workspace=None):
+    '''Like compile_and_run for a whole list of test codes, but compiles
+    once and runs all the tests in one JVM, each test with its own
+    timeout (in seconds, by default the run wall-clock limit).
+    Returns a (stdout, stderr) pair per test, just as separate
+    compile_and_run calls would have printed.
+    With a separator, also prints the results separated by it, as
+    a CodeRunner combinator template expects.
+    '''
     student_answer = _assemble_student_answer(student_answer, import_static)
     support_files = _assemble_support_files(ncoding)
-    _assemble_tester(student_answer, testcode, support_files, xception)
-    if subprocess.call(['javac', '-d', '.', '-encoding', ncoding,
-                        '-cp', _junit, _testfile]):
-        # code didn't compile
-        print('** Further testing aborted **', file=sys.stderr)
-    else:
-        subprocess.call(['java', _testclass])
+    with _workspace(workspace) as workspace:
+        library = _support_library(support_files, ncoding, workspace)
+        if library:
+            support_files = ''
+        _assemble_batch_tester(student_answer, testcodes, support_files,
+                               xception, ncoding, workspace)
+        status, out, err = _javac(ncoding, library, workspace)
+        if status:
+            # maybe only some of the test codes don't compile
+            results = [_compile_and_run_one(student_answer, testcode,
+                                            support_files, xception,
+                                            ncoding, library, workspace)
+                       for testcode in testcodes]
+        else:
+            # every separate run would have had the compiler's output
+            results = [(out + case_out, err + case_err)
+                       for case_out, case_err in _run_many(
+                           len(testcodes), timeout, library, workspace)]
+    if separator is not None:
+        for i, (out, err) in enumerate(results):
+            if i:
+                print(separator, flush=True)
+            print(out, end='', flush=True)
+            print(err, end='', file=sys.stderr, flush=True)
+    return results
+
+
+def _compile_and_run_one(student_answer, testcode, support_files,
+                         xception=None, ncoding='utf-8', library=None,
+                         workspace='.'):
+    '''compile_and_run for a single test case of a batch, with the output
+    captured rather than printed.
+    '''
+    _assemble_tester(student_answer, testcode, support_files,
+                     xception, ncoding, workspace)
+    status, out, err = _javac(ncoding, library, workspace)
+    if status:
+        return out, err + '** Further testing aborted **\n'
+    _, java_out, java_err = _call(_java(library, workspace) + [_testclass],
+                                  'run')
+    return out + java_out, err + java_err
+
+
+def _run_many(count, timeout=None, library=None, workspace='.'):
+    '''Runs the compiled batch tester, returning each test case's output.
+    A test that stops the JVM (System.exit, running out of time...) only
+    stops that test: the JVM is restarted for the following tests.
+    '''
+    marker = '<<%s>>' % secrets.token_hex(8)
+    timeout = timeout or _limits['run']['wall']
+    millis = str(int(timeout * 1000) if timeout else 0)
+    results = [('', '')] * count
+    first = 0
+    while first < count:
+        _, out, err = _call(_java(library, workspace)
+                            + [_testclass, str(first), marker, millis],
+                            'run', count - first)
+        outs = _split_cases(out, marker, first)
+        errs = _split_cases(err, marker, first)
+        for case in set(outs) | set(errs):
+            results[case] = (outs.get(case, ''), errs.get(case, ''))
+        first = max(max(outs), max(errs)) + 1
+    return results
 
 
-def compile_and_findbugs(student_answer, testcode,
-                         import_static=None, xception=None, ncoding='utf-8'):
+def _split_cases(output, marker, first):
+    '''Splits batch tester output into {case number: output}.
+    Anything before the first marker (eg, JVM warnings) is put down to
+    the first case of the run.
+    '''
+    parts = re.split('%s(\\d+)%s' % (re.escape(marker), re.escape(marker)),
+                     output)
+    cases = {first: parts[0]}
+    for case, text in zip(parts[1::2], parts[2::2]):
+        cases[int(case)] = cases.get(int(case), '') + text
+    return cases
+
+
+def compile_and_findbugs(student_answer, testcode, import_static=None,
+                         xception=None, ncoding='utf-8', workspace=None):
     '''Compiles the tester code and runs FindBugs on the bytecode.
     '''
-    student_answer = _assemble_student_answer(student_answer, import_static)
-    support_files = _assemble_support_files(ncoding)
-    _assemble_tester(student_answer, testcode, support_files, xception)
-    if subprocess.call(['javac', '-d', '.', '-encoding', ncoding,
-                        '-cp', _junit, _testfile]):
-        # code didn't compile
-        print("** Code doesn't compile - further testing aborted **",
-              file=sys.stderr)
-    else:
-        fb_output = 'fb.out'
-        subprocess.check_call(['java', '-jar', _findbugs, '-textui',
-                               '-exclude', 'fb_exclude_filter.xml',
-                               '-output', fb_output, '.'])
-        if os.path.exists(fb_output) and os.path.getsize(fb_output) != 0:
+    with _workspace(workspace) as workspace:
+        library = _assemble(student_answer, testcode,
+                            import_static, xception, ncoding, workspace)
+        if _compile(ncoding, library, workspace):
+            # code didn't compile
+            print("** Code doesn't compile - further testing aborted **",
+                  file=sys.stderr)
+            return
+        status, report, err = _findbugs_run(workspace, library)
+        print(err, end='', file=sys.stderr, flush=True)
+        if status:
+            # FB didn't make it to the end - it's said why on stderr
+            pass
+        elif report:
             # FB had something to criticize
-            with open(fb_output) as fbo:
-                print(fbo.read())
+            print(report)
         else:
             print('Code looks clean')
 
 
-def compile_and_junit(student_answer, testcode,
-                      import_static=None, xception=None, ncoding='utf-8'):
+def _findbugs_run(workspace, library=None):
+    '''Runs FindBugs on just the classes compiled into the workspace
+    (against the support library and JUnit), in the worker if there is
+    one, unless the very same classes have been analysed already.
+    Returns FindBugs' exit status, its report and what it had to say on
+    stderr.
+    '''
+    classes = sorted(glob.glob(os.path.join(workspace, _package, '*.class')))
+    auxclasspath = _classpath(library, _junit)
+    entry = 'findbugs-%s.json' % _findbugs_key(classes, library)
+    with contextlib.suppress(TypeError, ValueError):
+        return tuple(json.loads(_cache_read(entry)))
+    wall = _limits['analysis']['wall']
+    args = ['-textui', '-exclude', os.path.abspath(_findbugs_filter),
+            '-auxclasspath', auxclasspath] + classes
+    result = _worker_call('tool', _findbugs, str(int((wall or 0) * 1000)),
+                          *args, timeout=wall + 10 if wall else None)
+    if result is None:
+        result = _call(['java', '-jar', _findbugs] + args, 'analysis')
+    else:
+        result = (result[0], result[1],
+                  _limit_messages(result[0], result[2],
+                                  _limits['analysis']))
+    status, report, err = result
+    # the report's read from a pipe, not from a file
+    result = (status, report.replace(workspace + os.sep, ''),
+              err.replace(workspace + os.sep, ''))
+    if not status:
+        _cache_write(entry, json.dumps(result).encode('utf-8'))
+    return result
+
+
+def _findbugs_key(classes, library=None):
+    '''Hash of everything that goes into a FindBugs analysis: FindBugs
+    itself, the filter, the support library (named after its contents)
+    and the bytecode.
+    '''
+    auxclasspath = _classpath(library and os.path.basename(library), _junit)
+    digest = hashlib.sha256()
+    with contextlib.suppress(OSError):
+        findbugs_stat = os.stat(_findbugs)
+        digest.update(b'%d %d\0' % (findbugs_stat.st_mtime_ns,
+                                     findbugs_stat.st_size))
+    for part in (_findbugs, _file_digest(_findbugs_filter), auxclasspath):
+        digest.update(part.encode('utf-8') + b'\0')
+    for path in classes:
+        digest.update(os.path.basename(path).encode('utf-8') + b'\0')
+        with open(path, 'rb') as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def _file_digest(path):
+    '''Digest of the contents of a file, only read again when the file
+    changes (empty if there's no such file).
+    '''
+    try:
+        path_stat = os.stat(path)
+    except OSError:
+        return ''
+    path = os.path.abspath(path)
+    stamp = (path_stat.st_mtime_ns, path_stat.st_size)
+    if _digest_memo.get(path, (None,))[0] != stamp:
+        with open(path, 'rb') as f:
+            _digest_memo[path] = (stamp, hashlib.sha256(f.read()).hexdigest())
+    return _digest_memo[path][1]
+
+
+def compile_and_junit(student_answer, testcode, import_static=None,
+                      xception=None, ncoding='utf-8', workspace=None):
     '''Assembles code (student answer, support files, tester class.
-    Then compiles and (hopefully) runs the tester code.
+    Then compiles and (hopefully) runs the JUnit tests in the student
+    answer.
+    Returns a record per test (see _junit_results), eg, for partial
+    credit; none if the code doesn't compile.
     '''
-    student_answer = _assemble_student_answer(student_answer, import_static)
-    support_files = _assemble_support_files(ncoding)
-    _assemble_tester(student_answer, testcode, support_files, xception)
-    if subprocess.call(['javac', '-d', '.', '-cp', _junit,
-                        '-encoding', ncoding, _testfile]):
-        # didn't compile
-        print("** Code doesn't compile - further testing aborted **",
-              file=sys.stderr)
+    with _workspace(workspace) as workspace:
+        library = _assemble(student_answer, testcode,
+                            import_static, xception, ncoding, workspace)
+        if _compile(ncoding, library, workspace):
+            # didn't compile
+            print("** Code doesn't compile - further testing aborted **",
+                  file=sys.stderr)
+            return []
+        status, out, err = _junit_run(_index(student_answer).test_classes,
+                                      workspace, library)
+        result = _echo(status, out, err)
+        results = _junit_results(os.path.join(workspace, 'junit-reports'))
+    if result == 0:
+        print('JUnit tests passed')
+    elif err.endswith((_time_limit_message + '\n',
+                       _memory_limit_message + '\n')):
+        # went past its limits, and it's been said
+        pass
+    elif result == 1:
+        print('** Some JUnit tests failed **')
+    elif result == 2:
+        print("** Couldn't find any JUnit tests to run **")
     else:
-        result = subprocess.call(['java', '-jar', _junit, '-cp', '.',
-                                  '--fail-if-no-tests',
-                                  '--scan-classpath',
-                                  '--details=none'])
-        if result == 1:
-            print('** Some JUnit tests failed **')
-        elif result == 2:
-            print("** Couldn't find any JUnit tests to run **")
-        else:
-            print('JUnit tests passed')
+        print("** JUnit tests didn't run to the end **")
+    return results
+
+
+def _junit_run(test_classes, workspace, library=None):
+    '''Runs the JUnit tests in the given classes of the workspace, in the
+    worker if there is one (where JUnit stays loaded from one run to the
+    next), with an XML report going into the workspace.
+    Failing any test classes to select, the workspace's classes are
+    scanned for tests.
+    Returns the launcher's exit status, stdout and stderr.
+    '''
+    selection = ['--select-class=%s.%s' % (_package, name)
+                 for name in test_classes] or ['--scan-classpath', workspace]
+    args = ['-cp', _classpath(workspace, library), '--fail-if-no-tests',
+            '--details=none',
+            '--reports-dir', os.path.join(workspace, 'junit-reports')]
+    wall = _limits['run']['wall']
+    result = None
+    if _worker_can_run(workspace):
+        result = _worker_call('junit', _junit, str(int((wall or 0) * 1000)),
+                              *args, *selection,
+                              timeout=wall + 10 if wall else None)
+    if result is None:
+        return _call(['java', '-jar', _junit] + args + selection, 'run')
+    status, out, err = result
+    return status, out, _limit_messages(status, err, _limits['run'])
+
+
+def _junit_results(reports):
+    '''Reads the XML reports written by the JUnit launcher into the
+    reports directory.
+    Returns a record per test: a dict of its classname, name, outcome
+    (passed, failed, error or skipped), duration (in seconds) and
+    message (for tests that didn't pass).
+    '''
+    results = []
+    for report in sorted(glob.glob(os.path.join(reports, '*.xml'))):
+        try:
+            testcases = xml.etree.ElementTree.parse(report).iter('testcase')
+            for testcase in testcases:
+                outcome, message = 'passed', None
+                for child in testcase:
+                    if child.tag in ('failure', 'error', 'skipped'):
+                        outcome = 'failed' if child.tag == 'failure' \
+                            else child.tag
+                        message = child.get('message')
+                        break
+                results.append({'classname': testcase.get('classname'),
+                                'name': testcase.get('name'),
+                                'outcome': outcome,
+                                'duration': float(testcase.get('time', 0)),
+                                'message': message})
+        except (OSError, ValueError, xml.etree.ElementTree.ParseError):
+            # nothing to be got from a half-written report
+            pass
+    return results
+
+
+def _grade(job):
+    '''Runs one grading job, capturing everything it prints.
+    Returns (stdout, stderr).
+    '''
+    function, *args = job
+    out, err = io.StringIO(), io.StringIO()
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        try:
+            function(*args)
+        except Exception:
+            # as it would have appeared, had the job been run on its own
+            traceback.print_exc()
+    return out.getvalue(), err.getvalue()
+
+
+def grade_many(jobs, max_workers=None):
+    '''Runs many independent grading jobs in parallel, each in a process
+    of its own (max_workers at a time, by default as many as there are
+    CPUs) and in a workspace of its own.
+    A job is a function of this module and its arguments, eg,
+    (compile_and_run, student_answer, testcode).
+    Returns what each job printed, as (stdout, stderr), in job order.
+    '''
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as pool:
+        return list(pool.map(_grade, jobs))
 
 
 '''Checks whether student-submitted Java code conforms to given
@@ -259,6 +1435,266 @@ class CodeOutOfSpecException(Exception):
     pass
 
 
+def _out_of_spec(complaint):
+    '''The exception for an answer that's out of spec, for some reason.
+    '''
+    return CodeOutOfSpecException('''
+Your code may well execute...but:
+Your code is out of spec - %s
+''' % complaint)
+
+
+class _Index:
+    '''What the checks need to know about a student answer, got from a
+    single pass over its tokens:
+    - public_members: the fields and methods declared public (bar main
+      and toString)
+    - static_methods: the methods declared static (bar main)
+    - case_constants: the constants in the cases following a switch
+    - test_classes: the top-level classes with JUnit tests in them
+    The scan is only made when one of these is first needed.
+    Checks which just look for some text in the answer use count, which
+    remembers what it has already counted; those looking for a pattern
+    (extends, enum) search the answer for it as they always have.
+    '''
+
+    def __init__(self, student_answer):
+        self.student_answer = student_answer
+        self._counts = {}
+
+    def __getattr__(self, name):
+        if name not in ('public_members', 'static_methods',
+                        'case_constants', 'test_classes'):
+            raise AttributeError(name)
+        self._scan(_code_tokens(self.student_answer))
+        return getattr(self, name)
+
+    def count(self, text):
+        '''The number of times text turns up in the student answer.
+        '''
+        if text not in self._counts:
+            self._counts[text] = self.student_answer.count(text)
+        return self._counts[text]
+
+    def _scan(self, code):
+        self.public_members = []
+        self.static_methods = []
+        self.case_constants = set()
+        self.test_classes = []
+        # public and / or static, until it's known what they're for
+        modifiers = set()
+        # the name of the type being declared ('' until it's known), if any
+        declaration = None
+        # the top-level type whose body the scan is in, if any
+        outer = None
+        depth = 0
+        switched = in_case = False
+        previous = word = None
+        for kind, text, _ in code:
+            if declaration is not None:
+                if text in ('{', ';'):
+                    if depth == 0 and text == '{':
+                        outer = declaration
+                    declaration = None
+                elif kind == 'word' and not declaration:
+                    declaration = text
+            if kind == 'word':
+                if previous == '@' and text in _test_annotations \
+                        and outer not in (None, *self.test_classes):
+                    self.test_classes.append(outer)
+                if text in ('public', 'static'):
+                    modifiers.add(text)
+                elif text in ('class', 'interface', 'enum', 'record') \
+                        and previous != '.' and declaration is None:
+                    declaration = ''
+                    # they were for the type
+                    modifiers.clear()
+                elif text == 'switch':
+                    switched = True
+                elif text == 'case':
+                    in_case = switched
+                elif in_case:
+                    self.case_constants.add(text)
+                word = text
+            elif text == '(':
+                # a method (or constructor)
+                if 'public' in modifiers and word not in ('main', 'toString'):
+                    self.public_members.append(word)
+                if 'static' in modifiers and word != 'main':
+                    self.static_methods.append(word)
+                modifiers.clear()
+            elif text in (';', '='):
+                # a field
+                if 'public' in modifiers:
+                    self.public_members.append(word)
+                modifiers.clear()
+            elif text in ('{', '}'):
+                # an initializer block, or the end of something
+                modifiers.clear()
+                depth = max(depth + (1 if text == '{' else -1), 0)
+                if depth == 0:
+                    outer = None
+            elif text in (':', '->'):
+                in_case = False
+            previous = text
+
+
+@functools.lru_cache(maxsize=16)
+def _index(student_answer):
+    '''The (cached) _Index of the student answer.
+    '''
+    return _Index(student_answer)
+
+
+def _check_author(index, existing_author=None):
+    classes = index.count('class')
+    authors = index.count('@author')
+    existing_authors = index.count(existing_author)  \
+        if existing_author else 0
+    if classes > authors or existing_authors >= authors:
+        raise _out_of_spec("doesn't credit all authors.")
+    else:
+        print('Additional author added')
+
+
+def _check_extends(index, subclass, superclass):
+    pattern = r'''
+        class\s+    # keyword and spaces
+        %s\s+       # subclass name and spaces
+        extends\s+  # keyword and spaces
+        %s          # superclass name
+        ''' % (subclass, superclass)
+    if not re.search(pattern, index.student_answer, re.VERBOSE):
+        raise _out_of_spec('''you were supposed to define
+    %s extends %s.''' % (subclass, superclass))
+    else:
+        print('%s extends %s' % (subclass, superclass))
+
+
+def _check_public(index):
+    if index.public_members:
+        raise _out_of_spec("something declared public that shouldn't be.")
+    else:
+        print("Nothing declared public that shouldn't be")
+
+
+def _check_static_method(index):
+    if index.static_methods:
+        raise _out_of_spec("your methods shouldn't be static.")
+    else:
+        print("No methods declared static that shouldn't be")
+
+
+def _check_enum(index, enumb):
+    pattern = r'''
+        enum\s+     # keyword and spaces
+        %s          # enum name
+        ''' % enumb
+    if not re.search(pattern, index.student_answer, re.VERBOSE):
+        raise _out_of_spec('''you were supposed to define
+    enum %s.''' % enumb)
+    else:
+        print('Specified enum declared')
+
+
+def _check_enum_in_switch(index, enumb_const):
+    if enumb_const not in index.case_constants:
+        raise _out_of_spec('''you were supposed to use
+    case %s:.''' % enumb_const)
+    else:
+        print('Switch uses enum constants')
+
+
+def _check_reference(index, some_class):
+    if not index.count(some_class):
+        raise _out_of_spec('''it doesn't contains any reference to
+    %s :.''' % some_class)
+    else:
+        print('Ok reference to %s' % some_class)
+
+
+def _check_no_reference(index, no_such_class):
+    if index.count(no_such_class):
+        raise _out_of_spec('''it contains a reference to
+    %s :.''' % no_such_class)
+    else:
+        print('No reference to %s' % no_such_class)
+
+
+def _check_interface(index, interface):
+    if not index.count('interface ' + interface):
+        raise _out_of_spec('''it doesn't declare
+    interface %s :.''' % interface)
+    else:
+        print('Declares interface %s' % interface)
+
+
+def _check_no_procedural_style_loops(index):
+    if index.count('for ' or 'for (' or 'for(' or 'while '):
+        raise _out_of_spec('it contains procedural style loops')
+    else:
+        print('No procedural style loops')
+
+
+def _check_functional_style_lambdas(index):
+    if not index.count('->'):
+        raise _out_of_spec("it doesn't contain functional style lambdas")
+    else:
+        print('Uses functional style lambdas')
+
+
+def _check_no_functional_style_lambdas(index):
+    if index.count('->'):
+        raise _out_of_spec('it contains functional style lambdas')
+    else:
+        print('Uses no functional style lambdas')
+
+
+# run_checks rule names: what comes after check_for_ in the name of
+# the corresponding function, plus a couple of more natural aliases
+_rules = {
+    'author': _check_author,
+    'extends': _check_extends,
+    'public': _check_public,
+    'no_public': _check_public,
+    'static_method': _check_static_method,
+    'no_static': _check_static_method,
+    'enum': _check_enum,
+    'enum_in_switch': _check_enum_in_switch,
+    'reference': _check_reference,
+    'no_reference': _check_no_reference,
+    'interface': _check_interface,
+    'no_procedural_style_loops': _check_no_procedural_style_loops,
+    'functional_style_lambdas': _check_functional_style_lambdas,
+    'no_functional_style_lambdas': _check_no_functional_style_lambdas,
+}
+
+
+@functools.lru_cache(maxsize=64)
+def _compile_rules(rules):
+    '''Turns (name, args...) rules into (check, args) pairs, once per
+    question.
+    '''
+    try:
+        return tuple((_rules[name], args) for name, *args in rules)
+    except KeyError as e:
+        raise ValueError('No such check: %s' % e) from None
+
+
+def run_checks(student_answer, rules):
+    '''Runs a whole set of checks on the student answer, in one go.
+    Each rule is a tuple of the name of a check (what comes after
+    check_for_ in the name of the corresponding function) and its
+    arguments, eg, ('extends', 'Dog', 'Animal') or ('static_method',).
+    Prints and raises CodeOutOfSpecException just as calling the check_for_
+    functions one after the other would, but the answer is only scanned
+    once for all of them.
+    '''
+    index = _index(student_answer)
+    for check, args in _compile_rules(tuple(map(tuple, rules))):
+        check(index, *args)
+
+
 def check_for_author(student_answer, existing_author=None):
     '''Checks for an @author tag in the javadoc comments.
     With an existing author argument, checks that another author
@@ -268,17 +1704,7 @@ def check_for_author(student_answer, existing_author=None):
     If there's no additional author, then raises an exception and
     stops further testing.
     '''
-    classes = student_answer.count('class')
-    authors = student_answer.count('@author')
-    existing_authors = student_answer.count(existing_author)  \
-        if existing_author else 0
-    if classes > authors or existing_authors >= authors:
-        raise CodeOutOfSpecException('''
-Your code may well execute...but:
-Your code is out of spec - doesn't credit all authors.
-''')
-    else:
-        print('Additional author added')
+    _check_author(_index(student_answer), existing_author)
 
 
 def check_for_extends(student_answer, subclass, superclass):
@@ -286,20 +1712,7 @@ def check_for_extends(student_answer, subclass, superclass):
     If that's not the case, then raises an exception and
     stops further testing.
     '''
-    pattern = re.compile('''
-        class\s+    # keyword and spaces
-        %s\s+       # subclass name and spaces
-        extends\s+  # keyword and spaces
-        %s          # superclass name
-        ''' % (subclass, superclass), re.VERBOSE)
-    if not pattern.search(student_answer):
-        raise CodeOutOfSpecException('''
-Your code may well execute...but:
-Your code is out of spec - you were supposed to define
-    %s extends %s.
-''' % (subclass, superclass))
-    else:
-        print('%s extends %s' % (subclass, superclass))
+    _check_extends(_index(student_answer), subclass, superclass)
 
 
 def check_for_public(student_answer):
@@ -307,22 +1720,12 @@ def check_for_public(student_answer):
     except for the main method of course, and perhaps toString.
     If that's not the case, then raises an exception and
     stops further testing.
+    Goes by the declarations rather than by regex, so that it takes
+    linear time whatever the code looks like: main and toString pass
+    whatever their bodies (one-liners included), and comments and
+    strings don't count.
     '''
-    pattern = re.compile('''
-        public          # keyword
-        (.*)            # other stuff, eg, return type, name
-        (?<!main)       # but not the main method
-        (?<!toString)   # but not the toString method
-        [;(]            # attribute or method
-        ''', re.VERBOSE)
-    match = pattern.search(student_answer)
-    if match:
-        raise CodeOutOfSpecException('''
-Your code may well execute...but:
-Your code is out of spec - something declared public that shouldn't be.
-''')
-    else:
-        print("Nothing declared public that shouldn't be")
+    _check_public(_index(student_answer))
 
 
 def check_for_static_method(student_answer):
@@ -330,21 +1733,11 @@ def check_for_static_method(student_answer):
     except for the main method of course.
     If that's not the case, then raises an exception and
     stops further testing.
+    Goes by the declarations: main passes whatever its body, static
+    fields initialised with a call aren't methods, and comments and
+    strings don't count.
     '''
-    pattern = re.compile('''
-        static      # keyword
-        (.*)        # other stuff, eg, return type, name
-        (?<!main)   # but not main method
-        \(          # start of args
-        ''', re.VERBOSE)
-    match = pattern.search(student_answer)
-    if match:
-        raise CodeOutOfSpecException('''
-Your code may well execute...but:
-Your code is out of spec - your methods shouldn't be static.
-''')
-    else:
-        print("No methods declared static that shouldn't be")
+    _check_static_method(_index(student_answer))
 
 
 def check_for_enum(student_answer, enumb):
@@ -352,19 +1745,7 @@ def check_for_enum(student_answer, enumb):
     If that's not the case, then raises an exception and
     stops further testing.
     '''
-    pattern = re.compile('''
-        enum\s+     # keyword and spaces
-        %s          # enum name
-        ''' % enumb, re.VERBOSE)
-    match = pattern.search(student_answer)
-    if not match:
-        raise CodeOutOfSpecException('''
-Your code may well execute...but:
-Your code is out of spec - you were supposed to define
-    enum %s.
-''' % enumb)
-    else:
-        print('Specified enum declared')
+    _check_enum(_index(student_answer), enumb)
 
 
 def check_for_enum_in_switch(student_answer, enumb_const):
@@ -372,21 +1753,10 @@ def check_for_enum_in_switch(student_answer, enumb_const):
     case statement.
     If that's not the case, then raises an exception and
     stops further testing.
+    Any case label will do (case RED:, case RED :, case RED ->,
+    case GREEN, RED ->) but not one in a comment.
     '''
-    pattern = re.compile('''
-        switch.*?       # keyword and stuff
-        case\s+         # keyword and spaces
-        %s:             # enum constant and keymark
-        ''' % enumb_const, re.DOTALL | re.VERBOSE)
-    match = pattern.search(student_answer)
-    if not match:
-        raise CodeOutOfSpecException('''
-Your code may well execute...but:
-Your code is out of spec - you were supposed to use
-    case %s:.
-''' % enumb_const)
-    else:
-        print('Switch uses enum constants')
+    _check_enum_in_switch(_index(student_answer), enumb_const)
 
 
 def check_for_reference(student_answer, some_class):
@@ -395,14 +1765,7 @@ def check_for_reference(student_answer, some_class):
     If that's not the case, then raises an exception
     and stops further testing.
     '''
-    if not student_answer.count(some_class):
-        raise CodeOutOfSpecException('''
-Your code may well execute...but:
-Your code is out of spec - it doesn't contains any reference to
-    %s :.
-''' % some_class)
-    else:
-        print('Ok reference to %s' % some_class)
+    _check_reference(_index(student_answer), some_class)
 
 
 def check_for_no_reference(student_answer, no_such_class):
@@ -411,14 +1774,7 @@ def check_for_no_reference(student_answer, no_such_class):
     If that's not the case, then raises an exception
     and stops further testing.
     '''
-    if student_answer.count(no_such_class):
-        raise CodeOutOfSpecException('''
-Your code may well execute...but:
-Your code is out of spec - it contains a reference to
-    %s :.
-''' % no_such_class)
-    else:
-        print('No reference to %s' % no_such_class)
+    _check_no_reference(_index(student_answer), no_such_class)
 
 
 def check_for_interface(student_answer, interface):
@@ -427,14 +1783,7 @@ def check_for_interface(student_answer, interface):
     If that's not the case, then raises an exception
     and stops further testing.
     '''
-    if not student_answer.count('interface ' + interface):
-        raise CodeOutOfSpecException('''
-Your code may well execute...but:
-Your code is out of spec - it doesn't declare
-    interface %s :.
-''' % interface)
-    else:
-        print('Declares interface %s' % interface)
+    _check_interface(_index(student_answer), interface)
 
 
 def check_for_no_procedural_style_loops(student_answer):
@@ -443,13 +1792,7 @@ def check_for_no_procedural_style_loops(student_answer):
     If that's not the case, then raises an exception
     and stops further testing.
     '''
-    if student_answer.count('for ' or 'for (' or 'for(' or 'while '):
-        raise CodeOutOfSpecException('''
-Your code may well execute...but:
-Your code is out of spec - it contains procedural style loops
-''')
-    else:
-        print('No procedural style loops')
+    _check_no_procedural_style_loops(_index(student_answer))
 
 
 def check_for_functional_style_lambdas(student_answer):
@@ -458,13 +1801,7 @@ def check_for_functional_style_lambdas(student_answer):
     If that's not the case, then raises an exception
     and stops further testing.
     '''
-    if not student_answer.count('->'):
-        raise CodeOutOfSpecException('''
-Your code may well execute...but:
-Your code is out of spec - it doesn't contain functional style lambdas
-''')
-    else:
-        print('Uses functional style lambdas')
+    _check_functional_style_lambdas(_index(student_answer))
 
 
 def check_for_no_functional_style_lambdas(student_answer):
@@ -473,10 +1810,4 @@ def check_for_no_functional_style_lambdas(student_answer):
     If that's not the case, then raises an exception
     and stops further testing.
     '''
-    if student_answer.count('->'):
-        raise CodeOutOfSpecException('''
-Your code may well execute...but:
-Your code is out of spec - it contains functional style lambdas
-''')
-    else:
-        print('Uses no functional style lambdas')
+    _check_no_functional_style_lambdas(_index(student_answer))
@@ -9,8 +9,10 @@ This file is intended to be a support file for some CR prototype, eg, we use
 LOCAL_PROTOTYPE_python_code_checkr
 
 Works (mostly) by:
-- filtering out import and from...import... declarations in
-  the Answer and .py support files
+- filtering out import and from...import... declarations of the modules
+  which get smushed together (the Answer and .py support files), and of
+  modules which can't be imported anyway
+- neutralising if __name__ == '__main__' guards
 - replacing everything into one and the same package
 
 Limitations and works-by are sufficient for my current needs;
@@ -19,39 +21,200 @@ I may gradually be adding additional stuff.
 (cc) CC BY-NC 4.0 2016-2020 Peter Sander
 '''
 
+import ast
+import concurrent.futures
+import contextlib
+import hashlib
+import hmac
+import importlib.util
+import io
+import json
+import marshal
 import os
+import resource
+import secrets
+import shutil
+import signal
+import socket
+import stat
 import subprocess
 import sys
+import tempfile
+import traceback
 
 
 # arbitrary names
 _testfile = 'tester.py'
 
+# compiled support files are kept here - set to '' to do without
+# only a directory of the user's own, that no one else can write to, is
+# used
+_cache_dir = os.environ.get(
+    'PYTHON_CHECKR_CACHE',
+    os.path.join(tempfile.gettempdir(),
+                 'python_code_checkr_cache-%d' % os.getuid()))
+# student code runs as the grader, so it could write to the cache too:
+# compiled support files are signed with this key, and not used unless
+# the signature checks out
+# the key's taken from the environment (and out of it, so that the
+# processes started don't get it) for a cache shared by the grading
+# processes that have it; failing that, a key of the process's own makes
+# for a cache of the process's own
+_cache_secret = os.environ.pop('PYTHON_CHECKR_CACHE_KEY', '').encode('utf-8') \
+    or secrets.token_bytes(32)
+# the least recently used entries go once the cache grows past this
+_cache_size = 256 * 1024 * 1024
+
+# assembled support files, for as long as they stay the same
+_support_memo = {}
+
+# whether modules can be imported, by name
+_importable_memo = {}
+
+# path of the Unix socket of a running python_forkserver, eg,
+# /run/checkr/python.sock
+# if not set, or if nothing's listening there, python3 gets started as
+# a subprocess
+_forkserver = os.environ.get('PYTHON_CHECKR_FORKSERVER')
+
+# where the per-call workspaces go: tmpfs if there is one, else the
+# usual temp directory
+_workspace_root = os.environ.get(
+    'PYTHON_CHECKR_WORKSPACE',
+    '/dev/shm' if os.access('/dev/shm', os.W_OK) else None)
+
+# limits on the python3 process running the tests:
+# - wall: wall-clock time (s)
+# - cpu: CPU time (s)
+# - memory: address space (bytes)
+# - processes: processes for the user
+# None for no limit
+_limits = {
+    'run': {'wall': 10, 'cpu': 10,
+            'memory': 512 * 1024 * 1024, 'processes': None},
+}
+
+# printed instead of hanging when a limit's hit
+_time_limit_message = '** Time limit exceeded **'
+_memory_limit_message = '** Memory limit exceeded **'
+
 
 def _remove_cruft(student_answer, unittesting=False):
     '''Filters the student answer, mostly to get rid of expressions
     and keywords that would be incompatible with all the code being
-    smushed into one single file.
-    '''
-    filtered_student_answer = student_answer \
-        .replace('import ', '#import ') \
-        .replace('from ', '#from ')
-    if unittesting:
-        num_main_calls = student_answer.count("if __name__ == '__main__'")
-        filtered_student_answer = filtered_student_answer \
-            .replace("if __name__ == '__main__'",
-                     "if __name__ == '__NOT_MAIN__'",
-                     num_main_calls - 1) \
-            .replace('''if __name__ == '__main__':
-    main()
-''', '''if __name__ == '__main__':
-    hijack()
-''')
-    else:
-        filtered_student_answer = filtered_student_answer \
-        .replace("if __name__ == '__main__'",
-                 "if __name__ == '__NOT_MAIN__'")
-    return filtered_student_answer
+    smushed into one single file:
+    - imports of the support files, and of modules which aren't to be had
+      (eg, the other modules of the answer), go
+    - if __name__ == '__main__' guards never hold, except, when
+      unittesting, the last one, where main() becomes hijack()
+    Goes by the syntax tree, so strings and comments are left be, and
+    keeps the line numbers as they were.
+    An answer that doesn't parse is left for the tester to report on.
+    '''
+    try:
+        tree = ast.parse(student_answer)
+    except (SyntaxError, ValueError):
+        return student_answer
+    lines = student_answer.splitlines(keepends=True)
+    local = {name[:-len('.py')] for name, _, _ in _support_signature()}
+    guards = []
+    edits = []
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            kept = _kept_import(node, local)
+            if kept is not node:
+                edits.append((node, ast.unparse(kept) if kept else 'pass'))
+        elif isinstance(node, ast.If) and _is_main_guard(node.test):
+            guards.append(node)
+    guards.sort(key=lambda node: (node.lineno, node.col_offset))
+    if unittesting and guards:
+        main_call = _main_call(guards.pop())
+        if main_call:
+            edits.append((main_call, 'hijack()'))
+    edits += [(guard.test, 'False') for guard in guards]
+    # from the end, so that the offsets of the edits to come still hold
+    edits.sort(key=lambda edit: (edit[0].lineno, edit[0].col_offset),
+               reverse=True)
+    for node, replacement in edits:
+        start = _offset(lines, node.lineno, node.col_offset)
+        end = _offset(lines, node.end_lineno, node.end_col_offset)
+        replacement += '\n' * (node.end_lineno - node.lineno)
+        lines = _splice(lines, start, end, replacement)
+    return ''.join(lines)
+
+
+def _kept_import(node, local):
+    '''What's to be kept of an import: the node itself, a node importing
+    only some of its modules, or None.
+    '''
+    if isinstance(node, ast.ImportFrom):
+        # relative imports are between the modules being smushed together
+        if node.level or node.module == '__future__' \
+                or not _importable(node.module, local):
+            return None
+        return node
+    names = [alias for alias in node.names if _importable(alias.name, local)]
+    if len(names) == len(node.names):
+        return node
+    return ast.Import(names=names) if names else None
+
+
+def _importable(module, local):
+    '''Whether a module can be imported, and isn't one of the local
+    modules (the support files) that get smushed in.
+    '''
+    top = module.partition('.')[0]
+    if top in local:
+        return False
+    if top not in _importable_memo:
+        try:
+            _importable_memo[top] = top in sys.builtin_module_names \
+                or importlib.util.find_spec(top) is not None
+        except (ImportError, ValueError):
+            _importable_memo[top] = False
+    return _importable_memo[top]
+
+
+def _is_main_guard(test):
+    '''Whether an if test is __name__ == '__main__' (either way round).
+    '''
+    if not isinstance(test, ast.Compare) or len(test.ops) != 1 \
+            or not isinstance(test.ops[0], ast.Eq):
+        return False
+    sides = [test.left, test.comparators[0]]
+    return any(isinstance(side, ast.Name) and side.id == '__name__'
+               for side in sides) \
+        and any(isinstance(side, ast.Constant) and side.value == '__main__'
+                for side in sides)
+
+
+def _main_call(guard):
+    '''The main() (or unittest.main()) call that's all there is to a
+    main guard, if that's the case.
+    '''
+    if len(guard.body) != 1 or not isinstance(guard.body[0], ast.Expr):
+        return None
+    call = guard.body[0].value
+    if isinstance(call, ast.Call) and not call.args and not call.keywords \
+            and ast.unparse(call.func) in ('main', 'unittest.main'):
+        return call
+    return None
+
+
+def _offset(lines, lineno, col_offset):
+    '''The (line index, character index) of an AST position, whose
+    columns count UTF-8 bytes.
+    '''
+    line = lines[lineno - 1]
+    return lineno - 1, len(line.encode('utf-8')[:col_offset].decode('utf-8'))
+
+
+def _splice(lines, start, end, replacement):
+    '''Replaces the text of the lines from start to end.
+    '''
+    (first, start), (last, end) = start, end
+    text = lines[first][:start] + replacement + lines[last][end:]
+    return lines[:first] + [text] + lines[last + 1:]
 
 
 def _add_cruft(student_answer, unittesting=False):
@@ -71,39 +234,349 @@ def _assemble_student_answer(student_answer, unittesting=False):
     return _add_cruft(_remove_cruft(student_answer, unittesting), unittesting)
 
 
+def _support_signature():
+    '''Identifies the current state of the support files: their names,
+    modification times and sizes.
+    Leaves out the tester file left behind by a previous run.
+    '''
+    with os.scandir() as scan:
+        return tuple(sorted(
+            (f.name, f.stat().st_mtime_ns, f.stat().st_size)
+            for f in scan
+            if f.name.endswith('.py') and f.name != _testfile
+            and f.is_file()))
+
+
 def _assemble_support_files(ncoding='utf-8'):
     '''Inputs support files, assembles files into a string,
     then filters out cruft.
+    The result is kept for as long as the support files don't change.
+    '''
+    key = (_support_signature(), ncoding)
+    if key not in _support_memo:
+        support_files = []
+        for name, _, _ in key[0]:
+            with open(name, encoding=ncoding) as f:
+                support_files.append(f.read())
+        _support_memo.clear()
+        _support_memo[key] = _remove_cruft('\n\n\n'.join(support_files))
+    return _support_memo[key]
+
+
+def _compiled_support_files(support_files):
+    '''Compiles the (assembled) support files once and for all into a
+    code object marshalled into the cache, much as Python does with .pyc
+    files.
+    Returns the marshalled code file and the digest of its contents (once
+    its signature has checked out), or None if there's no cache or the
+    tester will be run by some other Python which can't load it.
+    '''
+    cache = _trusted_cache()
+    if not cache or not support_files.strip():
+        return None
+    if os.path.realpath(shutil.which('python3') or '') \
+            != os.path.realpath(sys.executable):
+        return None
+    digest = hashlib.sha256(importlib.util.MAGIC_NUMBER
+                            + support_files.encode('utf-8'))
+    name = 'support-%s.marshal' % digest.hexdigest()
+    compiled = os.path.join(cache, name)
+    try:
+        with open(compiled, 'rb') as f:
+            entry = f.read()
+        signature, code = entry[:32], entry[32:]
+        if not hmac.compare_digest(signature, _signature(name, code)):
+            code = None
+        else:
+            # for the LRU
+            os.utime(compiled)
+    except OSError:
+        code = None
+    if code is None:
+        try:
+            code = marshal.dumps(compile(support_files, 'support files',
+                                         'exec'))
+        except SyntaxError:
+            # leave it to the tester to report
+            return None
+        try:
+            fd, new_compiled = tempfile.mkstemp(dir=cache, prefix='.new-')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_signature(name, code) + code)
+            os.replace(new_compiled, compiled)
+            _cache_evict()
+        except OSError:
+            return None
+    return compiled, hashlib.sha256(code).hexdigest()
+
+
+def _trusted_cache():
+    '''The cache directory, made if need be, or None if there's to be no
+    cache: none set, or one that can't be trusted - anything but a
+    directory of the user's own that no one else can write to.
+    '''
+    if not _cache_dir:
+        return None
+    try:
+        os.makedirs(_cache_dir, mode=0o700, exist_ok=True)
+        cache_stat = os.lstat(_cache_dir)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(cache_stat.st_mode) \
+            or cache_stat.st_uid != os.getuid() \
+            or cache_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        return None
+    return _cache_dir
+
+
+def _cache_evict():
+    '''Evicts the least recently used entries until the cache is back
+    down to size.
+    '''
+    entries = []
+    with os.scandir(_cache_dir) as scan:
+        for entry in scan:
+            if entry.name.endswith('.marshal') \
+                    and not entry.name.startswith('.'):
+                entry_stat = entry.stat()
+                entries.append((entry_stat.st_mtime, entry_stat.st_size,
+                                entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= _cache_size:
+            break
+        with contextlib.suppress(OSError):
+            os.remove(path)
+        total -= size
+
+
+def _signature(name, data):
+    '''The signature of a cache entry, which goes for that entry only.
     '''
-    support_files = '\n\n\n'.join([
-        open(f, encoding=ncoding).read()
-        for f in os.listdir()
-        if f.endswith('.py')])
-    return _remove_cruft(support_files)
+    return hmac.new(_cache_secret, name.encode('utf-8') + b'\0' + data,
+                    hashlib.sha256).digest()
 
 
-def _assemble_tester(student_answer, testcode, support_files, ncoding='utf-8'):
+def _tester(student_answer, testcode, support_files):
     '''Smushes student answer and support files together with an
-    executable tester class and writes everything out into one file.
+    executable tester class.
+    Support files that have been compiled already are loaded as such
+    rather than being compiled along with everything else - provided
+    they're still what was compiled, by the time the tester loads them.
     '''
-    tester = f'''
+    compiled = _compiled_support_files(support_files)
+    if compiled:
+        compiled, digest = compiled
+        support_files = f'''
+with open({compiled!r}, 'rb') as _support_files:
+    # past the signature
+    _support_files.seek(32)
+    _support_files = _support_files.read()
+if __import__('hashlib').sha256(_support_files).hexdigest() != {digest!r}:
+    raise ImportError('compiled support files changed since compiled')
+exec(__import__('marshal').loads(_support_files))
+'''
+    return f'''
 {student_answer}
 {support_files}
 {testcode}
 '''
 
-    # write out the string containing all the classes into a file
-    with open(_testfile, mode='w', encoding=ncoding) as f:
-        print(tester, file=f)
+
+def _assemble_tester(student_answer, testcode, support_files, ncoding='utf-8',
+                     workspace='.'):
+    '''Smushes student answer and support files together with an
+    executable tester class and writes everything out into one file.
+    '''
+    with open(os.path.join(workspace, _testfile), mode='w',
+              encoding=ncoding) as f:
+        print(_tester(student_answer, testcode, support_files), file=f)
+
+
+@contextlib.contextmanager
+def _workspace(workspace=None):
+    '''The directory for the tester file of one call, so that calls don't
+    trip over each other.
+    Without a given workspace, a fresh one is made, and cleaned up
+    afterwards.
+    Support files are still read from (and tests still run in) the
+    current directory.
+    '''
+    if workspace:
+        os.makedirs(workspace, exist_ok=True)
+        yield os.path.abspath(workspace)
+    else:
+        with tempfile.TemporaryDirectory(prefix='python_code_checkr-',
+                                         dir=_workspace_root) as workspace:
+            yield workspace
+
+
+def _call(args, phase='run', env=None):
+    '''Runs a child process within the limits for the phase, its output
+    captured. The whole process group is killed if it runs out of time.
+    Returns its exit status, stdout and stderr, the latter ending with a
+    message when a limit was hit.
+    '''
+    limits = _limits[phase]
+    process = subprocess.Popen(
+        args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        text=True, errors='replace', start_new_session=True, env=env,
+        preexec_fn=lambda: _set_rlimits(limits))
+    try:
+        out, err = process.communicate(timeout=limits['wall'])
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        out, err = process.communicate()
+        return process.returncode, out, err + _time_limit_message + '\n'
+    return process.returncode, out, _limit_messages(process.returncode, err)
 
 
-def interpret(student_answer, testcode, unittesting=False, ncoding='utf-8'):
+def _limit_messages(status, err):
+    '''Adds a message to stderr saying which limit a process hit, if any.
+    '''
+    if status in (-signal.SIGXCPU, -signal.SIGKILL):
+        return err + _time_limit_message + '\n'
+    if err.rstrip().endswith('MemoryError'):
+        return err + _memory_limit_message + '\n'
+    return err
+
+
+def _forkserver_call(tester, path, phase='run'):
+    '''Has the forkserver, if there is one, run the tester (source code,
+    handed over as such rather than written to a file) within the limits
+    for the phase, with the path entries ahead of the usual ones.
+    Returns (status, stdout, stderr) as _call does, or None when there's
+    no forkserver to talk to so that the caller can fall back to a
+    subprocess.
+    '''
+    if not _forkserver:
+        return None
+    limits = _limits[phase]
+    request = json.dumps({'source': tester, 'filename': _testfile,
+                          'path': path, 'cwd': os.getcwd(),
+                          'limits': limits}) + '\n'
+    try:
+        stdin = sys.stdin.fileno()
+    except (AttributeError, OSError, ValueError):
+        stdin = None
+    try:
+        with contextlib.ExitStack() as stack:
+            if stdin is None:
+                stdin = stack.enter_context(open(os.devnull)).fileno()
+            out = stack.enter_context(tempfile.TemporaryFile())
+            err = stack.enter_context(tempfile.TemporaryFile())
+            sock = stack.enter_context(
+                socket.socket(socket.AF_UNIX, socket.SOCK_STREAM))
+            sock.connect(_forkserver)
+            request = request.encode('utf-8')
+            socket.send_fds(sock, [request[:4096]],
+                            [stdin, out.fileno(), err.fileno()])
+            sock.sendall(request[4096:])
+            response = _receive_lines(sock, b'', 1)
+            pid = int(response.split(b'\n')[0])
+            sock.settimeout(limits['wall'])
+            try:
+                response = _receive_lines(sock, response, 2)
+                timed_out = False
+            except socket.timeout:
+                with contextlib.suppress(OSError):
+                    os.killpg(pid, signal.SIGKILL)
+                sock.settimeout(None)
+                response = _receive_lines(sock, response, 2)
+                timed_out = True
+            status = int(response.split(b'\n')[1])
+            out.seek(0)
+            err.seek(0)
+            out = out.read().decode('utf-8', errors='replace')
+            err = err.read().decode('utf-8', errors='replace')
+    except (OSError, ValueError):
+        return None
+    if timed_out:
+        return status, out, err + _time_limit_message + '\n'
+    return status, out, _limit_messages(status, err)
+
+
+def _receive_lines(sock, received, count):
+    '''Receives from the socket until there are count lines.
+    '''
+    while received.count(b'\n') < count:
+        data = sock.recv(64)
+        if not data:
+            raise ValueError('truncated forkserver response')
+        received += data
+    return received
+
+
+def _set_rlimits(limits):
+    '''Sets the limits of a child process, just before it gets going.
+    '''
+    if limits['cpu']:
+        # SIGXCPU when the time's up, SIGKILL if that's ignored
+        resource.setrlimit(resource.RLIMIT_CPU,
+                           (limits['cpu'], limits['cpu'] + 1))
+    if limits['memory']:
+        resource.setrlimit(resource.RLIMIT_AS,
+                           (limits['memory'], limits['memory']))
+    if limits['processes']:
+        resource.setrlimit(resource.RLIMIT_NPROC,
+                           (limits['processes'], limits['processes']))
+
+
+def interpret(student_answer, testcode, unittesting=False, ncoding='utf-8',
+              workspace=None):
     '''Assembles code (student answer, support files, tester class.
     Then runs the tester code.
     '''
     student_answer = _assemble_student_answer(student_answer, unittesting)
     support_files = _assemble_support_files(ncoding)
-    _assemble_tester(student_answer, testcode, support_files)
-    if subprocess.call(['python3', _testfile]):
+    # the tester can still import whatever is in the current directory
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, (os.getcwd(), env.get('PYTHONPATH'))))
+    tester = _tester(student_answer, testcode, support_files)
+    result = None if workspace else _forkserver_call(tester, [os.getcwd()])
+    if result is None:
+        with _workspace(workspace) as workspace:
+            with open(os.path.join(workspace, _testfile), mode='w',
+                      encoding=ncoding) as f:
+                print(tester, file=f)
+            result = _call(['python3', os.path.join(workspace, _testfile)],
+                           env=env)
+        # students don't need to see where the tester was
+        result = result[:2] + (result[2].replace(workspace + os.sep, ''),)
+    status, out, err = result
+    print(out, end='', flush=True)
+    print(err, end='', file=sys.stderr, flush=True)
+    if status:
         # code didn't compile
         print('** Further testing aborted **', file=sys.stderr)
+
+
+def _grade(job):
+    '''Runs one grading job, capturing everything it prints.
+    Returns (stdout, stderr).
+    '''
+    function, *args = job
+    out, err = io.StringIO(), io.StringIO()
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        try:
+            function(*args)
+        except Exception:
+            # as it would have appeared, had the job been run on its own
+            traceback.print_exc()
+    return out.getvalue(), err.getvalue()
+
+
+def grade_many(jobs, max_workers=None):
+    '''Runs many independent grading jobs in parallel, each in a process
+    of its own (max_workers at a time, by default as many as there are
+    CPUs) and in a workspace of its own.
+    A job is a function of this module and its arguments, eg,
+    (interpret, student_answer, testcode).
+    Returns what each job printed, as (stdout, stderr), in job order.
+    '''
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as pool:
+        return list(pool.map(_grade, jobs))
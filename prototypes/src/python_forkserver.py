@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+'''Warm, pre-forking runner for python_code_checkr.py.
+
+Every interpret call otherwise starts a fresh python3 for the tester,
+which pays for interpreter startup and for importing unittest and co
+each time. This server imports all that once and then forks a child
+per run, which executes the tester in a clean __main__ module.
+
+This is NOT a CodeRunner support file - it runs on the grading server,
+eg:
+    python3 python_forkserver.py /run/checkr/python.sock
+and python_code_checkr.py is told about it with, eg,
+    PYTHON_CHECKR_FORKSERVER=/run/checkr/python.sock
+If the server isn't running, python_code_checkr.py falls back to
+starting python3 as a subprocess.
+
+Children are forked from the same warm parent, so they share what it
+imported (as it was when imported) and its hash seed; random gets
+reseeded in each child.
+
+Protocol, over a Unix socket:
+  request:  a JSON object (source and file name of the tester, path,
+            cwd, limits) on a line, its first bytes sent along with the
+            child's stdin, stdout and stderr file descriptors
+  response: the pid of the child, then its exit status (negative for
+            a signal, as for subprocess), each on a line of its own
+
+(cc) CC BY-NC 4.0 2016-2020 Peter Sander
+'''
+
+import builtins
+import contextlib
+import importlib
+import json
+import linecache
+import optparse
+import os
+import resource
+import signal
+import socket
+import sys
+import threading
+import traceback
+import types
+
+
+# imported once and for all, for the children to inherit
+_preloaded = ['contextlib', 'io', 'unittest', 'hijack_unittest']
+
+
+def serve(address, preloaded=_preloaded):
+    '''Imports the modules to preload, then forks a child for every
+    request, for ever.
+    '''
+    for module in preloaded:
+        with contextlib.suppress(ImportError):
+            importlib.import_module(module)
+    # children get reaped without being waited for
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(address)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(address)
+        os.chmod(address, 0o600)
+        server.listen(50)
+        while True:
+            connection, _ = server.accept()
+            with connection:
+                try:
+                    request, fds, _, _ = socket.recv_fds(connection,
+                                                         65536, 3)
+                    while not request.endswith(b'\n'):
+                        data = connection.recv(65536)
+                        if not data:
+                            raise ValueError('truncated request')
+                        request += data
+                    request = json.loads(request)
+                except (OSError, ValueError):
+                    continue
+                sys.stdout.flush()
+                sys.stderr.flush()
+                if os.fork() == 0:
+                    server.close()
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    _supervise(connection, request, fds)
+                for fd in fds:
+                    os.close(fd)
+
+
+def _supervise(connection, request, fds):
+    '''Forks the child for one run and tells the client how it went.
+    Never returns.
+    '''
+    try:
+        pid = os.fork()
+        if pid == 0:
+            connection.close()
+            _run(request, fds)
+        for fd in fds:
+            os.close(fd)
+        connection.sendall(b'%d\n' % pid)
+        _, wait_status = os.waitpid(pid, 0)
+        connection.sendall(b'%d\n' % os.waitstatus_to_exitcode(wait_status))
+    finally:
+        os._exit(0)
+
+
+def _run(request, fds):
+    '''Runs the tester in a clean __main__, much as python3 tester would
+    have, with the client's stdin, stdout and stderr and within its
+    limits. Never returns.
+    '''
+    status = 1
+    try:
+        os.setsid()
+        _set_rlimits(request['limits'])
+        for target, fd in enumerate(fds):
+            os.dup2(fd, target)
+            os.close(fd)
+        sys.stdin = open(0, closefd=False)
+        sys.stdout = open(1, 'w', closefd=False)
+        sys.stderr = open(2, 'w', closefd=False, errors='backslashreplace',
+                          buffering=1)
+        os.chdir(request['cwd'])
+        filename = request['filename']
+        sys.argv = [filename]
+        sys.path[:0] = request['path']
+        if 'random' in sys.modules:
+            sys.modules['random'].seed()
+        main = types.ModuleType('__main__')
+        main.__file__ = filename
+        main.__builtins__ = builtins
+        sys.modules['__main__'] = main
+        status = _execute(request['source'], filename, main)
+        # as the interpreter would, wait for the threads left running
+        for thread in threading.enumerate():
+            if thread is not threading.main_thread() and not thread.daemon:
+                thread.join()
+    finally:
+        with contextlib.suppress(Exception):
+            sys.stdout.flush()
+            sys.stderr.flush()
+        os._exit(status)
+
+
+def _execute(source, filename, main):
+    '''Executes the tester source in the main module.
+    Returns the exit status, having reported an uncaught exception just
+    as the interpreter would.
+    '''
+    # for the source lines of tracebacks, as there's no file to read
+    lines = source.splitlines(keepends=True)
+    linecache.cache[filename] = (len(source), None, lines, filename)
+    try:
+        exec(compile(source, filename, 'exec'), main.__dict__)
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code, file=sys.stderr)
+        return 1
+    except BaseException as e:
+        # leave out this frame, which is none of the student's business
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+        return 1
+    return 0
+
+
+def _set_rlimits(limits):
+    '''Sets the limits of a child, just before it gets going.
+    '''
+    if limits.get('cpu'):
+        resource.setrlimit(resource.RLIMIT_CPU,
+                           (limits['cpu'], limits['cpu'] + 1))
+    if limits.get('memory'):
+        resource.setrlimit(resource.RLIMIT_AS,
+                           (limits['memory'], limits['memory']))
+    if limits.get('processes'):
+        resource.setrlimit(resource.RLIMIT_NPROC,
+                           (limits['processes'], limits['processes']))
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser(usage='%prog [options] socket')
+    parser.add_option('-p', '--preload', dest='preloaded',
+                      default=','.join(_preloaded),
+                      help='modules to import once and for all, '
+                           'comma-separated [default: %default]')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('expecting the path of the socket to listen on')
+    serve(args[0], [module for module in options.preloaded.split(',')
+                    if module])
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+
+'''Times the checkers' hot paths on generated answers of increasing size,
+plain and pathological (everything on one huge line, deep nesting,
+thousands of classes): cruft removal, support file and tester assembly
+(a single test, and a batch of them), every check_for_ function of
+java_code_checkr, and dumbcopiers' normalisation and copy grouping on
+cohorts generated as cheat/src/bench.py does.
+Results go to a JSON file, along with what's needed to tell runs apart
+(commit, Python, platform), and can be compared with those of an earlier
+run.
+Not a unit test - run it by hand, eg
+    python3 checkr_bench.py -o before.json
+    (change things)
+    python3 checkr_bench.py -o after.json -c before.json
+
+(cc) CC BY-NC 4.0 2016-2020 Peter Sander
+'''
+
+import contextlib
+import datetime
+import io
+import json
+import optparse
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(sys.path[0], '../src'))
+sys.path.append(os.path.join(sys.path[0], '../../cheat/src'))
+import java_code_checkr
+import python_code_checkr
+from bench import cohort
+from cheat import dumbcopiers
+
+
+# test cases in a batch tester
+_batch_size = 20
+
+# characters per cleaned program in the cohorts
+_program_size = 400
+
+# arguments of the checks that take any
+_check_args = {
+    'check_for_author': ('Nobody Atall',),
+    'check_for_extends': ('Generated1', 'Nope'),
+    'check_for_enum': ('Nope',),
+    'check_for_enum_in_switch': ('NOPE',),
+    'check_for_reference': ('Nope',),
+    'check_for_no_reference': ('Nope',),
+    'check_for_interface': ('Nope',),
+}
+
+
+def _java_part(i, newline='\n'):
+    '''A class with some of everything the checks look for - no line
+    comments, so that it can all go on one line.
+    '''
+    return newline.join([
+        '/**', ' * Class number %d.' % i, ' * @author J. Random Author',
+        ' */',
+        'final class Generated%d extends Base%d implements Runnable {' % (i, i),
+        '    private String s = "public class Nope%d { import this; }";' % i,
+        "    private char c = '\\\\';",
+        '    enum Day%d { SATURDAY, SUNDAY }' % i,
+        '    /* public interface Nope%d */' % i,
+        '    int value(int x) {',
+        '        for (int j = 0; j < x; j++) { x += j; }',
+        '        switch (Day%d.SUNDAY) { case SATURDAY: return 0; default: }' % i,
+        '        java.util.List.of(x).forEach(e -> System.out.println(e));',
+        '        return x * %d + 0x1F;' % i,
+        '    }',
+        '    public void run() {}',
+        '}', ''])
+
+
+def java_answer(shape, size):
+    '''A Java answer of about size characters, of the given shape.
+    '''
+    parts = ['package generated;\n', 'import java.util.List;\n']
+    length = i = 0
+    if shape == 'nested':
+        # one method, blocks within blocks
+        depth = size // 40
+        return ''.join(parts + ['final class Nested {\n', 'void nested(int x) {\n'] +
+                       ['if (x > %d) { x--;\n' % d for d in range(depth)] +
+                       ['}\n' * depth, '}\n}\n'])
+    while length < size:
+        if shape == 'classes':
+            part = 'class Tiny%d { int x%d; }\n' % (i, i)
+        else:
+            part = _java_part(i, ' ' if shape == 'one_line' else '\n')
+        parts.append(part)
+        length += len(part)
+        i += 1
+    return ''.join(parts)
+
+
+def python_answer(shape, size):
+    '''A Python answer of about size characters, of the given shape.
+    '''
+    parts = ['import math\n', 'import os.path\n', 'from . import nope\n']
+    length = i = 0
+    while length < size:
+        if shape == 'one_line':
+            part = 'x%d = math.sqrt(%d); ' % (i, i)
+        elif shape == 'nested':
+            # as deep as the parser lets it go
+            depth = 90
+            part = ''.join('%sif x > %d:\n' % (' ' * d, d) for d in range(depth)) \
+                + ' ' * depth + 'x -= 1\n'
+            part = 'def nested%d(x):\n' % i + ''.join(
+                '    ' + line + '\n' for line in part.splitlines())
+        elif shape == 'classes':
+            part = 'class Tiny%d:\n    x = %d\n' % (i, i)
+        else:
+            part = '''
+class Generated%d:
+    """Class number %d."""
+
+    def value(self, x):
+        # return x times %d
+        return [x * %d + y for y in range(3) if y != x]
+
+
+''' % (i, i, i, i)
+        parts.append(part)
+        length += len(part)
+        i += 1
+    if shape == 'one_line':
+        parts.append('\n')
+    parts.append("\nif __name__ == '__main__':\n    main()\n")
+    return ''.join(parts)
+
+
+def _clear_caches():
+    '''Back to cold caches, as for a new answer.
+    '''
+    java_code_checkr._tokenize.cache_clear()
+    java_code_checkr._code_tokens.cache_clear()
+    java_code_checkr._index.cache_clear()
+    java_code_checkr._support_memo.clear()
+    python_code_checkr._support_memo.clear()
+
+
+def _best(function, repeat):
+    '''The best time of repeat calls, from cold caches, whatever the
+    calls print or complain about.
+    '''
+    best = None
+    for _ in range(repeat):
+        _clear_caches()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            with contextlib.suppress(java_code_checkr.CodeOutOfSpecException):
+                function()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+@contextlib.contextmanager
+def _support_files(answer, extension):
+    '''A temporary working directory with the answer split into a few
+    support files.
+    '''
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        lines = answer.splitlines(keepends=True)
+        step = len(lines) // 4 + 1
+        for n in range(0, len(lines), step):
+            with open(os.path.join(tmp, 'Support%d%s' % (n, extension)), 'w',
+                      encoding='utf-8') as f:
+                f.writelines(lines[n:n + step])
+        os.chdir(tmp)
+        try:
+            yield
+        finally:
+            os.chdir(cwd)
+
+
+def _java_benchmarks(shape, answer):
+    yield '_remove_cruft', lambda: java_code_checkr._remove_cruft(answer)
+    with _support_files(answer, '.java'):
+        yield '_assemble_support_files', java_code_checkr._assemble_support_files
+    yield '_assemble_student_answer', \
+        lambda: java_code_checkr._assemble_student_answer(answer)
+    student_answer = java_code_checkr._assemble_student_answer(answer)
+    testcode = 'System.out.println(new Generated0().value(3));'
+    with tempfile.TemporaryDirectory() as workspace:
+        yield '_assemble_tester', lambda: java_code_checkr._assemble_tester(
+            student_answer, testcode, '', workspace=workspace)
+        yield '_assemble_batch_tester', \
+            lambda: java_code_checkr._assemble_batch_tester(
+                student_answer, [testcode] * _batch_size, '',
+                workspace=workspace)
+    for name in sorted(dir(java_code_checkr)):
+        if name.startswith('check_for_'):
+            check = getattr(java_code_checkr, name)
+            args = _check_args.get(name, ())
+            yield name, lambda check=check, args=args: check(answer, *args)
+    rules = tuple((name[len('check_for_'):],) + _check_args.get(name, ())
+                  for name in dir(java_code_checkr)
+                  if name.startswith('check_for_'))
+
+    def run_checks():
+        # as run_checks would, were the answer to pass every check, rather
+        # than stop at the first it fails
+        index = java_code_checkr._index(answer)
+        for check, args in java_code_checkr._compile_rules(rules):
+            with contextlib.suppress(java_code_checkr.CodeOutOfSpecException):
+                check(index, *args)
+
+    yield 'run_checks', run_checks
+
+
+def _python_benchmarks(shape, answer):
+    yield '_remove_cruft', lambda: python_code_checkr._remove_cruft(answer)
+    yield '_remove_cruft unittesting', lambda: python_code_checkr._remove_cruft(
+        answer, unittesting=True)
+    with _support_files(answer, '.py'):
+        yield '_assemble_support_files', python_code_checkr._assemble_support_files
+    yield '_tester', lambda: python_code_checkr._tester(answer, 'print(1)', '')
+
+
+def _clean_benchmarks(language, answer):
+    normaliser = dumbcopiers.Normaliser({
+        'code_language': language, 'exact_copies_only': False,
+        'replace_identifiers': True})
+    yield 'Normaliser.clean', lambda: normaliser.clean(answer)
+    yield 'Normaliser.tokens', lambda: normaliser.tokens(answer)
+
+
+def _copy_benchmarks(progs):
+    yield 'find_copies', lambda: dumbcopiers.find_copies(
+        {stud: dumbcopiers.fingerprint(prog) for stud, prog in progs.items()})
+    shingled = {stud: dumbcopiers.shingles(dumbcopiers.TOKEN.findall(prog))
+                for stud, prog in progs.items() if prog != '-'}
+    yield 'find_similar', lambda: dumbcopiers.find_similar(shingled, 0.8)
+
+
+def run(sizes, students, repeat, shapes, progress=None):
+    '''All the benchmarks, as a list of dicts: what was timed (benchmark,
+    language, shape, size - chars, or students for copies) and the best
+    of its times (seconds).
+    '''
+    results = []
+
+    def time_all(benchmarks, language, shape, size):
+        for benchmark, function in benchmarks:
+            result = {'benchmark': benchmark, 'language': language,
+                      'shape': shape, 'size': size,
+                      'seconds': _best(function, repeat)}
+            results.append(result)
+            if progress:
+                progress(result)
+
+    for shape in shapes:
+        for size in sizes:
+            answer = java_answer(shape, size)
+            time_all(_java_benchmarks(shape, answer), 'java', shape, len(answer))
+            time_all(_clean_benchmarks('java', answer), 'java', shape, len(answer))
+            answer = python_answer(shape, size)
+            time_all(_python_benchmarks(shape, answer), 'python', shape, len(answer))
+            time_all(_clean_benchmarks('python', answer), 'python', shape, len(answer))
+    for count in students:
+        time_all(_copy_benchmarks(cohort(count, _program_size, 0)), 'cohort',
+                 'plain', count)
+    return results
+
+
+def _commit():
+    with contextlib.suppress(OSError, subprocess.CalledProcessError):
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                              text=True, check=True,
+                              cwd=sys.path[0] or '.').stdout.strip()
+
+
+def _key(result):
+    return (result['benchmark'], result['language'], result['shape'],
+            result['size'])
+
+
+def _print(result, before=None):
+    line = '%-36s %-7s %-9s %9d %10.2f' % (
+        _key(result) + (result['seconds'] * 1000,))
+    if before and _key(result) in before:
+        line += ' %7.2fx' % (result['seconds'] / before[_key(result)])
+    print(line, flush=True)
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-s', '--sizes', default='10000,100000,400000',
+                      help='answer sizes (chars), comma-separated '
+                           '[default: %default]')
+    parser.add_option('-n', '--students', default='1000,4000',
+                      help='cohort sizes for the copy grouping, '
+                           'comma-separated [default: %default]')
+    parser.add_option('--shapes', default='plain,one_line,nested,classes',
+                      help='answer shapes, comma-separated '
+                           '[default: %default]')
+    parser.add_option('-r', '--repeat', type='int', default=3,
+                      help='times to run each benchmark, keeping the best '
+                           '[default: %default]')
+    parser.add_option('-o', '--output',
+                      default='checkr_bench-%s.json'
+                              % datetime.datetime.now().strftime('%Y%m%d-%H%M%S'),
+                      help='JSON file for the results [default: %default]')
+    parser.add_option('-c', '--compare',
+                      help='JSON file of an earlier run, to show the ratio '
+                           'of the times to')
+    options, args = parser.parse_args()
+    if args:
+        parser.error('expecting no arguments')
+    before = None
+    if options.compare:
+        with open(options.compare) as f:
+            before = {_key(result): result['seconds']
+                      for result in json.load(f)['results']}
+    print('%-36s %-7s %-9s %9s %10s' % ('benchmark', 'lang', 'shape', 'size',
+                                        'best ms'))
+    results = run([int(size) for size in options.sizes.split(',')],
+                  [int(count) for count in options.students.split(',')],
+                  options.repeat, options.shapes.split(','),
+                  lambda result: _print(result, before))
+    with open(options.output, 'w') as f:
+        json.dump({
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': _commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': options.repeat,
+            'results': results,
+        }, f, indent=2)
+    print('Results in', options.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+'''Exercises (some of) the hijack_unittest.py functions.
+
+(cc) CC BY-NC 4.0 2016-2020 Peter Sander
+'''
+
+import json
+import os
+import os.path
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(sys.path[0], '../src'))
+import hijack_unittest
+
+# tests to be hijacked, followed by the hijack call
+_tests = '''
+import unittest
+from hijack_unittest import hijack
+
+class Passing(unittest.TestCase):
+    def test_print(self):
+        print('printed in the test')
+
+    @unittest.skip('not today')
+    def test_skipped(self):
+        pass
+
+class Failing(unittest.TestCase):
+    def test_failure(self):
+        self.assertEqual(1, 2, 'test in the wrong place')
+
+    def test_error(self):
+        raise ValueError('tests in error')
+
+'''
+
+
+class HijackTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def hijack(self, call, **env):
+        tester = os.path.join(self.tmp.name, 'tester.py')
+        with open(tester, 'w') as f:
+            f.write(_tests + call + '\n')
+        env = dict(os.environ, **env,
+                   PYTHONPATH=os.path.dirname(hijack_unittest.__file__))
+        return subprocess.run([sys.executable, tester], env=env,
+                              capture_output=True, text=True).stdout
+
+    def test_report(self):
+        report = self.hijack('hijack()')
+        self.assertTrue(report.startswith('EFprinted in the test\n.s\n'))
+        self.assertIn('ERROR: test_error (__main__.Failing.test_error)',
+                      report)
+        # test names and messages aren't mistaken for the time taken
+        self.assertIn('test in the wrong place', report)
+        self.assertTrue(report.endswith(
+            '-' * 70 + '\n'
+            'Ran 4 tests in X.XXXs\n\n'
+            'FAILED (failures=1, errors=1, skipped=1)\n\n'))
+
+    def test_json(self):
+        summary = json.loads(self.hijack('hijack(as_json=True)'))
+        self.assertEqual((summary['run'], summary['failures'],
+                          summary['errors'], summary['successful']),
+                         (4, 1, 1, False))
+        self.assertEqual(
+            [(record['test'], record['outcome'])
+             for record in summary['tests']],
+            [('__main__.Failing.test_error', 'error'),
+             ('__main__.Failing.test_failure', 'failure'),
+             ('__main__.Passing.test_print', 'success'),
+             ('__main__.Passing.test_skipped', 'skipped')])
+        self.assertTrue(all(record['duration'] >= 0
+                            for record in summary['tests']))
+
+    def test_processes(self):
+        self.assertEqual(self.hijack('hijack(processes=2)'),
+                         self.hijack('hijack()'))
+
+    def test_profile(self):
+        profile = os.path.join(self.tmp.name, 'profile.jsonl')
+        report = self.hijack('hijack()', HIJACK_PROFILE=profile)
+        self.assertEqual(report, self.hijack('hijack()'))
+        self.hijack('hijack(processes=2)', HIJACK_PROFILE=profile)
+        with open(profile) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(len(records), 8)
+        for record in records:
+            self.assertEqual(
+                sorted(record),
+                ['cpu', 'duration', 'memory', 'outcome', 'setUp', 'tearDown',
+                 'test'])
+            self.assertGreaterEqual(record['memory'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,18 +6,31 @@ One day I'll add more tests...
 (cc) CC BY-NC 4.0 2016-2020 Peter Sander
 '''
 
+import contextlib
+import io
 import os
 import os.path
+import re
+import shutil
+import socketserver
+import struct
 import sys
+import tempfile
+import threading
+import time
 import unittest
 
 sys.path.append(os.path.join(sys.path[0], '../src'))
+import java_code_checkr
 from java_code_checkr import check_for_author
 from java_code_checkr import check_for_reference
 from java_code_checkr import check_for_no_reference
 from java_code_checkr import check_for_public
 from java_code_checkr import check_for_static_method
 from java_code_checkr import check_for_interface
+from java_code_checkr import check_for_extends
+from java_code_checkr import check_for_enum
+from java_code_checkr import run_checks
 from java_code_checkr import CodeOutOfSpecException
 
 
@@ -223,5 +236,732 @@ public interface SomethingAble {
             None)
 
 
+class RunChecksTest(unittest.TestCase):
+    def setUp(self):
+        self.student_answer = '''
+/**
+ * @author Alfred E. Neuman
+ */
+class Dog extends Animal implements Pet {
+    private static final List<String> NAMES = List.of("Rex");
+    private Day day;
+
+    String bark() {
+        switch (day) {
+            case SATURDAY: return "Woof";
+            default: return names.stream().map(n -> n).findFirst().get();
+        }
+    }
+}
+
+/**
+ * @author Alfred E. Neuman
+ */
+enum Day { SATURDAY, SUNDAY }
+'''
+        self.rules = [('author',), ('extends', 'Dog', 'Animal'),
+                      ('no_public',), ('no_static',), ('enum', 'Day'),
+                      ('enum_in_switch', 'SATURDAY'),
+                      ('reference', 'List'), ('no_reference', 'Set'),
+                      ('functional_style_lambdas',)]
+
+    def test_same_output_as_check_functions(self):
+        with contextlib.redirect_stdout(io.StringIO()) as together:
+            run_checks(self.student_answer, self.rules)
+        with contextlib.redirect_stdout(io.StringIO()) as apart:
+            check_for_author(self.student_answer)
+            check_for_extends(self.student_answer, 'Dog', 'Animal')
+            check_for_public(self.student_answer)
+            check_for_static_method(self.student_answer)
+            check_for_enum(self.student_answer, 'Day')
+            java_code_checkr.check_for_enum_in_switch(self.student_answer,
+                                                      'SATURDAY')
+            check_for_reference(self.student_answer, 'List')
+            check_for_no_reference(self.student_answer, 'Set')
+            java_code_checkr.check_for_functional_style_lambdas(
+                self.student_answer)
+        self.assertEqual(together.getvalue(), apart.getvalue())
+        self.assertEqual(len(together.getvalue().splitlines()),
+                         len(self.rules))
+
+    def test_stops_at_first_out_of_spec(self):
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            self.assertRaises(
+                CodeOutOfSpecException, run_checks, self.student_answer,
+                [('enum', 'Day'), ('extends', 'Dog', 'Cat'), ('author',)])
+        self.assertEqual(out.getvalue(), 'Specified enum declared\n')
+
+    def test_unknown_rule(self):
+        self.assertRaises(ValueError, run_checks, self.student_answer,
+                          [('no_such_check',)])
+
+    def test_index(self):
+        index = java_code_checkr._index('''
+public class Foo extends Bar {
+    public int x;
+    public static void main(String[] args) {}
+    public String toString() { return "public int y;"; }
+    static int twice(int x) { return 2 * x; }
+    static { Object o = Foo.class; }
+}
+''')
+        self.assertEqual(index.public_members, ['x'])
+        self.assertEqual(index.static_methods, ['twice'])
+
+    def assertChecks(self, passes, rule, student_answer):
+        '''Checks that the rule passes (or not) whether run by run_checks
+        or by its check_for_ function, as it always did.
+        '''
+        name, *args = rule
+        check = getattr(java_code_checkr, 'check_for_' + name)
+        with contextlib.redirect_stdout(io.StringIO()):
+            for run in (lambda: run_checks(student_answer, [rule]),
+                        lambda: check(student_answer, *args)):
+                if passes:
+                    run()
+                else:
+                    self.assertRaises(CodeOutOfSpecException, run)
+
+    def test_enum_name_a_pattern(self):
+        # the name's a regular expression, and one it starts will do
+        self.assertChecks(True, ('enum', 'Color'), 'enum Colors { RED }')
+        self.assertChecks(True, ('enum', 'Col.r'), 'enum Color { RED }')
+        self.assertChecks(False, ('enum', 'Color'), 'class Color {}')
+
+    def test_extends_names_patterns(self):
+        self.assertChecks(True, ('extends', 'Dog', 'Animal'),
+                          'class Dog extends AnimalBase {}')
+        self.assertChecks(True, ('extends', 'Dog', 'Anim.l'),
+                          'class Dog extends Animal {}')
+        self.assertChecks(False, ('extends', 'Dog', 'Animal'),
+                          'class Dog extends Cat {}')
+
+    def test_extends_in_comment(self):
+        self.assertChecks(True, ('extends', 'Dog', 'Animal'),
+                          '// class Dog extends Animal\nclass Dog {}')
+
+    def test_extends_generic_or_qualified(self):
+        self.assertChecks(False, ('extends', 'Dog', 'Animal'),
+                          'class Dog<T> extends Animal {}')
+        self.assertChecks(False, ('extends', 'Dog', 'Animal'),
+                          'class Dog extends zoo.Animal {}')
+
+
+    def test_enum_in_switch_any_case_label(self):
+        for switch in ('switch (c) { case RED: go(); }',
+                       'switch (c) { case RED -> go(); }',
+                       'switch (c) { case RED : go(); }',
+                       'switch (c) { case GREEN, RED -> go(); }'):
+            self.assertChecks(True, ('enum_in_switch', 'RED'), switch)
+
+    def test_enum_in_switch_not_in_comment(self):
+        self.assertChecks(False, ('enum_in_switch', 'RED'),
+                          '// switch (c) { case RED: }\n')
+
+    def test_public_one_line_main_and_to_string(self):
+        self.assertChecks(True, ('public',), '''class A {
+    public static void main(String[] args) { foo(); }
+}''')
+        self.assertChecks(True, ('public',), '''class A {
+    public String toString() { return "x"; }
+}''')
+
+    def test_public_not_in_comments_or_strings(self):
+        self.assertChecks(True, ('public',),
+                          'class A {\n    // public int x;\n}')
+        self.assertChecks(True, ('public',),
+                          'class A {\n    String s = "public int x;";\n}')
+
+    def test_static_one_line_main(self):
+        self.assertChecks(True, ('static_method',), '''class A {
+    public static void main(String[] args) { foo(); }
+}''')
+
+    def test_static_field_not_a_method(self):
+        self.assertChecks(True, ('static_method',), '''class A {
+    static final List<String> L = List.of("a");
+}''')
+
+    def test_static_not_in_comments_or_strings(self):
+        self.assertChecks(True, ('static_method',),
+                          'class A {\n    // static void f()\n}')
+        self.assertChecks(True, ('static_method',),
+                          'class A {\n    String s = "static f()";\n}')
+
+
+class PathologicalTest(unittest.TestCase):
+    '''Inputs which used to make the check regexes backtrack for ages
+    (see java_regex_bench.py): these must now be over in no time.
+    '''
+    def assertQuick(self, check, *args):
+        java_code_checkr._index.cache_clear()
+        java_code_checkr._tokenize.cache_clear()
+        java_code_checkr._code_tokens.cache_clear()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            check(*args)
+        self.assertLess(time.perf_counter() - start, 5)
+
+    def test_public_on_one_huge_line(self):
+        self.assertQuick(check_for_public, 'public ' * 100000)
+
+    def test_static_on_one_huge_line(self):
+        self.assertQuick(check_for_static_method, 'static ' * 100000)
+
+    def test_switches_without_cases(self):
+        self.assertRaises(CodeOutOfSpecException, self.assertQuick,
+                          java_code_checkr.check_for_enum_in_switch,
+                          'switch (x) {}\n' * 50000, 'SATURDAY')
+
+
+class CruftTest(unittest.TestCase):
+    def test_declarations(self):
+        self.assertEqual(java_code_checkr._remove_cruft('''package foo;
+import java.util.List;
+public abstract class A {
+    public static class B {}
+    public void f() {}
+}
+final public class C {}
+public interface I {}
+public enum E { X }
+'''), '''// package foo;
+// import java.util.List;
+abstract class A {
+    static class B {}
+    public void f() {}
+}
+final class C {}
+interface I {}
+enum E { X }
+''')
+
+    def test_comments_and_strings_left_be(self):
+        student_answer = '''/* public class Foo */
+class A {
+    // import this
+    String s = "import java.util.*; public class Foo {}";
+    Class<?> c = A.class;
+}
+'''
+        self.assertEqual(java_code_checkr._remove_cruft(student_answer),
+                         student_answer)
+
+    def test_unterminated(self):
+        self.assertEqual(java_code_checkr._remove_cruft('public class A {} /*'),
+                         'class A {} /*')
+
+    def test_assemble_student_answer(self):
+        self.assertEqual(
+            java_code_checkr._assemble_student_answer('public class A {}'),
+            java_code_checkr._add_cruft('class A {}'))
+
+
+class BatchTest(unittest.TestCase):
+    def test_split_cases(self):
+        output = 'warning\n<<x>>2<<x>>two\n<<x>>3<<x>><<x>>4<<x>>four'
+        self.assertEqual(
+            java_code_checkr._split_cases(output, '<<x>>', 2),
+            {2: 'warning\ntwo\n', 3: '', 4: 'four'})
+
+    def test_split_cases_no_marker(self):
+        self.assertEqual(
+            java_code_checkr._split_cases('Error: oops\n', '<<x>>', 5),
+            {5: 'Error: oops\n'})
+
+    answer = '''
+class Thrower {
+    static void boom(String why) {
+        throw new IllegalStateException(why);
+    }
+}
+'''
+    testcodes = ['System.out.println(1);',
+                 'Runnable r = () -> Thrower.boom("lambda");\nr.run();',
+                 'new Object() {\n    void go() { Thrower.boom("anon"); }\n}.go();',
+                 'try {\n    Thrower.boom("cause");\n} catch (Exception e) {\n'
+                 '    throw new RuntimeException(e);\n}']
+
+    def test_batch_lines_map_to_own_tester(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            java_code_checkr._assemble_batch_tester(
+                self.answer, self.testcodes, '', workspace=tmp)
+            with open(os.path.join(tmp, java_code_checkr._testfile)) as f:
+                batch = f.read().splitlines()
+            tester = '\n'.join(batch)
+            first, last = ([int(n) for n in re.search(
+                name + r' = \{(.*)\}', tester).group(1).split(', ')]
+                for name in ('FIRST_LINES', 'LAST_LINES'))
+            main_line = int(re.search(r'MAIN_LINE = (\d+)', tester).group(1))
+            for i, testcode in enumerate(self.testcodes):
+                java_code_checkr._assemble_tester(self.answer, testcode, '',
+                                                  workspace=tmp)
+                with open(os.path.join(tmp, java_code_checkr._testfile)) as f:
+                    own = f.read().splitlines()
+                self.assertEqual(batch[first[i] - 1:last[i]],
+                                 own[main_line - 1:
+                                     main_line + last[i] - first[i]])
+                self.assertEqual(batch[first[i] - 1].strip(),
+                                 testcode.splitlines()[0])
+
+    @unittest.skipUnless(shutil.which('javac'), 'needs a JDK')
+    def test_batch_output_same_as_separate_runs(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                separate = []
+                for testcode in self.testcodes:
+                    out, err = io.StringIO(), io.StringIO()
+                    with contextlib.redirect_stdout(out), \
+                            contextlib.redirect_stderr(err):
+                        java_code_checkr.compile_and_run(self.answer, testcode)
+                    separate.append((out.getvalue(), err.getvalue()))
+                batch = java_code_checkr.compile_and_run_many(
+                    self.answer, self.testcodes)
+            finally:
+                os.chdir(cwd)
+        self.assertIn('Tester.main(Tester.java:', separate[1][1])
+        self.assertEqual(batch, separate)
+
+    def test_compiler_output_for_every_case(self):
+        saved = java_code_checkr._javac, java_code_checkr._run_many
+        java_code_checkr._javac = lambda *args: (
+            0, '', 'Note: Tester.java uses unchecked or unsafe operations.\n')
+        java_code_checkr._run_many = lambda count, *args: [
+            (str(case), '') for case in range(count)]
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                results = java_code_checkr.compile_and_run_many(
+                    self.answer, self.testcodes, workspace=tmp)
+        finally:
+            java_code_checkr._javac, java_code_checkr._run_many = saved
+        self.assertEqual(results, [
+            (str(case),
+             'Note: Tester.java uses unchecked or unsafe operations.\n')
+            for case in range(len(self.testcodes))])
+
+
+class CacheTest(unittest.TestCase):
+    '''Exercises the compile cache with a stand-in for javac.
+    '''
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.saved = (java_code_checkr._cache_dir,
+                      java_code_checkr._cache_size,
+                      java_code_checkr._javac_into)
+        java_code_checkr._cache_dir = os.path.join(self.tmp.name, 'cache')
+        java_code_checkr._javac_into = self.fake_javac
+        self.compilations = 0
+
+    def tearDown(self):
+        (java_code_checkr._cache_dir,
+         java_code_checkr._cache_size,
+         java_code_checkr._javac_into) = self.saved
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def fake_javac(self, classes, ncoding='utf-8',
+                   source=java_code_checkr._testfile, library=None):
+        self.compilations += 1
+        with open(source) as f:
+            source = f.read()
+        if 'broken' in source:
+            return 1, '', 'Tester.java:1: error: broken\n'
+        os.makedirs(os.path.join(classes, 'foobar'), exist_ok=True)
+        with open(os.path.join(classes, 'foobar', 'Tester.class'), 'w') as f:
+            f.write(source)
+        return 0, '', ''
+
+    def compile(self, source):
+        java_code_checkr._write_tester(source)
+        return java_code_checkr._javac()
+
+    def test_hit_restores_classes(self):
+        self.assertEqual(self.compile('class Tester {}'), (0, '', ''))
+        os.remove(os.path.join('foobar', 'Tester.class'))
+        self.assertEqual(self.compile('class Tester {}'), (0, '', ''))
+        self.assertEqual(self.compilations, 1)
+        self.assertTrue(os.path.exists(os.path.join('foobar', 'Tester.class')))
+
+    def test_different_source_misses(self):
+        self.compile('class Tester {}')
+        self.compile('class Tester { int x; }')
+        self.assertEqual(self.compilations, 2)
+
+    def test_compile_errors_cached(self):
+        first = self.compile('broken')
+        self.assertEqual(self.compile('broken'), first)
+        self.assertEqual(first[0], 1)
+        self.assertEqual(self.compilations, 1)
+
+    def test_support_files_leave_out_tester(self):
+        with open('Props.java', 'w') as f:
+            f.write('public class Props {}')
+        java_code_checkr._write_tester('class Tester {}')
+        self.assertEqual(java_code_checkr._assemble_support_files(),
+                         'class Props {}')
+
+    def test_support_library_compiled_once(self):
+        support = 'class Props {}'
+        library = java_code_checkr._support_library(support)
+        self.assertTrue(library.endswith('.jar'))
+        self.assertEqual(java_code_checkr._support_library(support), library)
+        self.assertEqual(self.compilations, 1)
+
+    def test_support_library_not_compilable(self):
+        self.assertIsNone(java_code_checkr._support_library('broken'))
+        self.assertIsNone(java_code_checkr._support_library('broken'))
+        self.assertEqual(self.compilations, 1)
+
+    def test_compile_in_workspace(self):
+        with java_code_checkr._workspace() as workspace:
+            java_code_checkr._write_tester('class Tester {}',
+                                           workspace=workspace)
+            self.assertEqual(java_code_checkr._javac(workspace=workspace),
+                             (0, '', ''))
+            self.assertTrue(os.path.exists(
+                os.path.join(workspace, 'foobar', 'Tester.class')))
+        self.assertFalse(os.path.exists(workspace))
+        self.assertEqual(sorted(os.listdir()), ['cache'])
+
+    def test_errors_without_workspace_path(self):
+        workspace = os.path.join(self.tmp.name, 'ws')
+        java_code_checkr._cache_dir = ''
+        java_code_checkr._javac_into = self.saved[2]
+        call = java_code_checkr._call
+        java_code_checkr._call = lambda args, phase: (
+            1, '', '%s:1: error: broken\n' % args[-1])
+        try:
+            with java_code_checkr._workspace(workspace):
+                java_code_checkr._write_tester('broken', workspace=workspace)
+                self.assertEqual(
+                    java_code_checkr._javac(workspace=workspace),
+                    (1, '', 'Tester.java:1: error: broken\n'))
+        finally:
+            java_code_checkr._call = call
+        self.assertTrue(os.path.isdir(workspace))
+
+    def test_findbugs_results_cached(self):
+        os.makedirs('foobar')
+        with open(os.path.join('foobar', 'Tester.class'), 'wb') as f:
+            f.write(b'bytecode')
+        with open(java_code_checkr._findbugs_filter, 'w') as f:
+            f.write('<FindBugsFilter/>')
+        analyses = []
+        call = java_code_checkr._call
+
+        def fake_findbugs(args, phase):
+            analyses.append(args)
+            return 0, 'M D UuF: Unused field  In Tester.java\n', ''
+        java_code_checkr._call = fake_findbugs
+        try:
+            workspace = os.getcwd()
+            first = java_code_checkr._findbugs_run(workspace)
+            self.assertEqual(java_code_checkr._findbugs_run(workspace), first)
+            self.assertEqual(len(analyses), 1)
+            self.assertEqual(analyses[0][-1],
+                             os.path.join(workspace, 'foobar', 'Tester.class'))
+            time.sleep(0.01)
+            with open(java_code_checkr._findbugs_filter, 'w') as f:
+                f.write('<FindBugsFilter></FindBugsFilter>')
+            java_code_checkr._findbugs_run(workspace)
+            self.assertEqual(len(analyses), 2)
+        finally:
+            java_code_checkr._call = call
+
+    def test_tampered_entry_not_used(self):
+        self.compile('class Tester {}')
+        entry, = os.listdir(java_code_checkr._cache_dir)
+        with open(os.path.join(java_code_checkr._cache_dir, entry),
+                  'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last[0] ^ 1]))
+        self.compile('class Tester {}')
+        self.assertEqual(self.compilations, 2)
+
+    def test_entry_only_good_for_its_name(self):
+        self.compile('class Tester {}')
+        entry, = os.listdir(java_code_checkr._cache_dir)
+        java_code_checkr._write_tester('class Tester { int x; }')
+        key = java_code_checkr._cache_key()
+        os.rename(os.path.join(java_code_checkr._cache_dir, entry),
+                  os.path.join(java_code_checkr._cache_dir, key + '.zip'))
+        self.compile('class Tester { int x; }')
+        self.assertEqual(self.compilations, 2)
+
+    def test_untrusted_cache_not_used(self):
+        os.chmod(java_code_checkr._trusted_cache(), 0o777)
+        self.assertIsNone(java_code_checkr._trusted_cache())
+        self.compile('class Tester {}')
+        self.compile('class Tester {}')
+        self.assertEqual(self.compilations, 2)
+        self.assertEqual(os.listdir(java_code_checkr._cache_dir), [])
+        self.assertIsNone(java_code_checkr._support_library('class Props {}'))
+
+    def test_cache_made_private(self):
+        cache = java_code_checkr._trusted_cache()
+        self.assertEqual(os.stat(cache).st_mode & 0o777, 0o700)
+
+    def test_lru_eviction(self):
+        self.compile('class Tester {}')
+        java_code_checkr._cache_size = 0
+        self.compile('class Tester { int x; }')
+        self.assertEqual(os.listdir(java_code_checkr._cache_dir), [])
+
+
+class FakeWorker(socketserver.StreamRequestHandler):
+    '''Answers every request the way CheckrWorker would, echoing the
+    request fields back on stdout.
+    '''
+    def handle(self):
+        fields = []
+        for _ in range(struct.unpack('>i', self.rfile.read(4))[0]):
+            size, = struct.unpack('>i', self.rfile.read(4))
+            fields.append(self.rfile.read(size).decode('utf-8'))
+        out = ' '.join(fields).encode('utf-8')
+        err = 'Tester.java:1: error'.encode('utf-8')
+        self.wfile.write(struct.pack('>i', 3)
+                         + struct.pack('>i', len(out)) + out
+                         + struct.pack('>i', len(err)) + err)
+
+
+class WorkerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = socketserver.TCPServer(('localhost', 0), FakeWorker)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.worker = java_code_checkr._worker
+
+    def tearDown(self):
+        java_code_checkr._worker = self.worker
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_worker_call(self):
+        java_code_checkr._worker = 'localhost:%d' % self.server.server_address[1]
+        self.assertEqual(
+            java_code_checkr._worker_call('java', '.', 'foobar.Tester', ''),
+            (3, 'java . foobar.Tester ', 'Tester.java:1: error'))
+
+    def test_no_worker(self):
+        java_code_checkr._worker = None
+        self.assertIsNone(java_code_checkr._worker_call('javac'))
+
+    def test_worker_not_listening(self):
+        port = self.server.server_address[1]
+        self.server.shutdown()
+        self.server.server_close()
+        java_code_checkr._worker = 'localhost:%d' % port
+        self.assertIsNone(java_code_checkr._worker_call('javac'))
+
+    def run_main(self, worker, data_file=False):
+        '''What _run prints with stdin from a file, and java a shell script
+        echoing its stdin.
+        '''
+        cwd = os.getcwd()
+        saved = (java_code_checkr._limits, os.environ['PATH'], sys.stdin)
+        out = io.StringIO()
+        with tempfile.TemporaryDirectory() as bin, \
+                tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(bin, 'java'), 'w') as f:
+                f.write('#!/bin/sh\ncat\n')
+            os.chmod(os.path.join(bin, 'java'), 0o755)
+            with open(os.path.join(bin, 'stdin.txt'), 'w') as f:
+                f.write('42\n')
+            os.chdir(tmp)
+            os.mkdir('ws')
+            if data_file:
+                open('data.txt', 'w').close()
+            java_code_checkr._worker = worker
+            java_code_checkr._limits = {
+                'run': {'wall': 5, 'cpu': None, 'memory': None,
+                        'processes': None, 'output': None}}
+            os.environ['PATH'] = bin + os.pathsep + os.environ['PATH']
+            sys.stdin = open(os.path.join(bin, 'stdin.txt'))
+            try:
+                with contextlib.redirect_stdout(out):
+                    java_code_checkr._run(workspace='ws')
+            finally:
+                sys.stdin.close()
+                (java_code_checkr._limits, os.environ['PATH'],
+                 sys.stdin) = saved
+                os.chdir(cwd)
+        return out.getvalue()
+
+    def test_stdin_with_worker(self):
+        out = self.run_main('localhost:%d' % self.server.server_address[1])
+        self.assertTrue(out.startswith('java '))
+        self.assertTrue(out.endswith(' foobar.Tester 42\n 5000'))
+
+    def test_stdin_without_worker(self):
+        self.assertEqual(self.run_main(None), '42\n')
+
+    def test_stdin_when_worker_not_listening(self):
+        port = self.server.server_address[1]
+        self.server.shutdown()
+        self.server.server_close()
+        self.assertEqual(self.run_main('localhost:%d' % port), '42\n')
+
+    def test_data_files_not_in_worker(self):
+        worker = 'localhost:%d' % self.server.server_address[1]
+        self.assertEqual(self.run_main(worker, data_file=True), '42\n')
+
+
+class JUnitTest(unittest.TestCase):
+    def test_test_classes(self):
+        answer = '''
+class Counter {
+    int count() { return 1; }
+}
+
+class CounterTest {
+    @Test
+    void counts() { assertEquals(1, new Counter().count()); }
+
+    @Test
+    void countsAgain() { assertEquals(1, new Counter().count()); }
+}
+
+class Helper {
+    @Override
+    public String toString() { return "@Test"; }
+}
+'''
+        self.assertEqual(java_code_checkr._index(answer).test_classes,
+                         ['CounterTest'])
+
+    def test_results(self):
+        with tempfile.TemporaryDirectory() as reports:
+            with open(os.path.join(reports, 'TEST-junit-jupiter.xml'),
+                      'w') as f:
+                f.write('''<?xml version="1.0" encoding="UTF-8"?>
+<testsuite name="JUnit Jupiter" tests="3" failures="1" errors="0">
+  <testcase name="counts()" classname="foobar.CounterTest" time="0.012"/>
+  <testcase name="countsAgain()" classname="foobar.CounterTest" time="0.5">
+    <failure message="expected: &lt;2&gt; but was: &lt;1&gt;"
+             type="org.opentest4j.AssertionFailedError">trace</failure>
+  </testcase>
+  <testcase name="later()" classname="foobar.CounterTest" time="0">
+    <skipped/>
+  </testcase>
+</testsuite>
+''')
+            results = java_code_checkr._junit_results(reports)
+        self.assertEqual(
+            [(r['name'], r['outcome'], r['duration']) for r in results],
+            [('counts()', 'passed', 0.012), ('countsAgain()', 'failed', 0.5),
+             ('later()', 'skipped', 0.0)])
+        self.assertEqual(results[1]['message'], 'expected: <2> but was: <1>')
+        self.assertEqual(java_code_checkr._junit_results(reports), [])
+
+    def junit(self, java):
+        '''What compile_and_junit prints, with javac stood in for and
+        java a shell script.
+        '''
+        cwd = os.getcwd()
+        saved = (java_code_checkr._javac_into, java_code_checkr._limits,
+                 java_code_checkr._worker, os.environ['PATH'])
+        out = io.StringIO()
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, 'java'), 'w') as f:
+                f.write('#!/bin/sh\n' + java + '\n')
+            os.chmod(os.path.join(tmp, 'java'), 0o755)
+            os.chdir(tmp)
+            java_code_checkr._javac_into = lambda *args: (0, '', '')
+            java_code_checkr._limits = {
+                'compile': {'wall': None, 'cpu': None, 'memory': None,
+                            'processes': None, 'output': None},
+                'run': {'wall': 1, 'cpu': None, 'memory': None,
+                        'processes': None, 'output': None}}
+            java_code_checkr._worker = None
+            os.environ['PATH'] = tmp + os.pathsep + os.environ['PATH']
+            try:
+                with contextlib.redirect_stdout(out), \
+                        contextlib.redirect_stderr(out):
+                    java_code_checkr.compile_and_junit('class A {}', '',
+                                                       workspace='ws')
+            finally:
+                (java_code_checkr._javac_into, java_code_checkr._limits,
+                 java_code_checkr._worker, os.environ['PATH']) = saved
+                os.chdir(cwd)
+        return out.getvalue()
+
+    def test_timed_out_not_passed(self):
+        self.assertEqual(self.junit('sleep 30'),
+                         java_code_checkr._time_limit_message + '\n')
+
+    def test_passed(self):
+        self.assertEqual(self.junit('exit 0'), 'JUnit tests passed\n')
+
+    def test_failed(self):
+        self.assertEqual(self.junit('exit 1'),
+                         '** Some JUnit tests failed **\n')
+
+    def test_crashed_not_passed(self):
+        self.assertEqual(self.junit('exit 134'),
+                         "** JUnit tests didn't run to the end **\n")
+
+
+class LimitsTest(unittest.TestCase):
+    def setUp(self):
+        self.limits = java_code_checkr._limits
+        java_code_checkr._limits = {
+            'run': {'wall': 1, 'cpu': 5, 'memory': None, 'processes': None,
+                    'output': None}}
+
+    def tearDown(self):
+        java_code_checkr._limits = self.limits
+
+    def test_hanging_process_is_killed(self):
+        start = time.monotonic()
+        status, _, err = java_code_checkr._call(
+            ['sh', '-c', 'sleep 30 & sleep 30'], 'run')
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertNotEqual(status, 0)
+        self.assertTrue(
+            err.endswith(java_code_checkr._time_limit_message + '\n'))
+
+    def test_wall_clock_scales_with_cases(self):
+        status, _, err = java_code_checkr._call(['sleep', '1.5'], 'run', 2)
+        self.assertEqual((status, err), (0, ''))
+
+    def test_flood_cut_short(self):
+        java_code_checkr._limits['run']['output'] = 1024 * 1024
+        start = time.monotonic()
+        status, out, err = java_code_checkr._call(
+            ['sh', '-c', 'yes >&2 & yes'], 'run')
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertNotEqual(status, 0)
+        self.assertTrue(
+            err.endswith(java_code_checkr._output_limit_message + '\n'))
+        self.assertLessEqual(
+            len(out) + len(err) - len(java_code_checkr._output_limit_message)
+            - 1, 1024 * 1024)
+        self.assertEqual(set(out), {'y', '\n'})
+
+    def test_output_scales_with_cases(self):
+        java_code_checkr._limits['run']['output'] = 1000
+        status, out, err = java_code_checkr._call(
+            ['sh', '-c', 'head -c 1500 /dev/zero'], 'run', 2)
+        self.assertEqual((status, len(out), err), (0, 1500, ''))
+
+    def test_input(self):
+        self.assertEqual(java_code_checkr._call(['cat'], 'run',
+                                                input='42\n' * 100000),
+                         (0, '42\n' * 100000, ''))
+
+    def test_out_of_memory(self):
+        err = 'Exception in thread "main" java.lang.OutOfMemoryError\n'
+        self.assertEqual(
+            java_code_checkr._limit_messages(1, err,
+                                             java_code_checkr._limits['run']),
+            err + java_code_checkr._memory_limit_message + '\n')
+
+
 if __name__ == '__main__':
     unittest.main()
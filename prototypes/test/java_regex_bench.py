@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+'''Times check_for_public, check_for_static_method and
+check_for_enum_in_switch on pathological answers (everything on one huge
+line, switches with no cases...) against the regexes they used to use.
+The regexes backtrack, so their time grows with the square of the size
+(they're only run on the smaller sizes); the declaration scan stays linear.
+Not a unit test - run it by hand.
+
+(cc) CC BY-NC 4.0 2016-2020 Peter Sander
+'''
+
+import contextlib
+import io
+import os
+import re
+import sys
+import time
+
+sys.path.append(os.path.join(sys.path[0], '../src'))
+import java_code_checkr
+
+
+# the regexes the checks used to use
+_old_public = re.compile(r'public(.*)(?<!main)(?<!toString)[;(]')
+_old_static = re.compile(r'static(.*)(?<!main)\(')
+_old_switch = re.compile(r'switch.*?case\s+SATURDAY:', re.DOTALL)
+
+# the largest answer the old regexes are tried on
+_old_limit = 40_000
+
+_cases = [
+    ('public', java_code_checkr.check_for_public, (), _old_public,
+     lambda n: 'public int ' * (n // 11)),
+    ('static', java_code_checkr.check_for_static_method, (), _old_static,
+     lambda n: 'static int ' * (n // 11)),
+    ('switch', java_code_checkr.check_for_enum_in_switch, ('SATURDAY',),
+     _old_switch, lambda n: 'switch (day) { default: }\n' * (n // 26)),
+]
+
+
+def _time(function, *args):
+    '''Seconds taken by a call, starting from cold caches.
+    '''
+    java_code_checkr._index.cache_clear()
+    java_code_checkr._tokenize.cache_clear()
+    java_code_checkr._code_tokens.cache_clear()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        with contextlib.suppress(java_code_checkr.CodeOutOfSpecException):
+            function(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    print('%-8s %10s %12s %12s' % ('check', 'chars', 'regex ms', 'scan ms'))
+    for name, check, args, old, generate in _cases:
+        for size in (10_000, 20_000, 40_000, 400_000, 4_000_000):
+            answer = generate(size)
+            regex = '%12.1f' % (_time(old.search, answer) * 1000) \
+                if size <= _old_limit else '%12s' % '-'
+            scan = _time(check, answer, *args) * 1000
+            print('%-8s %10d %s %12.1f' % (name, len(answer), regex, scan))
+
+
+if __name__ == '__main__':
+    main()
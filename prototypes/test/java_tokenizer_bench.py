@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+'''Times java_code_checkr's single-pass cruft removal on generated answers
+of increasing size, to show that it stays linear: the time per KB should
+stay (roughly) flat as the answers grow.
+Not a unit test - run it by hand.
+
+(cc) CC BY-NC 4.0 2016-2020 Peter Sander
+'''
+
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.join(sys.path[0], '../src'))
+import java_code_checkr
+
+
+def generate_answer(size):
+    '''Generates a Java answer of about size characters, with all the
+    things the tokenizer has to deal with.
+    '''
+    parts = ['package generated;\n', 'import java.util.List;\n']
+    length = 0
+    i = 0
+    while length < size:
+        part = '''
+/**
+ * Class number %d.
+ * @author J. Random Author
+ */
+public final class Generated%d {
+    private String s = "public class Nope%d { import this; }";
+    private char c = '\\\\'';
+    // public interface Nope%d
+    public int value(int x) {
+        return x * %d + 0x1F;
+    }
+}
+''' % (i, i, i, i, i)
+        parts.append(part)
+        length += len(part)
+        i += 1
+    return ''.join(parts)
+
+
+def main():
+    print('%10s %10s %10s' % ('KB', 'ms', 'us/KB'))
+    for size in (100_000, 200_000, 400_000, 800_000):
+        answer = generate_answer(size)
+
+        def remove_cruft():
+            # no helping hand from the token cache
+            java_code_checkr._tokenize.cache_clear()
+            java_code_checkr._code_tokens.cache_clear()
+            java_code_checkr._remove_cruft(answer)
+
+        seconds = min(timeit.repeat(remove_cruft, number=1, repeat=5))
+        kb = len(answer) / 1000
+        print('%10.0f %10.1f %10.1f' % (kb, seconds * 1000,
+                                        seconds * 1e6 / kb))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+
+'''Exercises (some of) the python_code_checkr.py functions.
+
+(cc) CC BY-NC 4.0 2016-2020 Peter Sander
+'''
+
+import contextlib
+import io
+import marshal
+import os
+import os.path
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.append(os.path.join(sys.path[0], '../src'))
+import python_code_checkr
+
+
+class SupportFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.cache_dir = python_code_checkr._cache_dir
+        python_code_checkr._cache_dir = os.path.join(self.tmp.name, 'cache')
+        with open('helpers.py', 'w') as f:
+            f.write('import math\n\ndef area(r):\n    return 3 * r * r\n')
+
+    def tearDown(self):
+        python_code_checkr._cache_dir = self.cache_dir
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_support_files_leave_out_tester(self):
+        with open(python_code_checkr._testfile, 'w') as f:
+            f.write('print(area(2))\n')
+        self.assertEqual(python_code_checkr._assemble_support_files(),
+                         'import math\n\ndef area(r):\n    return 3 * r * r\n')
+
+    def test_compiled_support_files(self):
+        support_files = python_code_checkr._assemble_support_files()
+        compiled = python_code_checkr._compiled_support_files(support_files)
+        self.assertEqual(
+            python_code_checkr._compiled_support_files(support_files),
+            compiled)
+        python_code_checkr._assemble_tester('', 'print(area(2))',
+                                            support_files)
+        with open(python_code_checkr._testfile) as f:
+            self.assertNotIn('def area', f.read())
+        self.assertEqual(
+            subprocess.run([sys.executable, python_code_checkr._testfile],
+                           capture_output=True, text=True).stdout,
+            '12\n')
+
+    def forge(self, compiled):
+        # what an earlier submission might have left there
+        with open(compiled, 'r+b') as f:
+            f.seek(32)
+            f.write(marshal.dumps(compile('print("pwned")', 'x', 'exec')))
+            f.truncate()
+
+    def test_tampered_support_files_recompiled(self):
+        support_files = python_code_checkr._assemble_support_files()
+        compiled, digest = python_code_checkr._compiled_support_files(
+            support_files)
+        self.forge(compiled)
+        self.assertEqual(
+            python_code_checkr._compiled_support_files(support_files),
+            (compiled, digest))
+        python_code_checkr._assemble_tester('', 'print(area(2))',
+                                            support_files)
+        self.assertEqual(
+            subprocess.run([sys.executable, python_code_checkr._testfile],
+                           capture_output=True, text=True).stdout,
+            '12\n')
+
+    def test_support_files_changed_after_assembly_not_run(self):
+        support_files = python_code_checkr._assemble_support_files()
+        python_code_checkr._assemble_tester('', 'print(area(2))',
+                                            support_files)
+        compiled, _ = python_code_checkr._compiled_support_files(
+            support_files)
+        self.forge(compiled)
+        result = subprocess.run([sys.executable, python_code_checkr._testfile],
+                                capture_output=True, text=True)
+        self.assertNotIn('pwned', result.stdout)
+        self.assertIn('ImportError', result.stderr)
+
+    def test_untrusted_cache_not_used(self):
+        os.makedirs(python_code_checkr._cache_dir)
+        os.chmod(python_code_checkr._cache_dir, 0o777)
+        self.assertIsNone(python_code_checkr._compiled_support_files(
+            python_code_checkr._assemble_support_files()))
+        self.assertEqual(os.listdir(python_code_checkr._cache_dir), [])
+
+    def test_cache_made_private(self):
+        python_code_checkr._compiled_support_files(
+            python_code_checkr._assemble_support_files())
+        self.assertEqual(
+            os.stat(python_code_checkr._cache_dir).st_mode & 0o777, 0o700)
+
+    def test_lru_eviction(self):
+        cache_size = python_code_checkr._cache_size
+        try:
+            first, _ = python_code_checkr._compiled_support_files('x = 1')
+            second, _ = python_code_checkr._compiled_support_files('x = 2')
+            os.utime(first, (0, 0))
+            os.utime(second, (1, 1))
+            # used again, so no longer the least recently used
+            python_code_checkr._compiled_support_files('x = 1')
+            python_code_checkr._cache_size = 2 * os.path.getsize(first)
+            third, _ = python_code_checkr._compiled_support_files('x = 3')
+        finally:
+            python_code_checkr._cache_size = cache_size
+        self.assertEqual(sorted(os.listdir(python_code_checkr._cache_dir)),
+                         sorted(os.path.basename(compiled)
+                                for compiled in (first, third)))
+
+
+class CruftTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        with open('helpers.py', 'w') as f:
+            f.write('def area(r):\n    return 3 * r * r\n')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_imports(self):
+        self.assertEqual(
+            python_code_checkr._remove_cruft(
+                'import math, helpers\n'
+                'from helpers import area\n'
+                'from .shapes import Square\n'
+                'import no_such_module as nsm\n'
+                'from os import (path,\n'
+                '                sep)\n'
+                'def f():\n'
+                '    import helpers\n'
+                '    return "import helpers"  # from helpers\n'),
+            'import math\n'
+            'pass\n'
+            'pass\n'
+            'pass\n'
+            'from os import (path,\n'
+            '                sep)\n'
+            'def f():\n'
+            '    pass\n'
+            '    return "import helpers"  # from helpers\n')
+
+    def test_main_guards(self):
+        answer = '''def main():
+    print("if __name__ == '__main__'")
+
+if __name__ == '__main__':
+    main()
+else:
+    print('imported')
+
+if '__main__' == __name__:
+    main()
+'''
+        self.assertEqual(
+            python_code_checkr._remove_cruft(answer),
+            answer.replace("if __name__ == '__main__':", 'if False:')
+                  .replace("if '__main__' == __name__:", 'if False:'))
+        self.assertEqual(
+            python_code_checkr._remove_cruft(answer, unittesting=True),
+            answer.replace("if __name__ == '__main__':", 'if False:')
+                  .replace('    main()\n', '    hijack()\n')
+                  .replace('    hijack()\nelse', '    main()\nelse'))
+
+    def test_syntax_error_left_be(self):
+        self.assertEqual(python_code_checkr._remove_cruft('import math\nx = '),
+                         'import math\nx = ')
+
+
+class WorkspaceTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.cache_dir = python_code_checkr._cache_dir
+        python_code_checkr._cache_dir = ''
+        with open('helpers.py', 'w') as f:
+            f.write('def area(r):\n    return 3 * r * r\n')
+
+    def tearDown(self):
+        python_code_checkr._cache_dir = self.cache_dir
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_nothing_left_behind(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            python_code_checkr.interpret('x = 7', 'print(area(x))')
+        self.assertEqual(out.getvalue(), '147\n')
+        self.assertEqual(os.listdir(), ['helpers.py'])
+
+    def test_given_workspace(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            python_code_checkr.interpret('', 'print(1)', workspace='ws')
+        self.assertTrue(
+            os.path.exists(os.path.join('ws', python_code_checkr._testfile)))
+
+    def test_grade_many(self):
+        jobs = [(python_code_checkr.interpret, 'x = %d' % i, 'print(area(x))')
+                for i in range(4)]
+        jobs.append((python_code_checkr.interpret, 'x = ', 'print(x)'))
+        results = python_code_checkr.grade_many(jobs, max_workers=2)
+        self.assertEqual([out for out, _ in results[:4]],
+                         ['0\n', '3\n', '12\n', '27\n'])
+        out, err = results[4]
+        self.assertEqual(out, '')
+        self.assertIn('SyntaxError', err)
+        self.assertIn('File "tester.py"', err)
+        self.assertIn('** Further testing aborted **', err)
+        self.assertEqual(os.listdir(), ['helpers.py'])
+
+
+class ForkserverTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        address = os.path.join(self.tmp.name, 'forkserver.sock')
+        self.server = subprocess.Popen(
+            [sys.executable, os.path.join(os.path.dirname(__file__), '..',
+                                          'src', 'python_forkserver.py'),
+             address])
+        for _ in range(100):
+            if os.path.exists(address):
+                break
+            time.sleep(0.05)
+        self.saved = python_code_checkr._forkserver, python_code_checkr._call
+        python_code_checkr._forkserver = address
+        python_code_checkr._call = self.no_subprocess
+
+    def tearDown(self):
+        python_code_checkr._forkserver, python_code_checkr._call = self.saved
+        self.server.kill()
+        self.server.wait()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def no_subprocess(self, args, phase='run', env=None):
+        self.fail('ran %s as a subprocess' % args)
+
+    def interpret(self, student_answer, testcode):
+        out, err = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            python_code_checkr.interpret(student_answer, testcode)
+        return out.getvalue(), err.getvalue()
+
+    def test_runs_in_clean_main(self):
+        self.assertEqual(
+            self.interpret('x = 6', 'print(x * 7, __name__)\n'
+                                    'print(sorted(globals())[:3])'),
+            ("42 __main__\n['__builtins__', '__doc__', '__file__']\n", ''))
+        self.assertEqual(self.interpret('', 'print("x" in globals())'),
+                         ('False\n', ''))
+
+    def test_uncaught_exception(self):
+        out, err = self.interpret('def f():\n    return 1 / 0', 'f()')
+        self.assertTrue(err.startswith('Traceback (most recent call last):\n'
+                                       '  File "tester.py"'))
+        self.assertIn('ZeroDivisionError', err)
+        self.assertNotIn('python_forkserver', err)
+        self.assertTrue(err.endswith('** Further testing aborted **\n'))
+
+    def test_time_limit(self):
+        limits = python_code_checkr._limits
+        python_code_checkr._limits = {
+            'run': {'wall': 1, 'cpu': 5, 'memory': None, 'processes': None}}
+        try:
+            _, err = self.interpret('', 'while True: pass')
+        finally:
+            python_code_checkr._limits = limits
+        self.assertIn(python_code_checkr._time_limit_message, err)
+
+
+class LimitsTest(unittest.TestCase):
+    def setUp(self):
+        self.limits = python_code_checkr._limits
+        python_code_checkr._limits = {
+            'run': {'wall': 1, 'cpu': 5,
+                    'memory': 512 * 1024 * 1024, 'processes': None}}
+
+    def tearDown(self):
+        python_code_checkr._limits = self.limits
+
+    def test_infinite_loop_times_out(self):
+        status, out, err = python_code_checkr._call(
+            [sys.executable, '-c', 'print("going", flush=True)\n'
+                                   'while True: pass'])
+        self.assertNotEqual(status, 0)
+        self.assertEqual(out, 'going\n')
+        self.assertTrue(
+            err.endswith(python_code_checkr._time_limit_message + '\n'))
+
+    def test_memory_hog_runs_out(self):
+        status, _, err = python_code_checkr._call(
+            [sys.executable, '-c', 'x = bytearray(1024 ** 3)'])
+        self.assertNotEqual(status, 0)
+        self.assertTrue(
+            err.endswith(python_code_checkr._memory_limit_message + '\n'))
+
+    def test_within_limits(self):
+        self.assertEqual(
+            python_code_checkr._call([sys.executable, '-c', 'print(42)']),
+            (0, '42\n', ''))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,16 +1,407 @@
 #! /usr/bin/env python3
 
-from random import randint
-
-def main():
-    f = open('weblog.txt', 'r')
-    line = f.readline()
-    # limit = 0
-    while line != '':
-        if (randint(0, 15) == 0):
-            print(line, end='')
-        line = f.readline()
-        # limit += 1
+'''Samples the lines of (large) log files, gzipped or not.
+
+Either each line is kept with a given probability (1/16 by default), or
+exactly k lines are kept, each as likely as any other (reservoir
+sampling). Both work on big chunks of the file, split into lines in one
+go, and jump from one sampled line to the next with random skips rather
+than rolling a die for each line, so that throughput is close to reading
+the file. With a seed, the sample is the same from one run to the next.
+
+The input is cut up into units - newline-aligned byte ranges of plain
+files, whole .gz files - each sampled with a random generator of its own,
+seeded from the seed and the unit's number. Units can then be sampled in
+a pool of processes, and the sample is the same whatever the number of
+processes, none included. Samples come out in input order.
+
+Plain files can also be sampled through an index of their line start
+offsets, kept in path.idx and brought up to date (by indexing just what
+was appended, if that's all that happened) before sampling. Sampling then
+only reads the lines sampled, at random, rather than the whole file.
+'''
+
+from array import array
+import collections
+import concurrent.futures
+import gzip
+import hashlib
+import heapq
+import itertools
+import math
+import mmap
+import os
+import random
+import sys
+
+# bytes read at a time
+_chunk_size = 1 << 22
+# bytes of a plain file per unit
+_unit_size = 1 << 26
+# an index starts with a header of uint64: this, then what identifies the
+# file indexed - its device and inode, and hashes of the first and last
+# lines indexed
+_index_magic = int.from_bytes(b'lightidx', 'little')
+_header = 5
+
+
+def main(*paths, rate=1 / 16, k=None, seed=None, out=None, jobs=None,
+         index=False):
+    '''Writes the sample of the lines of the files at paths (weblog.txt by
+    default) to out (stdout by default), in the order they come in. With
+    jobs, units are sampled in that many processes; with index, lines are
+    sampled through the files' indexes.
+    '''
+    out = out or sys.stdout.buffer
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(64)
+    if index:
+        _sample_indexed(paths or ['weblog.txt'], rate, k, seed, out)
+        out.flush()
+        return
+    units = [(path, start, end, '%s:%d' % (seed, i)) for i, (path, start, end)
+             in enumerate(_units(paths or ['weblog.txt']))]
+    with (concurrent.futures.ProcessPoolExecutor(jobs) if jobs
+          else _InProcess()) as executor:
+        samples = _ordered(executor, _sample, units, rate, k, 2 * (jobs or 1))
+        if k is None:
+            for sample in samples:
+                out.write(sample)
+        else:
+            # the k smallest keys of all are among the k smallest of each
+            kept = heapq.nsmallest(k, ((key, n, position, line)
+                                       for n, sample in enumerate(samples)
+                                       for key, position, line in sample))
+            out.write(b''.join(line + b'\n' for _, _, _, line in sorted(
+                kept, key=lambda kept: kept[1:3])))
+    out.flush()
+
+
+def _units(paths):
+    '''The units of work, as (path, start, end) - no start and end for
+    whole files: gzip files, and pipes and such.
+    '''
+    for path in paths:
+        if path.endswith('.gz') or not os.path.isfile(path):
+            yield path, None, None
+            continue
+        size = os.path.getsize(path)
+        start = 0
+        with open(path, 'rb') as f:
+            while start < size:
+                f.seek(start + _unit_size)
+                f.readline()
+                end = min(f.tell(), size)
+                yield path, start, end
+                start = end
+
+
+def _sample(path, start, end, seed, rate, k):
+    '''The sample of one unit: the lines sampled, newlines and all, or the
+    reservoir, as (key, position, line).
+    '''
+    rnd = random.Random(seed)
+    with (gzip.open(path, 'rb') if path.endswith('.gz')
+          else open(path, 'rb')) as f:
+        blocks = _blocks(f, start, end)
+        if k is None:
+            return b''.join(line + b'\n' for lines in bernoulli(blocks, rate, rnd)
+                            for line in lines)
+        return reservoir(blocks, k, rnd)
+
+
+def _ordered(executor, fn, units, rate, k, ahead):
+    '''The results of fn on the units, in order, with no more than ahead
+    of them in the works at a time.
+    '''
+    pending = collections.deque()
+    for unit in units:
+        pending.append(executor.submit(fn, *unit, rate, k))
+        if len(pending) >= ahead:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+class _InProcess:
+    '''An executor that runs everything there and then.
+    '''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def submit(self, fn, *args):
+        future = concurrent.futures.Future()
+        future.set_result(fn(*args))
+        return future
+
+
+def _blocks(f, start=None, end=None, chunk_size=_chunk_size):
+    '''Binary file f, a chunk at a time, cut just after the last newline
+    of each so that lines don't straddle them. A range of a plain file,
+    from start to end, is read through a memory map; files read whole are
+    read as they come.
+    '''
+    if start is not None:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            while start < end:
+                stop = view.rfind(b'\n', start, min(start + chunk_size, end)) + 1
+                if not stop:
+                    stop = view.find(b'\n', start + chunk_size, end) + 1 or end
+                yield view[start:stop]
+                start = stop
+        return
+    rest = b''
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        end = chunk.rfind(b'\n') + 1
+        if end:
+            yield rest + chunk[:end]
+            rest = chunk[end:]
+        else:
+            rest += chunk
+    if rest:
+        yield rest
+
+
+def _lines(block):
+    '''The lines of a block, split in one go. Lines lose their newline, to
+    be put back when written.
+    '''
+    lines = block.split(b'\n')
+    if not lines[-1]:
+        lines.pop()
+    return lines
+
+
+def _count(block):
+    '''The number of lines in a block, without splitting it.
+    '''
+    return block.count(b'\n') + (not block.endswith(b'\n'))
+
+
+def _skip(rnd, log_q):
+    '''The number of lines to skip before the next one sampled, when each
+    is sampled with probability p = 1 - exp(log_q): geometrically
+    distributed.
+    '''
+    return int(math.log(1.0 - rnd.random()) / log_q)
+
+
+def bernoulli(blocks, rate, rnd):
+    '''The lines sampled, each with probability rate, a list of them per
+    block.
+    '''
+    if rate >= 1:
+        yield from map(_lines, blocks)
+        return
+    if rate <= 0:
+        return
+    log_q = math.log1p(-rate)
+    i = _skip(rnd, log_q)
+    for block in blocks:
+        lines = _lines(block)
+        sampled = []
+        while i < len(lines):
+            sampled.append(lines[i])
+            i += 1 + _skip(rnd, log_q)
+        i -= len(lines)
+        yield sampled
+
+
+def reservoir(blocks, k, rnd):
+    '''k lines sampled uniformly (or all of them, if there are no more
+    than k), as (key, position, line) in file order.
+    Each line gets a random key, and the lines with the k smallest keys
+    are kept. Once the reservoir is full, the next line to make it in is
+    found with a geometric skip, and its key drawn below the largest kept.
+    Skips soon get longer than blocks, which then only need counting.
+    '''
+    if k <= 0:
+        return []
+    kept = []  # heap of (-key, position, line)
+    position = 0
+    i = 0  # index of the next line to consider, in the block
+    last = 0  # lines in the last block split
+    for block in blocks:
+        if len(kept) == k and i >= last:
+            # likely to skip the whole block, so count its lines first:
+            # counting is cheaper than splitting
+            count = _count(block)
+            if i >= count:
+                position += count
+                i -= count
+                continue
+        lines = _lines(block)
+        last = len(lines)
+        while i < len(lines):
+            if len(kept) < k:
+                heapq.heappush(kept, (-rnd.random(), position + i, lines[i]))
+            else:
+                heapq.heapreplace(kept, (kept[0][0] * rnd.random(),
+                                         position + i, lines[i]))
+            i += 1
+            if len(kept) == k:
+                i += _skip(rnd, math.log1p(kept[0][0]))
+        position += len(lines)
+        i -= len(lines)
+    return sorted(((-key, position, line) for key, position, line in kept),
+                  key=lambda kept: kept[1])
+
+
+def update_index(path):
+    '''Brings the index of the (plain) file at path up to date, and returns
+    the number of lines indexed - complete ones, a last line without a
+    newline is left for when it's complete.
+    The index is an array of uint64, in native byte order so that it can
+    be mapped as is: a header, then the offsets of the start of each
+    line, then of the end of the last one. A log that has been appended
+    to only gets what was appended indexed; one that has been changed
+    otherwise (rotated, truncated, rewritten...) gets indexed anew. What
+    tells them apart is the header: the file's device and inode, and the
+    hashes of its first and last lines indexed, which should all be as
+    they were.
+    '''
+    idx = path + '.idx'
+    with open(path, 'rb') as log:
+        log_stat = os.fstat(log.fileno())
+        size = log_stat.st_size
+        identity = [_index_magic, log_stat.st_dev, log_stat.st_ino]
+        indexed = _indexed(idx)
+        if indexed is not None:
+            header, first_end, last_start, end = indexed
+            if header[:3] != array('Q', identity) or end > size \
+                    or header[3] != _line_hash(log, 0, first_end) \
+                    or header[4] != _line_hash(log, last_start, end):
+                indexed = None
+        if indexed is None:
+            with open(idx, 'wb') as f:
+                # the header's filled in once there are lines to hash
+                array('Q', identity + [0, 0, 0]).tofile(f)
+            first_end = last_start = end = 0
+        if indexed is None or end < size:
+            with open(idx, 'ab') as f:
+                for block in _blocks(log, end, size) if end < size else ():
+                    if not block.endswith(b'\n'):
+                        break  # the last line, not complete yet
+                    # the end of each line, from its length plus its newline
+                    offsets = array('Q', itertools.accumulate(
+                        map((1).__add__, map(len, _lines(block))),
+                        initial=end))
+                    offsets[1:].tofile(f)
+                    first_end = first_end or offsets[1]
+                    last_start, end = offsets[-2:]
+            with open(idx, 'r+b') as f:
+                array('Q', identity + [_line_hash(log, 0, first_end),
+                                       _line_hash(log, last_start, end)]
+                      ).tofile(f)
+    return os.path.getsize(idx) // 8 - _header - 1
+
+
+def _indexed(idx):
+    '''What the index at idx has to say: its header, the end of the first
+    line indexed, the start and end of the last one. None if there's no
+    index worth the name.
+    '''
+    try:
+        with open(idx, 'rb') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size < 8 * (_header + 1) or size % 8:
+                return None
+            f.seek(0)
+            header = array('Q', f.read(8 * _header))
+            first = array('Q', f.read(16))
+            f.seek(-16 if size >= 8 * (_header + 2) else -8, os.SEEK_END)
+            last = array('Q', f.read())
+    except OSError:
+        return None
+    if header[0] != _index_magic:
+        return None
+    return (header, first[1] if len(first) > 1 else 0,
+            last[0] if len(last) > 1 else 0, last[-1])
+
+
+def _line_hash(f, start, end):
+    '''Hash of the bytes of binary file f from start to end, as a uint64.
+    '''
+    f.seek(start)
+    return int.from_bytes(hashlib.blake2b(f.read(end - start),
+                                          digest_size=8).digest(), 'little')
+
+
+def _sample_indexed(paths, rate, k, seed, out):
+    '''Writes the sample of the lines of the files at paths to out, reading
+    only the lines sampled: all those drawn, each with probability rate,
+    with geometric skips, or k distinct line numbers drawn over all files.
+    '''
+    rnd = random.Random(seed)
+    counts = [update_index(path) for path in paths]
+    if k is None:
+        picks = [list(_bernoulli_numbers(n, rate, rnd)) for n in counts]
+    else:
+        drawn = sorted(rnd.sample(range(sum(counts)), min(k, sum(counts))))
+        picks = []
+        first = 0
+        for n in counts:
+            picks.append([number - first for number in drawn
+                          if first <= number < first + n])
+            first += n
+    for path, numbers in zip(paths, picks):
+        if not numbers:
+            continue
+        with open(path, 'rb') as log, open(path + '.idx', 'rb') as idx, \
+                mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ) as view, \
+                mmap.mmap(idx.fileno(), 0, access=mmap.ACCESS_READ) as offsets_map:
+            offsets = memoryview(offsets_map).cast('Q')
+            try:
+                out.write(b''.join(view[offsets[_header + number]:
+                                        offsets[_header + number + 1]]
+                                   for number in numbers))
+            finally:
+                offsets.release()
+
+
+def _bernoulli_numbers(n, rate, rnd):
+    '''The numbers of the lines sampled out of n, each with probability
+    rate.
+    '''
+    if rate >= 1:
+        yield from range(n)
+        return
+    if rate <= 0:
+        return
+    log_q = math.log1p(-rate)
+    i = _skip(rnd, log_q)
+    while i < n:
+        yield i
+        i += 1 + _skip(rnd, log_q)
+
 
 if __name__ == '__main__':
-    main()
+    import optparse
+    parser = optparse.OptionParser(usage='%prog [options] [log file...]')
+    parser.add_option('-r', '--rate', type='float', default=1 / 16,
+                      help='probability of a line being sampled '
+                           '[default: %default]')
+    parser.add_option('-k', '--sample-size', type='int', dest='k',
+                      help='sample exactly this many lines instead')
+    parser.add_option('-s', '--seed',
+                      help='seed, for the same sample every time')
+    parser.add_option('-j', '--jobs', type='int',
+                      help='processes to sample in [default: none]')
+    parser.add_option('-i', '--index', action='store_true', default=False,
+                      help='sample through an index of line offsets, '
+                           'log file.idx, updated first')
+    options, args = parser.parse_args()
+    if not 0 <= options.rate <= 1:
+        parser.error('the rate is a probability, between 0 and 1')
+    if options.index and any(path.endswith('.gz') or not os.path.isfile(path)
+                             for path in args or ['weblog.txt']):
+        parser.error('only plain files can be indexed')
+    main(*args, rate=options.rate, k=options.k, seed=options.seed,
+         jobs=options.jobs, index=options.index)
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+'''Exercises the lighten_up.py sampling: the same sample whatever the
+blocks, units and processes, the reservoir, and the index.
+
+(cc) CC BY-NC 4.0 2016-2020 Peter Sander
+'''
+
+import collections
+import gzip
+import io
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(sys.path[0], '../src'))
+import lighten_up
+
+
+def log_lines(count, seed=0):
+    rnd = random.Random(seed)
+    return [b'%06d %s' % (i, b'x' * rnd.randrange(60)) for i in range(count)]
+
+
+class SamplingTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.lines = log_lines(5000)
+        with open('log', 'wb') as f:
+            f.write(b'\n'.join(self.lines) + b'\n')
+        self.unit_size = lighten_up._unit_size
+
+    def tearDown(self):
+        lighten_up._unit_size = self.unit_size
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def sample(self, *paths, **options):
+        out = io.BytesIO()
+        lighten_up.main(*(paths or ['log']), seed='seed', out=out, **options)
+        return out.getvalue()
+
+    def test_bernoulli_whatever_the_blocks(self):
+        samples = set()
+        for chunk_size in (1, 100, 4096, 1 << 20):
+            with open('log', 'rb') as f:
+                samples.add(tuple(
+                    line for lines in lighten_up.bernoulli(
+                        lighten_up._blocks(f, chunk_size=chunk_size), 0.1,
+                        random.Random(1))
+                    for line in lines))
+        self.assertEqual(len(samples), 1)
+        sample, = samples
+        self.assertTrue(set(sample) <= set(self.lines))
+        self.assertEqual(list(sample), sorted(sample))
+        self.assertLess(abs(len(sample) - 500), 100)
+
+    def test_reservoir_whatever_the_blocks(self):
+        samples = set()
+        for chunk_size in (1, 100, 4096, 1 << 20):
+            with open('log', 'rb') as f:
+                samples.add(tuple(lighten_up.reservoir(
+                    lighten_up._blocks(f, chunk_size=chunk_size), 20,
+                    random.Random(1))))
+        self.assertEqual(len(samples), 1)
+        sample, = samples
+        self.assertEqual([position for _, position, _ in sample],
+                         sorted({position for _, position, _ in sample}))
+        self.assertEqual(len(sample), 20)
+        for _, position, line in sample:
+            self.assertEqual(line, self.lines[position])
+
+    def test_reservoir_all_when_fewer_than_k(self):
+        sample = lighten_up.reservoir([b'a\nb\n', b'c'], 5, random.Random(1))
+        self.assertEqual([line for _, _, line in sample], [b'a', b'b', b'c'])
+
+    def test_reservoir_uniform(self):
+        counts = collections.Counter()
+        blocks = [b'\n'.join(b'%d' % i for i in range(n, n + 5)) + b'\n'
+                  for n in range(0, 20, 5)]
+        for trial in range(4000):
+            counts.update(position for _, position, _ in lighten_up.reservoir(
+                blocks, 5, random.Random(trial)))
+        # each of the 20 lines is kept a quarter of the time
+        for position in range(20):
+            self.assertLess(abs(counts[position] - 1000), 150)
+
+    def test_same_sample_whatever_the_processes(self):
+        lighten_up._unit_size = 4096
+        self.assertGreater(len(list(lighten_up._units(['log']))), 10)
+        for options in ({'rate': 0.1}, {'k': 50}):
+            alone = self.sample(**options)
+            self.assertEqual(self.sample(jobs=3, **options), alone)
+            self.assertTrue(alone)
+
+    def test_units_cover_the_file(self):
+        lighten_up._unit_size = 1000
+        units = list(lighten_up._units(['log']))
+        self.assertEqual(units[0][1], 0)
+        self.assertEqual(units[-1][2], os.path.getsize('log'))
+        with open('log', 'rb') as f:
+            data = f.read()
+        for (_, _, end), (_, start, _) in zip(units, units[1:]):
+            self.assertEqual(end, start)
+            self.assertEqual(data[end - 1:end], b'\n')
+
+    def test_gzip_same_as_plain(self):
+        with open('log', 'rb') as f, gzip.open('log.gz', 'wb') as z:
+            z.write(f.read())
+        for options in ({'rate': 0.1}, {'k': 50}):
+            self.assertEqual(self.sample('log.gz', **options),
+                             self.sample(**options))
+
+    def test_k_over_many_files(self):
+        with open('other', 'wb') as f:
+            f.write(b'\n'.join(self.lines[:10]) + b'\n')
+        sample = self.sample('other', 'log', k=30).splitlines()
+        self.assertEqual(len(sample), 30)
+        self.assertTrue(set(sample) <= set(self.lines))
+
+
+class IndexTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def write(self, data, mode='wb'):
+        with open('log', mode) as f:
+            f.write(data)
+
+    def sample(self, **options):
+        out = io.BytesIO()
+        lighten_up.main('log', seed='seed', out=out, index=True, **options)
+        return out.getvalue()
+
+    def assertIndexed(self, lines):
+        '''Checks that the index is what one made from scratch would be,
+        and that the lines sampled one at a time are the lines of the log.
+        '''
+        with open('log.idx', 'rb') as f:
+            self.assertEqual(f.read(), self.fresh_index())
+        sampled = set()
+        for seed in range(100):
+            out = io.BytesIO()
+            lighten_up.main('log', k=1, seed=seed, out=out, index=True)
+            sampled.add(out.getvalue())
+        self.assertEqual(sampled, {line + b'\n' for line in lines})
+
+    def fresh_index(self):
+        '''The index of the log, made from scratch.
+        '''
+        os.rename('log.idx', 'log.idx.kept')
+        lighten_up.update_index('log')
+        with open('log.idx', 'rb') as f:
+            fresh = f.read()
+        os.replace('log.idx.kept', 'log.idx')
+        return fresh
+
+    def test_every_line(self):
+        self.write(b'aaaa\nbbbb\ncc')
+        self.assertEqual(lighten_up.update_index('log'), 2)
+        self.assertEqual(self.sample(rate=1), b'aaaa\nbbbb\n')
+
+    def test_appended_to(self):
+        self.write(b'aaaa\nbbbb\ncc')
+        lighten_up.update_index('log')
+        self.write(b'cc\ndddd\n', 'ab')
+        size = os.path.getsize('log.idx')
+        self.assertEqual(lighten_up.update_index('log'), 4)
+        # only the new line ends were added
+        self.assertEqual(os.path.getsize('log.idx'), size + 2 * 8)
+        self.assertIndexed([b'aaaa', b'bbbb', b'cccc', b'dddd'])
+
+    def test_rewritten(self):
+        self.write(b'aaaa\nbbbb\n')
+        lighten_up.update_index('log')
+        # in place, with a newline where the old end was
+        with open('log', 'r+b') as f:
+            f.write(b'12\n456789\nmore\n')
+        self.assertEqual(lighten_up.update_index('log'), 3)
+        self.assertIndexed([b'12', b'456789', b'more'])
+
+    def test_last_line_rewritten(self):
+        self.write(b'aaaa\nbbbb\n')
+        lighten_up.update_index('log')
+        self.write(b'aaaa\nbbxb\nmore\n')
+        self.assertEqual(lighten_up.update_index('log'), 3)
+        self.assertIndexed([b'aaaa', b'bbxb', b'more'])
+
+    def test_truncated(self):
+        self.write(b'aaaa\nbbbb\n')
+        lighten_up.update_index('log')
+        self.write(b'aaaa\n')
+        self.assertEqual(lighten_up.update_index('log'), 1)
+        self.assertIndexed([b'aaaa'])
+
+    def test_rotated(self):
+        self.write(b'aaaa\nbbbb\n')
+        lighten_up.update_index('log')
+        # same first line, and a newline where the old end was
+        with open('log.new', 'wb') as f:
+            f.write(b'aaaa\nb\nbb\ncccc\n')
+        os.replace('log.new', 'log')
+        self.assertEqual(lighten_up.update_index('log'), 4)
+        self.assertIndexed([b'aaaa', b'b', b'bb', b'cccc'])
+
+    def test_old_index_replaced(self):
+        self.write(b'aaaa\nbbbb\n')
+        with open('log.idx', 'wb') as f:
+            f.write(bytes(16))
+        self.assertEqual(lighten_up.update_index('log'), 2)
+        self.assertEqual(self.sample(rate=1), b'aaaa\nbbbb\n')
+
+    def test_k_lines(self):
+        lines = log_lines(1000)
+        self.write(b'\n'.join(lines) + b'\n')
+        sample = self.sample(k=25).splitlines()
+        self.assertEqual(len(sample), 25)
+        self.assertEqual(sample, sorted(set(sample)))
+        self.assertTrue(set(sample) <= set(lines))
+
+
+if __name__ == '__main__':
+    unittest.main()